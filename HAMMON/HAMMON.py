@@ -11,18 +11,2158 @@ from tkinter import ttk
 from tkinter import filedialog, messagebox, Scrollbar, simpledialog, colorchooser
 import pandas as pd
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
-from matplotlib.patches import FancyArrowPatch
+from matplotlib.collections import LineCollection, PathCollection
+from matplotlib.path import Path
+from matplotlib.textpath import TextPath, text_to_path
+from matplotlib.font_manager import FontProperties, findfont, get_font
+from matplotlib import transforms
+from matplotlib.colors import to_rgba_array
 from matplotlib.lines import Line2D
 from matplotlib import colormaps as cmaps
-from collections import deque, defaultdict
 import re
 import unicodedata
 import time
 from tkinter import PhotoImage
 import os
 import sys
+import functools
+import gc
+import itertools
+import json
+import sqlite3
+import threading
+import queue
+
+class ModelChanges:
+    """Registro de lo que ha cambiado en el modelo desde la última actualización de la interfaz."""
+
+    def __init__(self):
+        # Unidades añadidas, eliminadas o con algún atributo modificado
+        self.units = set()
+        # Columnas de atributos modificadas
+        self.columns = set()
+        self.added = set()
+        self.removed = set()
+        # Código antiguo -> código nuevo
+        self.renamed = {}
+        # Aristas del modelo tocadas, por columna de relación
+        self.edges = {"Hijos": set(), "Equivalencias": set(), "Hecho": set()}
+
+    def __bool__(self):
+        return bool(self.units or self.removed or self.renamed or any(self.edges.values()))
+
+class EdgeTabIndex:
+    """Índice de las aristas que muestra una pestaña (relaciones, equivalencias o hechos).
+
+    Cada arista mostrada se identifica por su par no ordenado (ver 'GraphApp.edge_key') y guarda
+    su fila del Treeview y las aristas del modelo que la originan, de modo que añadir o quitar
+    una arista del modelo solo toca su fila.
+    """
+
+    def __init__(self):
+        # Aristas mostradas en el Treeview
+        self.keys = set()
+        # Arista mostrada -> fila del Treeview
+        self.rows = {}
+        # Arista mostrada (visible o no) -> aristas del modelo que la originan
+        self.sources = {}
+        # Arista del modelo -> arista mostrada
+        self.origin = {}
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def clear(self):
+        self.keys.clear()
+        self.rows.clear()
+        self.sources.clear()
+        self.origin.clear()
+
+class StratigraphicModel:
+    """Modelo canónico de la matriz de Harris.
+
+    Las unidades y sus relaciones, equivalencias y hechos se guardan en
+    diccionarios indexados por código, de modo que cada consulta es un acceso
+    directo en lugar de un recorrido de la BD. La BD (DataFrame) es solo una
+    vista que se materializa para exportar y para la pestaña de unidades.
+    """
+
+    # Columnas de la BD que se guardan como adyacencias
+    RELATION_COLUMNS = ("Hijos", "Equivalencias", "Hecho")
+
+    # Contador global: dos modelos con la misma versión tienen el mismo contenido
+    _versions = itertools.count(1)
+
+    def __init__(self, columns):
+        # Columnas de la BD, en orden (incluye 'Codigo')
+        self.columns = list(columns)
+        # Códigos en el orden de las filas y su índice código -> fila
+        self.order = []
+        self.row_index = {}
+        # Nombre -> código
+        self.codes_by_name = {}
+        # Código -> {columna: valor} (sin 'Codigo' ni columnas de relación)
+        self.units = {}
+        # Adyacencias. Se usan dict como conjuntos ordenados para conservar el orden del CSV
+        self.children = {}
+        self.parents = {}
+        self.equivalents = {}
+        self.fact_members = {}
+        self.member_of = {}
+        self.version = next(self._versions)
+        # Versión de la pertenencia a hechos: solo cambia al modificar 'Hecho' o renombrar
+        self.facts_version = self.version
+        # Versión de la estructura (unidades y aristas): no cambia al editar atributos
+        self.structure_version = self.version
+        # Vista en arrays CSR de las adyacencias (ver 'GraphArrays') y versión de la estructura con que se creó
+        self._arrays = None
+        self._arrays_version = None
+        # Orden topológico para detectar ciclos (ver 'TopologicalOrder'); se crea al consultarlo
+        self._topology = None
+        # Índice de alcanzabilidad (ver 'ReachabilityIndex'); se crea al consultarlo
+        self._reachability = None
+        # Cambios pendientes de reflejar en la interfaz
+        self.changes = ModelChanges()
+        # Edición del historial en curso (ver 'EditHistory'); None si no se registran las operaciones
+        self.recorder = None
+        # Diario de autoguardado (ver 'EditJournal'); None si no se escriben las operaciones
+        self.journal = None
+
+    def __contains__(self, code):
+        return code in self.units
+
+    def __len__(self):
+        return len(self.order)
+
+    def _touch(self, facts=False, structure=True):
+        self.version = next(self._versions)
+        if facts:
+            self.facts_version = self.version
+        if structure:
+            self.structure_version = self.version
+
+    def take_changes(self):
+        """Devuelve los cambios acumulados y empieza un registro nuevo."""
+        changes, self.changes = self.changes, ModelChanges()
+        return changes
+
+    def _record(self, forward, inverse):
+        """Anota una operación y la que la deshace, como (método, argumentos)."""
+        if self.recorder is not None:
+            self.recorder.add(forward, inverse)
+        if self.journal is not None:
+            self.journal.write(forward)
+
+    def _notify(self, event, *args):
+        """Lleva un cambio de la estructura a los índices derivados que estén al día."""
+        for index in (self._topology, self._reachability):
+            if index is not None and index.valid:
+                getattr(index, event)(*args)
+
+    def apply(self, operation):
+        method, args = operation
+        getattr(self, method)(*args)
+
+    @staticmethod
+    def _insert(adjacency, code, key, position):
+        """Inserta 'key' en la posición dada del conjunto ordenado adjacency[code]."""
+        items = list(adjacency[code])
+        items.insert(position, key)
+        adjacency[code] = dict.fromkeys(items)
+
+    @staticmethod
+    def _position(adjacency, code, key):
+        """Posición de 'key' en adjacency[code], o None si no está."""
+        if key not in adjacency[code]:
+            return None
+        return list(adjacency[code]).index(key)
+
+    def _adjacencies(self):
+        return (self.children, self.parents, self.equivalents, self.fact_members, self.member_of)
+
+    def attribute_columns(self):
+        return [col for col in self.columns if col != "Codigo" and col not in self.RELATION_COLUMNS]
+
+    def relation_adjacency(self, column):
+        """Devuelve la adyacencia asociada a una columna de relación de la BD."""
+        return {"Hijos": self.children, "Equivalencias": self.equivalents, "Hecho": self.fact_members}[column]
+
+    # Consultas
+
+    def arrays(self):
+        """Adyacencias como arrays CSR sobre identificadores enteros; se rehacen solo si cambió la estructura."""
+        if self._arrays is None or self._arrays_version != self.structure_version:
+            self._arrays = GraphArrays(self)
+            self._arrays_version = self.structure_version
+        return self._arrays
+
+    def topology(self):
+        """Orden topológico incremental; si no era válido se rehace cuando cambia la estructura."""
+        topology = self._topology
+        if topology is None or (not topology.valid and topology.version != self.structure_version):
+            self._topology = TopologicalOrder(self)
+        return self._topology
+
+    def reachability(self):
+        """Índice de alcanzabilidad al día, o None si el modelo tiene un ciclo o demasiadas unidades.
+
+        Se crea al pedirlo y se rehace si algún cambio lo invalidó.
+        """
+        index = self._reachability
+        if index is not None and index.valid:
+            return index
+        self._reachability = None
+        if len(self.order) > ReachabilityIndex.MAX_UNITS:
+            return None
+        topology = self.topology()
+        if topology.valid:
+            self._reachability = ReachabilityIndex(self, topology)
+        return self._reachability
+
+    def get(self, code, column):
+        return self.units[code][column]
+
+    def codes_of_type(self, types):
+        return [code for code in self.order if self.units[code]["Tipo"] in types]
+
+    def phases(self):
+        """Fases distintas en el orden en que aparecen (como BD['Fase'].unique())."""
+        return list(dict.fromkeys(self.units[code]["Fase"] for code in self.order))
+
+    def row(self, code):
+        """Fila de la BD de una unidad, sin materializar la BD completa."""
+        row = {}
+        for col in self.columns:
+            if col == "Codigo":
+                row[col] = code
+            elif col in self.RELATION_COLUMNS:
+                row[col] = ",".join(self.relation_adjacency(col)[code])
+            else:
+                row[col] = self.units[code][col]
+        return row
+
+    # Modificación de unidades
+
+    def add_unit(self, code, attributes, position=None):
+        if position is None or position >= len(self.order):
+            self.row_index[code] = len(self.order)
+            self.order.append(code)
+        else:
+            self.order.insert(position, code)
+            self._reindex(position)
+        self.units[code] = {col: attributes.get(col, "") for col in self.attribute_columns()}
+        self._record(("add_unit", (code, dict(self.units[code]), position)), ("remove_unit", (code,)))
+        self.codes_by_name[self.units[code]["Nombre"]] = code
+        for adjacency in self._adjacencies():
+            adjacency[code] = {}
+        self.changes.units.add(code)
+        self.changes.added.add(code)
+        self.changes.columns.update(self.units[code])
+        self._notify("unit_added", code)
+        self._touch()
+
+    def set_attribute(self, code, column, value):
+        if self.units[code][column] == value:
+            return
+        if column == "Nombre":
+            self.codes_by_name.pop(self.units[code]["Nombre"], None)
+            self.codes_by_name[value] = code
+        self._record(("set_attribute", (code, column, value)), ("set_attribute", (code, column, self.units[code][column])))
+        self.units[code][column] = value
+        self.changes.units.add(code)
+        self.changes.columns.add(column)
+        self._touch(structure=False)
+
+    def detach_unit(self, code):
+        """Elimina todas las relaciones, equivalencias y hechos en los que participa la unidad."""
+        for son in list(self.children[code]):
+            self.remove_child(code, son)
+        for parent in list(self.parents[code]):
+            self.remove_child(parent, code)
+        for equi in list(self.equivalents[code]):
+            self.remove_equivalence(code, equi)
+        for member in list(self.fact_members[code]):
+            self.remove_member(code, member)
+        for fact in list(self.member_of[code]):
+            self.remove_member(fact, code)
+
+    def remove_unit(self, code):
+        self.remove_units([code])
+
+    def remove_units(self, codes):
+        """Elimina varias unidades. El índice de filas se corrige una sola vez, desde la primera fila quitada."""
+        # De la última fila a la primera: así la fila anotada para deshacer es la original de cada unidad
+        positions = sorted(((self.row_index[code], code) for code in dict.fromkeys(codes)), reverse=True)
+        for position, code in positions:
+            self.detach_unit(code)
+            self._record(("remove_unit", (code,)), ("add_unit", (code, dict(self.units[code]), position)))
+            for adjacency in self._adjacencies():
+                del adjacency[code]
+            del self.codes_by_name[self.units[code]["Nombre"]]
+            del self.units[code]
+            del self.order[position]
+            del self.row_index[code]
+            self.changes.units.discard(code)
+            self.changes.added.discard(code)
+            self.changes.removed.add(code)
+            self._notify("unit_removed", code)
+        if positions:
+            self._reindex(positions[-1][0])
+            self._touch()
+
+    def _reindex(self, start):
+        """Corrige el índice código -> fila desde la fila 'start'; las anteriores no se han movido."""
+        row_index = self.row_index
+        order = self.order
+        for position in range(start, len(order)):
+            row_index[order[position]] = position
+
+    def rename_unit(self, old_code, new_code):
+        """Cambia el código de una unidad manteniendo su posición en todas las listas."""
+        if old_code == new_code:
+            return
+        # Las aristas con el código antiguo desaparecen y aparecen con el nuevo
+        self._record_incident_edges(old_code)
+        position = self.row_index.pop(old_code)
+        self.order[position] = new_code
+        self.row_index[new_code] = position
+        self.units[new_code] = self.units.pop(old_code)
+        for adjacency in self._adjacencies():
+            adjacency[new_code] = adjacency.pop(old_code)
+        self.codes_by_name[self.units[new_code]["Nombre"]] = new_code
+
+        # Sustituir la referencia en los vecinos, conservando el orden
+        def replace_key(d):
+            return {new_code if k == old_code else k: v for k, v in d.items()}
+
+        for son in self.children[new_code]:
+            self.parents[son] = replace_key(self.parents[son])
+        for parent in self.parents[new_code]:
+            self.children[parent] = replace_key(self.children[parent])
+        for equi in self.equivalents[new_code]:
+            self.equivalents[equi] = replace_key(self.equivalents[equi])
+        for member in self.fact_members[new_code]:
+            self.member_of[member] = replace_key(self.member_of[member])
+        for fact in self.member_of[new_code]:
+            self.fact_members[fact] = replace_key(self.fact_members[fact])
+        self._record_incident_edges(new_code)
+        self.changes.units.discard(old_code)
+        self.changes.units.add(new_code)
+        self.changes.renamed[old_code] = new_code
+        self._record(("rename_unit", (old_code, new_code)), ("rename_unit", (new_code, old_code)))
+        self._notify("unit_renamed", old_code, new_code)
+        self._touch(facts=True)
+
+    def _record_incident_edges(self, code):
+        edges = self.changes.edges
+        edges["Hijos"].update((code, son) for son in self.children[code])
+        edges["Hijos"].update((parent, code) for parent in self.parents[code])
+        edges["Equivalencias"].update((code, equi) for equi in self.equivalents[code])
+        edges["Equivalencias"].update((equi, code) for equi in self.equivalents[code])
+        edges["Hecho"].update((code, member) for member in self.fact_members[code])
+        edges["Hecho"].update((fact, code) for fact in self.member_of[code])
+
+    # Modificación de relaciones
+    # Al quitar una arista se anota su posición en cada lado, para que deshacer la deje donde estaba
+
+    def add_child(self, parent, son, positions=None):
+        if son in self.children[parent]:
+            return
+        if positions is None:
+            self.children[parent][son] = None
+            self.parents[son][parent] = None
+        else:
+            self._insert(self.children, parent, son, positions[0])
+            self._insert(self.parents, son, parent, positions[1])
+        self._record(("add_child", (parent, son, positions)), ("remove_child", (parent, son)))
+        self.changes.edges["Hijos"].add((parent, son))
+        self._notify("child_added", parent, son)
+        self._touch()
+
+    def remove_child(self, parent, son):
+        if son not in self.children[parent]:
+            return
+        positions = (self._position(self.children, parent, son), self._position(self.parents, son, parent))
+        self.children[parent].pop(son, None)
+        self.parents[son].pop(parent, None)
+        self._record(("remove_child", (parent, son)), ("add_child", (parent, son, positions)))
+        self.changes.edges["Hijos"].add((parent, son))
+        self._notify("child_removed", parent, son)
+        self._touch()
+
+    def add_equivalence(self, node_A, node_B, positions=None):
+        # Desde el CSV una equivalencia puede estar solo en uno de sus lados: una posición None es un lado ausente
+        if positions is None:
+            if node_B in self.equivalents[node_A] and node_A in self.equivalents[node_B]:
+                return
+            self.equivalents[node_A][node_B] = None
+            self.equivalents[node_B][node_A] = None
+        else:
+            if positions[0] is not None:
+                self._insert(self.equivalents, node_A, node_B, positions[0])
+            if positions[1] is not None:
+                self._insert(self.equivalents, node_B, node_A, positions[1])
+        self._record(("add_equivalence", (node_A, node_B, positions)), ("remove_equivalence", (node_A, node_B)))
+        self.changes.edges["Equivalencias"].update(((node_A, node_B), (node_B, node_A)))
+        self._notify("equivalence_added", node_A, node_B)
+        self._touch()
+
+    def remove_equivalence(self, node_A, node_B):
+        positions = (self._position(self.equivalents, node_A, node_B), self._position(self.equivalents, node_B, node_A))
+        if positions == (None, None):
+            return
+        self.equivalents[node_A].pop(node_B, None)
+        self.equivalents[node_B].pop(node_A, None)
+        self._record(("remove_equivalence", (node_A, node_B)), ("add_equivalence", (node_A, node_B, positions)))
+        self.changes.edges["Equivalencias"].update(((node_A, node_B), (node_B, node_A)))
+        self._notify("equivalence_removed", node_A, node_B)
+        self._touch()
+
+    def add_member(self, fact, member, positions=None):
+        if member in self.fact_members[fact]:
+            return
+        if positions is None:
+            self.fact_members[fact][member] = None
+            self.member_of[member][fact] = None
+        else:
+            self._insert(self.fact_members, fact, member, positions[0])
+            self._insert(self.member_of, member, fact, positions[1])
+        self._record(("add_member", (fact, member, positions)), ("remove_member", (fact, member)))
+        self.changes.edges["Hecho"].add((fact, member))
+        self._touch(facts=True)
+
+    def remove_member(self, fact, member):
+        if member not in self.fact_members[fact]:
+            return
+        positions = (self._position(self.fact_members, fact, member), self._position(self.member_of, member, fact))
+        self.fact_members[fact].pop(member, None)
+        self.member_of[member].pop(fact, None)
+        self._record(("remove_member", (fact, member)), ("add_member", (fact, member, positions)))
+        self.changes.edges["Hecho"].add((fact, member))
+        self._touch(facts=True)
+
+    # Conversión
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """Crea el modelo a partir de una tabla con 'Codigo' y relaciones indicadas por 'Nombre'."""
+        model = cls(df.columns)
+        codes = df["Codigo"].tolist()
+
+        # Unidades: todas las filas de una vez
+        model.order = codes
+        model.row_index = {code: i for i, code in enumerate(codes)}
+        attribute_columns = model.attribute_columns()
+        values = zip(*(df[col].tolist() for col in attribute_columns))
+        model.units = {code: dict(zip(attribute_columns, row)) for code, row in zip(codes, values)}
+        model.codes_by_name = {attributes["Nombre"]: code for code, attributes in model.units.items()}
+        for adjacency in model._adjacencies():
+            adjacency.update((code, {}) for code in codes)
+
+        # Relaciones: se separan todas las listas de una columna y se traducen con un único diccionario
+        for col in cls.RELATION_COLUMNS:
+            if col not in df.columns or df.empty:
+                continue
+            for code, value_code in model._explode_relation(df, col):
+                if col == "Hijos":
+                    model.children[code][value_code] = None
+                    model.parents[value_code][code] = None
+                elif col == "Equivalencias":
+                    # Cada fila aporta su lado de la equivalencia
+                    model.equivalents[code][value_code] = None
+                else:
+                    model.fact_members[code][value_code] = None
+                    model.member_of[value_code][code] = None
+
+        return model
+
+    def _explode_relation(self, df, col):
+        """Pares (código, código relacionado) de una columna de relación, en el orden del CSV."""
+        values = df[col].fillna("").astype(str)
+        listed = values != ""
+        edges = pd.DataFrame({"code": df["Codigo"][listed], "value": values[listed].str.split(",")})
+        edges = edges.explode("value")
+        edges["value"] = edges["value"].str.strip()
+        edges = edges[edges["value"] != ""]
+        value_codes = edges["value"].map(self.codes_by_name)
+        unknown = value_codes.isna()
+        if unknown.any():
+            raise KeyError(edges["value"][unknown].iloc[0])
+        return zip(edges["code"], value_codes)
+
+    def copy(self):
+        other = StratigraphicModel(self.columns)
+        other.order = list(self.order)
+        other.row_index = dict(self.row_index)
+        other.codes_by_name = dict(self.codes_by_name)
+        other.units = {code: dict(attributes) for code, attributes in self.units.items()}
+        other.children = {code: dict(v) for code, v in self.children.items()}
+        other.parents = {code: dict(v) for code, v in self.parents.items()}
+        other.equivalents = {code: dict(v) for code, v in self.equivalents.items()}
+        other.fact_members = {code: dict(v) for code, v in self.fact_members.items()}
+        other.member_of = {code: dict(v) for code, v in self.member_of.items()}
+        other.version = self.version
+        other.facts_version = self.facts_version
+        other.structure_version = self.structure_version
+        return other
+
+    def to_dataframe(self, codes=None, use_names=False):
+        """Materializa la BD. Con 'use_names' las relaciones se escriben con el 'Nombre' de las unidades."""
+        codes = self.order if codes is None else codes
+        to_text = (lambda c: self.units[c]["Nombre"]) if use_names else str
+        data = {}
+        for col in self.columns:
+            if col == "Codigo":
+                data[col] = list(codes)
+            elif col in self.RELATION_COLUMNS:
+                adjacency = self.relation_adjacency(col)
+                data[col] = [",".join(map(to_text, adjacency[code])) for code in codes]
+            else:
+                data[col] = [self.units[code][col] for code in codes]
+        return pd.DataFrame(data, columns=self.columns)
+
+class GraphArrays:
+    """Adyacencias del modelo como arrays CSR sobre identificadores enteros densos.
+
+    El identificador de cada unidad es su fila en el modelo. Los vecinos de la unidad i en una
+    adyacencia (indptr, indices) son indices[indptr[i]:indptr[i + 1]], en el orden del modelo.
+    Los recorridos avanzan por frentes completos con operaciones de numpy en vez de nodo a nodo.
+    """
+
+    # Adyacencias del modelo que se convierten
+    ADJACENCIES = ("children", "parents", "equivalents", "fact_members", "member_of")
+    # Columnas de bits por pasada de la reducción transitiva: acota su memoria a n * 8192 / 8 bytes
+    REDUCTION_BLOCK_BITS = 8192
+
+    def __init__(self, model):
+        # Identificador -> código y código -> identificador
+        self.codes = list(model.order)
+        self.ids = dict(model.row_index)
+        self.n = len(self.codes)
+        ids = self.ids
+        for name in self.ADJACENCIES:
+            adjacency = getattr(model, name)
+            counts = np.fromiter((len(adjacency[code]) for code in self.codes), dtype=np.int64, count=self.n)
+            indptr = np.zeros(self.n + 1, dtype=np.int64)
+            np.cumsum(counts, out=indptr[1:])
+            indices = np.fromiter((ids[other] for code in self.codes for other in adjacency[code]),
+                                  dtype=np.int32, count=int(indptr[-1]))
+            setattr(self, name, (indptr, indices))
+
+    @staticmethod
+    def from_edges(n, src, dst):
+        """CSR (indptr, indices) de las aristas src[k] -> dst[k] entre los nodos 0..n-1."""
+        order = np.argsort(src, kind="stable")
+        indptr = np.searchsorted(src[order], np.arange(n + 1))
+        return indptr, dst[order]
+
+    @staticmethod
+    def neighbors(csr, nodes):
+        """Vecinos de todos los nodos indicados, concatenados (puede haber repetidos)."""
+        indptr, indices = csr
+        starts = indptr[nodes]
+        counts = indptr[nodes + 1] - starts
+        edge_ids = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return indices[edge_ids]
+
+    @staticmethod
+    def topological_order(n, src, dst):
+        """Nodos 0..n-1 en orden topológico para las aristas src[k] -> dst[k], o None si hay un ciclo."""
+        # Kahn nodo a nodo: un frente por generación sería lento en cadenas largas
+        indptr, indices = GraphArrays.from_edges(n, src, dst)
+        indptr, indices = indptr.tolist(), indices.tolist()
+        indegree = np.bincount(dst, minlength=n).tolist()
+        ranked = [i for i, degree in enumerate(indegree) if degree == 0]
+        for node in ranked:
+            for other in indices[indptr[node]:indptr[node + 1]]:
+                indegree[other] -= 1
+                if indegree[other] == 0:
+                    ranked.append(other)
+        return ranked if len(ranked) == n else None
+
+    @staticmethod
+    def transitive_reduction(n, src, dst):
+        """Máscara de las aristas src[k] -> dst[k] que quedan en la reducción transitiva, o None si hay un ciclo.
+
+        Se recorre el DAG en orden topológico inverso guardando los descendientes de cada nodo como una
+        fila de bits: la arista u -> v sobra si v ya desciende de otro hijo de u. Las columnas se
+        procesan por bloques para que la memoria no crezca con n².
+        """
+        order = GraphArrays.topological_order(n, src, dst)
+        if order is None:
+            return None
+        keep = np.ones(len(src), dtype=bool)
+        # Aristas en orden CSR y su posición en src/dst
+        edge_ids = np.argsort(src, kind="stable")
+        indptr, indices = GraphArrays.from_edges(n, src, dst)
+        order = [node for node in reversed(order) if indptr[node] < indptr[node + 1]]
+        for first in range(0, n, GraphArrays.REDUCTION_BLOCK_BITS):
+            width = min(GraphArrays.REDUCTION_BLOCK_BITS, n - first)
+            # Descendientes de cada nodo entre las columnas first..first + width
+            below = np.zeros((n, (width + 7) // 8), dtype=np.uint8)
+            # Nodos con algún descendiente en el bloque; los demás no necesitan calcular su fila
+            reaches = np.zeros(n, dtype=bool)
+            for node in order:
+                start, end = indptr[node], indptr[node + 1]
+                sons = indices[start:end]
+                inside = np.flatnonzero((sons >= first) & (sons < first + width))
+                if not inside.size and not reaches[sons].any():
+                    continue
+                reaches[node] = True
+                implied = np.bitwise_or.reduce(below[sons], axis=0)
+                local = sons[inside] - first
+                redundant = (implied[local >> 3] & (128 >> (local & 7))) != 0
+                keep[edge_ids[start + inside[redundant]]] = False
+                np.bitwise_or.at(implied, local >> 3, (128 >> (local & 7)).astype(np.uint8))
+                below[node] = implied
+        return keep
+
+    @functools.cached_property
+    def redundant_children(self):
+        """Relaciones 'Hijos' que se deducen de otras, como pares (padre, hijo); None si hay un ciclo."""
+        src, dst = self.edges("children")
+        keep = self.transitive_reduction(self.n, src, dst)
+        if keep is None:
+            return None
+        return list(zip(self.to_codes(src[~keep]), self.to_codes(dst[~keep])))
+
+    def edges(self, name):
+        """Aristas de una adyacencia como arrays (origen, destino)."""
+        indptr, indices = getattr(self, name)
+        return np.repeat(np.arange(self.n, dtype=np.int32), np.diff(indptr)), indices
+
+    def to_ids(self, codes):
+        return np.fromiter((self.ids[code] for code in codes), dtype=np.int64)
+
+    def to_codes(self, ids):
+        return [self.codes[i] for i in ids.tolist()]
+
+    def reachable(self, starts, step, target=None):
+        """Máscara de los nodos alcanzables desde 'starts' (incluidos) aplicando 'step' a cada frente.
+
+        Con 'target' el recorrido se detiene en cuanto se alcanza ese nodo.
+        """
+        visited = np.zeros(self.n, dtype=bool)
+        frontier = np.unique(starts)
+        while frontier.size:
+            visited[frontier] = True
+            if target is not None and visited[target]:
+                break
+            successors = step(frontier)
+            frontier = np.unique(successors[~visited[successors]])
+        return visited
+
+    def closure(self, starts, name):
+        """Máscara de los nodos alcanzables desde 'starts' siguiendo una adyacencia."""
+        csr = getattr(self, name)
+        return self.reachable(starts, lambda frontier: self.neighbors(csr, frontier))
+
+    def reaches_through_equivalents(self, start, target):
+        """Indica si 'target' es descendiente de 'start' contando las equivalencias de cada hijo."""
+        starts = np.concatenate(([start], self.neighbors(self.equivalents, np.array([start]))))
+
+        def step(frontier):
+            sons = self.neighbors(self.children, frontier)
+            return np.concatenate((sons, self.neighbors(self.equivalents, sons)))
+
+        return bool(self.reachable(starts, step, target)[target])
+
+class TopologicalOrder:
+    """Orden topológico del modelo mantenido de forma incremental (Pearce–Kelly) para detectar ciclos.
+
+    Se ordena el grafo que recorre la búsqueda de ciclos: cada unidad apunta a sus hijos y a los
+    equivalentes de sus hijos. Al añadir una arista solo se reordenan las unidades cuya posición
+    está entre las de sus extremos, y una consulta solo visita las unidades anteriores al origen.
+    Si el modelo ya tiene un ciclo no hay orden válido y las consultas devuelven None.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        # Versión de la estructura del modelo con que se construyó
+        self.version = model.structure_version
+        # Código -> posición; las aristas van siempre de una posición menor a una mayor
+        self.position = {}
+        # Equivalencias en ambos sentidos (en el CSV pueden estar solo en uno de sus lados)
+        self.equivalents = {code: set() for code in model.order}
+        for code, equivalents in model.equivalents.items():
+            for equi in equivalents:
+                self.equivalents[code].add(equi)
+                self.equivalents[equi].add(code)
+        self.valid = True
+
+        arrays = model.arrays()
+        src, dst = arrays.edges("children")
+        # Aristas de cada padre a los equivalentes de sus hijos
+        equi_src, equi_dst = arrays.edges("equivalents")
+        equivalents = GraphArrays.from_edges(arrays.n, np.concatenate((equi_src, equi_dst)),
+                                             np.concatenate((equi_dst, equi_src)))
+        counts = np.diff(equivalents[0])[dst]
+        src = np.concatenate((src, np.repeat(src, counts)))
+        dst = np.concatenate((dst, GraphArrays.neighbors(equivalents, dst)))
+
+        ranked = GraphArrays.topological_order(arrays.n, src, dst)
+        if ranked is None:
+            self.valid = False
+            return
+        self.position = {arrays.codes[node]: rank for rank, node in enumerate(ranked)}
+        self.next_position = arrays.n
+
+    def _successors(self, code):
+        for son in self.model.children[code]:
+            yield son
+            yield from self.equivalents[son]
+
+    def _predecessors(self, code):
+        yield from self.model.parents[code]
+        for equi in self.equivalents[code]:
+            yield from self.model.parents[equi]
+
+    def _region(self, start, neighbors, lower, upper, stop=None):
+        """Unidades alcanzables desde 'start' con posición entre 'lower' y 'upper' (excluidas).
+
+        Devuelve None si se alcanza 'stop'.
+        """
+        position = self.position
+        region = {start}
+        stack = [start]
+        while stack:
+            for other in neighbors(stack.pop()):
+                if other == stop:
+                    return None
+                if other not in region and lower < position[other] < upper:
+                    region.add(other)
+                    stack.append(other)
+        return region
+
+    def _insert(self, origin, destination):
+        """Reordena lo necesario para la arista origin -> destination."""
+        position = self.position
+        lower, upper = position[destination], position[origin]
+        if lower > upper:
+            return
+        forward = None if origin == destination else self._region(destination, self._successors, lower, upper, origin)
+        if forward is None:
+            self.valid = False
+            return
+        backward = self._region(origin, self._predecessors, lower, upper)
+        # Las posiciones de la región se reparten: primero lo que llega al origen, después lo que sale del destino
+        forward = sorted(forward, key=position.get)
+        backward = sorted(backward, key=position.get)
+        slots = sorted(position[code] for code in forward + backward)
+        for code, slot in zip(backward + forward, slots):
+            position[code] = slot
+
+    # Cambios del modelo
+
+    def unit_added(self, code):
+        self.position[code] = self.next_position
+        self.next_position += 1
+        self.equivalents[code] = set()
+
+    def unit_removed(self, code):
+        del self.position[code]
+        del self.equivalents[code]
+
+    def unit_renamed(self, old_code, new_code):
+        self.position[new_code] = self.position.pop(old_code)
+        self.equivalents[new_code] = self.equivalents.pop(old_code)
+        for equi in self.equivalents[new_code]:
+            self.equivalents[equi].discard(old_code)
+            self.equivalents[equi].add(new_code)
+
+    def child_added(self, parent, son):
+        self._insert(parent, son)
+        for equi in list(self.equivalents[son]):
+            if self.valid:
+                self._insert(parent, equi)
+
+    def equivalence_added(self, node_A, node_B):
+        self.equivalents[node_A].add(node_B)
+        self.equivalents[node_B].add(node_A)
+        for node, equi in ((node_A, node_B), (node_B, node_A)):
+            for parent in list(self.model.parents[node]):
+                if self.valid:
+                    self._insert(parent, equi)
+
+    def child_removed(self, parent, son):
+        # Quitar una arista no desordena nada
+        pass
+
+    def equivalence_removed(self, node_A, node_B):
+        self.equivalents[node_A].discard(node_B)
+        self.equivalents[node_B].discard(node_A)
+
+    # Consultas
+
+    def creates_cycle(self, origin, destination):
+        """Indica si añadir destination como hijo de origin crearía un ciclo; None si no se puede decidir.
+
+        Equivale a 'GraphApp.search_cycle', pero solo visita unidades con posición anterior al origen.
+        """
+        if not self.valid or origin not in self.position or destination not in self.position:
+            return None
+        position = self.position
+        upper = position[origin]
+        model = self.model
+        stack = [destination, *model.equivalents[destination]]
+        visited = set()
+        while stack:
+            current = stack.pop()
+            if current == origin:
+                return True
+            if current in visited or position[current] > upper:
+                continue
+            visited.add(current)
+            for son in model.children[current]:
+                stack.append(son)
+                stack.extend(model.equivalents[son])
+        return False
+
+class ReachabilityIndex:
+    """Cierre transitivo del modelo como filas de bits empaquetadas en un array de numpy.
+
+    La fila de cada unidad marca la propia unidad y todas las que están por debajo de ella: sus hijos
+    y los equivalentes de sus hijos, recursivamente (el grafo de 'TopologicalOrder'). Se construye en
+    orden topológico inverso haciendo el OR de las filas de los sucesores, así que preguntar si una
+    unidad está por encima de otra es leer un bit. Ocupa n²/8 bytes, por eso tiene un límite de unidades.
+    Añadir relaciones o equivalencias actualiza las filas afectadas; los demás cambios lo invalidan.
+    """
+
+    # Máximo de unidades para crear el índice (20000 unidades ocupan unos 50 MB)
+    MAX_UNITS = 20000
+
+    def __init__(self, model, topology):
+        self.model = model
+        arrays = model.arrays()
+        self.codes = arrays.codes
+        self.ids = dict(arrays.ids)
+        self.n = arrays.n
+        self.valid = True
+        self.rows = np.zeros((self.n, (self.n + 7) // 8), dtype=np.uint8)
+
+        # Sucesores: hijos y equivalentes de los hijos
+        src, dst = arrays.edges("children")
+        counts = np.diff(arrays.equivalents[0])[dst]
+        src = np.concatenate((src, np.repeat(src, counts)))
+        dst = np.concatenate((dst, GraphArrays.neighbors(arrays.equivalents, dst)))
+        indptr, indices = GraphArrays.from_edges(self.n, src, dst)
+
+        position = topology.position
+        rows = self.rows
+        for node in sorted(range(self.n), key=lambda i: position[self.codes[i]], reverse=True):
+            successors = indices[indptr[node]:indptr[node + 1]]
+            if successors.size:
+                np.bitwise_or.reduce(rows[successors], axis=0, out=rows[node])
+            rows[node, node >> 3] |= 128 >> (node & 7)
+
+    def _column(self, node):
+        """Máscara de las unidades cuya fila contiene a 'node' (la propia unidad y las de encima)."""
+        return (self.rows[:, node >> 3] & (128 >> (node & 7))) != 0
+
+    def _add_edges(self, origin, destinations):
+        """Añade las aristas origin -> destinations propagando las filas a todo lo que está por encima."""
+        node = self.ids[origin]
+        targets = [self.ids[code] for code in destinations]
+        below = np.bitwise_or.reduce(self.rows[targets], axis=0)
+        if below[node >> 3] & (128 >> (node & 7)):
+            # La arista cierra un ciclo: ya no hay cierre transitivo que mantener
+            self.valid = False
+            return
+        above = self._column(node)
+        self.rows[above] |= below
+
+    # Consultas
+
+    def is_above(self, upper, lower):
+        """Indica si 'lower' está por debajo de 'upper'."""
+        i, j = self.ids[upper], self.ids[lower]
+        return i != j and bool(self.rows[i, j >> 3] & (128 >> (j & 7)))
+
+    def are_above(self, uppers, lowers):
+        """Versión por lotes de 'is_above': un array de bool para los pares (uppers[k], lowers[k])."""
+        i = np.fromiter((self.ids[code] for code in uppers), dtype=np.int64)
+        j = np.fromiter((self.ids[code] for code in lowers), dtype=np.int64, count=len(i))
+        return ((self.rows[i, j >> 3] & (128 >> (j & 7))) != 0) & (i != j)
+
+    def descendants(self, code):
+        node = self.ids[code]
+        below = np.unpackbits(self.rows[node], count=self.n).astype(bool)
+        below[node] = False
+        return [self.codes[i] for i in np.flatnonzero(below).tolist()]
+
+    def ancestors(self, code):
+        node = self.ids[code]
+        above = self._column(node)
+        above[node] = False
+        return [self.codes[i] for i in np.flatnonzero(above).tolist()]
+
+    def creates_cycle(self, origin, destination):
+        """Indica si añadir destination como hijo de origin crearía un ciclo; None si no se puede decidir.
+
+        Mismo criterio que 'GraphApp.search_cycle': el origen está en el destino, en sus equivalentes
+        o por debajo de alguno de ellos.
+        """
+        if origin not in self.ids or destination not in self.ids:
+            return None
+        starts = [self.ids[code] for code in (destination, *self.model.equivalents[destination])]
+        node = self.ids[origin]
+        return bool((self.rows[starts, node >> 3] & (128 >> (node & 7))).any())
+
+    # Cambios del modelo
+
+    def child_added(self, parent, son):
+        self._add_edges(parent, [son, *self.model.equivalents[son]])
+
+    def equivalence_added(self, node_A, node_B):
+        for node, equi in ((node_A, node_B), (node_B, node_A)):
+            if equi in self.model.equivalents[node]:
+                for parent in self.model.parents[node]:
+                    if self.valid:
+                        self._add_edges(parent, [equi])
+
+    def unit_renamed(self, old_code, new_code):
+        self.ids[new_code] = self.ids.pop(old_code)
+        self.codes = list(self.codes)
+        self.codes[self.ids[new_code]] = new_code
+
+    def _invalidate(self, *args):
+        self.valid = False
+
+    unit_added = unit_removed = child_removed = equivalence_removed = _invalidate
+
+class EditCommand:
+    """Una edición del usuario: las operaciones que hizo sobre el modelo y las que las deshacen."""
+
+    def __init__(self, checkpoint=None):
+        # Pares ((método, argumentos), (método inverso, argumentos))
+        self.operations = []
+        # Copia del modelo anterior a la edición, si se guardó
+        self.checkpoint = checkpoint
+        self.size = 0 if checkpoint is None else self.estimate(checkpoint.units) * 2
+
+    @staticmethod
+    def estimate(value):
+        """Tamaño aproximado en bytes de los argumentos de una operación."""
+        if isinstance(value, dict):
+            return 64 + sum(EditCommand.estimate(k) + EditCommand.estimate(v) for k, v in value.items())
+        if isinstance(value, (tuple, list)):
+            return 56 + sum(EditCommand.estimate(v) for v in value)
+        if isinstance(value, str):
+            return 49 + len(value)
+        return 28
+
+    def add(self, forward, inverse):
+        self.operations.append((forward, inverse))
+        self.size += self.estimate(forward) + self.estimate(inverse)
+
+
+class EditHistory:
+    """Historial de deshacer/rehacer como registro de operaciones invertibles del modelo.
+
+    Deshacer o rehacer cuesta lo que ocupa la edición, no lo que ocupa el modelo. Si 'checkpoint_every'
+    no es None, cada tantas ediciones se guarda además una copia del modelo y deshacer esa edición la
+    restaura directamente. Cuando el historial supera 'max_bytes' se olvidan las ediciones más antiguas.
+    """
+
+    def __init__(self, max_bytes=64 * 2**20, checkpoint_every=None):
+        self.max_bytes = max_bytes
+        self.checkpoint_every = checkpoint_every
+        self.undo_stack = []
+        self.redo_stack = []
+        self._count = 0
+
+    def size(self):
+        return sum(command.size for command in itertools.chain(self.undo_stack, self.redo_stack))
+
+    def begin(self, model):
+        """Empieza una edición: desde aquí las operaciones del modelo se anotan en ella."""
+        self._count += 1
+        checkpoint = None
+        if self.checkpoint_every and self._count % self.checkpoint_every == 0:
+            checkpoint = model.copy()
+        command = EditCommand(checkpoint)
+        self.undo_stack.append(command)
+        self.redo_stack.clear()
+        model.recorder = command
+
+    def end(self, model):
+        """Termina la edición: el modelo deja de anotar operaciones y se recorta el historial."""
+        model.recorder = None
+        self.trim()
+
+    def trim(self):
+        # La última edición nunca se descarta
+        total = self.size()
+        while total > self.max_bytes and len(self.undo_stack) > 1:
+            total -= self.undo_stack.pop(0).size
+
+    def undo(self, model):
+        """Deshace la última edición y devuelve el modelo resultante."""
+        command = self.undo_stack.pop()
+        self.redo_stack.append(command)
+        model.recorder = None
+        if command.checkpoint is not None:
+            return command.checkpoint.copy()
+        for _, inverse in reversed(command.operations):
+            model.apply(inverse)
+        return model
+
+    def redo(self, model):
+        """Rehace la última edición deshecha y devuelve el modelo resultante."""
+        command = self.redo_stack.pop()
+        self.undo_stack.append(command)
+        model.recorder = None
+        for forward, _ in command.operations:
+            model.apply(forward)
+        return model
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+
+
+class EditJournal:
+    """Diario de solo escritura al final, junto al CSV, con las operaciones del modelo desde el último guardado.
+
+    Cada operación es una línea JSON de pocos bytes. Las escrituras se acumulan en el búfer del archivo y
+    se vuelcan al disco (fsync) como mucho cada 'sync_ms' milisegundos. La primera línea identifica la
+    versión del CSV (tamaño y fecha de modificación) sobre la que hay que reproducir el diario.
+    """
+
+    SUFFIX = ".journal"
+
+    def __init__(self, csv_path, root, sync_ms=1000):
+        self.csv_path = csv_path
+        self.path = csv_path + self.SUFFIX
+        self.root = root
+        self.sync_ms = sync_ms
+        # Operaciones escritas desde el último guardado del CSV
+        self.entries = 0
+        self._file = None
+        self._after = None
+
+    @staticmethod
+    def fingerprint(csv_path):
+        stat = os.stat(csv_path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def start(self):
+        """Empieza un diario vacío para la versión actual del CSV."""
+        self.close()
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._file.write(json.dumps({"csv": self.fingerprint(self.csv_path)}) + "\n")
+        self.entries = 0
+        self.sync()
+
+    def resume(self, entries):
+        """Sigue escribiendo al final de un diario recuperado que tiene 'entries' operaciones."""
+        self.close()
+        self._file = open(self.path, "a", encoding="utf-8")
+        self.entries = entries
+
+    def write(self, operation):
+        method, args = operation
+        self._file.write(json.dumps({"op": method, "args": args}, ensure_ascii=False) + "\n")
+        self.entries += 1
+        if self._after is None:
+            self._after = self.root.after(self.sync_ms, self.sync)
+
+    def write_model(self, model):
+        """Anota el modelo completo, para saltos de estado que no son operaciones (p. ej. restaurar una copia)."""
+        df = model.to_dataframe(use_names=True)
+        self.write(("load", (list(df.columns), df.values.tolist())))
+
+    def sync(self):
+        self._after = None
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self, remove=False):
+        if self._after is not None:
+            self.root.after_cancel(self._after)
+        self.sync()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
+
+    @classmethod
+    def read(cls, csv_path):
+        """Operaciones del diario de un CSV, o None si no hay diario o es de otra versión del CSV.
+
+        Una última línea incompleta (escritura interrumpida) se descarta.
+        """
+        path = csv_path + cls.SUFFIX
+        if not os.path.exists(path):
+            return None
+        operations = []
+        with open(path, encoding="utf-8") as file:
+            try:
+                header = json.loads(file.readline())
+            except ValueError:
+                return None
+            if header.get("csv") != cls.fingerprint(csv_path):
+                return None
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                operations.append((entry["op"], entry["args"]))
+        return operations
+
+    @staticmethod
+    def replay(model, operations):
+        """Reproduce las operaciones sobre el modelo y devuelve el modelo resultante."""
+        for method, args in operations:
+            if method == "load":
+                columns, rows = args
+                model = StratigraphicModel.from_dataframe(pd.DataFrame(rows, columns=columns))
+            else:
+                model.apply((method, args))
+        return model
+
+
+class ProjectFile:
+    """Formato de proyecto nativo: un .npz sin comprimir y sin objetos de Python.
+
+    Los valores de las columnas de la BD son índices a una tabla de cadenas UTF-8 y las relaciones son
+    pares de filas, así que la carga no analiza texto. Guarda lo mismo que el CSV más la personalización,
+    de modo que se puede pasar de un formato a otro sin pérdidas.
+    """
+
+    EXTENSION = ".hammon"
+    VERSION = 1
+
+    @staticmethod
+    def _string_table(values):
+        """Cadenas distintas de 'values' (bytes UTF-8 y desplazamientos) e índice de cada valor en ellas."""
+        table = {}
+        indices = np.fromiter((table.setdefault(value, len(table)) for value in values), dtype=np.int32, count=len(values))
+        encoded = [value.encode("utf-8") for value in table]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets, indices
+
+    @staticmethod
+    def _edges(model, adjacency):
+        """Pares (fila, fila relacionada) en el orden en que el CSV escribe la columna."""
+        row = model.row_index
+        edges = [(row[code], row[other]) for code in model.order for other in adjacency[code]]
+        return np.array(edges, dtype=np.int32).reshape(-1, 2)
+
+    @classmethod
+    def save(cls, path, model, settings=None):
+        columns = model.attribute_columns()
+        values = [model.units[code][col] for col in columns for code in model.order]
+        strings, offsets, indices = cls._string_table(values)
+        # Con un objeto archivo np.savez no añade la extensión '.npz'
+        with open(path, "wb") as file:
+            np.savez(file, version=np.array(cls.VERSION), columns=np.array(model.columns),
+                     strings=strings, offsets=offsets, values=indices.reshape(len(columns), len(model.order)),
+                     children=cls._edges(model, model.children), equivalents=cls._edges(model, model.equivalents),
+                     facts=cls._edges(model, model.fact_members), settings=np.array(json.dumps(settings or {})))
+
+    @classmethod
+    def load(cls, path):
+        """Devuelve el modelo (códigos iguales a 'Nombre', como al cargar el CSV) y la personalización guardada."""
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["version"]) > cls.VERSION:
+                raise ValueError("El proyecto se guardó con una versión más reciente de HAMMON.")
+            columns = data["columns"].tolist()
+            strings = data["strings"].tobytes()
+            offsets = data["offsets"].tolist()
+            values = data["values"]
+            children = data["children"]
+            equivalents = data["equivalents"]
+            facts = data["facts"]
+            settings = json.loads(str(data["settings"]))
+
+        table = np.array([strings[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:])], dtype=object)
+        # Crear cientos de miles de diccionarios dispara el recolector de ciclos sin necesidad
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return cls._build(columns, table[values], children, equivalents, facts), settings
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    @staticmethod
+    def _build(columns, column_values, children, equivalents, facts):
+        """Crea el modelo a partir de los valores de las columnas (una fila por columna) y los pares de filas."""
+        model = StratigraphicModel(columns)
+        attribute_columns = model.attribute_columns()
+        names = column_values[attribute_columns.index("Nombre")]
+        codes = names.tolist()
+
+        model.order = codes
+        model.row_index = {code: i for i, code in enumerate(codes)}
+        model.units = {code: dict(zip(attribute_columns, row)) for code, row in zip(codes, zip(*column_values.tolist()))}
+        model.codes_by_name = dict(zip(codes, codes))
+        model.children, model.parents, model.equivalents, model.fact_members, model.member_of = (
+            {code: {} for code in codes} for _ in range(5))
+        # Pares de filas traducidos a pares de códigos de una vez
+        for parent, son in names[children].tolist():
+            model.children[parent][son] = None
+            model.parents[son][parent] = None
+        for code, equi in names[equivalents].tolist():
+            model.equivalents[code][equi] = None
+        for fact, member in names[facts].tolist():
+            model.fact_members[fact][member] = None
+            model.member_of[member][fact] = None
+        return model
+
+
+class SiteArchive:
+    """Archivo SQLite con las matrices de varios yacimientos o campañas, sin tener que cargarlas todas.
+
+    Las tablas están indexadas por yacimiento y por cada extremo de las relaciones, así que buscar
+    unidades, recorrer ancestros o descendientes y extraer una parte de la matriz solo leen las filas
+    implicadas. Se usa con 'with'; cada uso abre su propia conexión, de modo que sirve en segundo plano.
+    """
+
+    EXTENSION = ".sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sites (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, columns TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS units (site INTEGER NOT NULL, code TEXT NOT NULL, row INTEGER NOT NULL,
+                                          PRIMARY KEY (site, code)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS units_row ON units (site, row);
+        CREATE TABLE IF NOT EXISTS attributes (site INTEGER NOT NULL, code TEXT NOT NULL, col TEXT NOT NULL,
+                                               value TEXT NOT NULL, folded TEXT NOT NULL,
+                                               PRIMARY KEY (site, code, col)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS attributes_folded ON attributes (site, col, folded);
+        CREATE TABLE IF NOT EXISTS relations (site INTEGER NOT NULL, parent TEXT NOT NULL, son TEXT NOT NULL,
+                                              position INTEGER NOT NULL);
+        CREATE INDEX IF NOT EXISTS relations_parent ON relations (site, parent);
+        CREATE INDEX IF NOT EXISTS relations_son ON relations (site, son);
+        CREATE TABLE IF NOT EXISTS equivalences (site INTEGER NOT NULL, code TEXT NOT NULL, other TEXT NOT NULL,
+                                                 position INTEGER NOT NULL);
+        CREATE INDEX IF NOT EXISTS equivalences_code ON equivalences (site, code);
+        CREATE INDEX IF NOT EXISTS equivalences_other ON equivalences (site, other);
+        CREATE TABLE IF NOT EXISTS facts (site INTEGER NOT NULL, fact TEXT NOT NULL, member TEXT NOT NULL,
+                                          position INTEGER NOT NULL);
+        CREATE INDEX IF NOT EXISTS facts_fact ON facts (site, fact);
+        CREATE INDEX IF NOT EXISTS facts_member ON facts (site, member);
+    """
+
+    # Tabla, columna origen y columna destino de cada adyacencia del modelo
+    EDGE_TABLES = (("relations", "parent", "son"), ("equivalences", "code", "other"), ("facts", "fact", "member"))
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+
+    def __enter__(self):
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(self.SCHEMA)
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if kind is None:
+            self.connection.commit()
+        self.connection.close()
+        self.connection = None
+
+    @staticmethod
+    def fold(text):
+        """Texto sin mayúsculas ni diacríticos, como lo compara el filtro por defecto."""
+        return UnitFilter.normalize(text)
+
+    def sites(self):
+        return [name for (name,) in self.connection.execute("SELECT name FROM sites ORDER BY name")]
+
+    def _site(self, name):
+        """Identificador y columnas de la BD de un yacimiento."""
+        row = self.connection.execute("SELECT id, columns FROM sites WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return row[0], json.loads(row[1])
+
+    def store(self, name, model):
+        """Guarda el modelo como el yacimiento 'name', sustituyéndolo si ya existía."""
+        self.remove(name)
+        site = self.connection.execute("INSERT INTO sites (name, columns) VALUES (?, ?)",
+                                       (name, json.dumps(model.columns))).lastrowid
+        self.connection.executemany("INSERT INTO units VALUES (?, ?, ?)",
+                                    ((site, code, row) for row, code in enumerate(model.order)))
+        self.connection.executemany("INSERT INTO attributes VALUES (?, ?, ?, ?, ?)",
+                                    ((site, code, col, value, self.fold(value))
+                                     for code in model.order for col, value in model.units[code].items()))
+        adjacencies = (model.children, model.equivalents, model.fact_members)
+        for (table, _, _), adjacency in zip(self.EDGE_TABLES, adjacencies):
+            self.connection.executemany(f"INSERT INTO {table} VALUES (?, ?, ?, ?)",
+                                        ((site, code, other, position) for code in model.order
+                                         for position, other in enumerate(adjacency[code])))
+
+    def remove(self, name):
+        try:
+            site, _ = self._site(name)
+        except KeyError:
+            return
+        for table in ("units", "attributes") + tuple(table for table, _, _ in self.EDGE_TABLES):
+            self.connection.execute(f"DELETE FROM {table} WHERE site = ?", (site,))
+        self.connection.execute("DELETE FROM sites WHERE id = ?", (site,))
+
+    def search(self, name, terms, columns=None, full_words=False):
+        """Unidades con algún valor que contiene (o, con 'full_words', es) alguno de los términos.
+
+        Sin distinguir mayúsculas ni diacríticos. La búsqueda por palabras completas usa el índice de
+        valores; la parcial recorre solo los valores del yacimiento.
+        """
+        site, _ = self._site(name)
+        terms = [self.fold(term.strip()) for term in terms]
+        query = "SELECT DISTINCT code FROM attributes WHERE site = ?"
+        params = [site]
+        if columns:
+            query += f" AND col IN ({','.join('?' * len(columns))})"
+            params.extend(columns)
+        if full_words:
+            query += f" AND folded IN ({','.join('?' * len(terms))})"
+        else:
+            query += " AND (" + " OR ".join("instr(folded, ?) > 0" for _ in terms) + ")"
+        params.extend(terms)
+        return {code for (code,) in self.connection.execute(query, params)}
+
+    def _reach(self, name, codes, table, source, target):
+        site, _ = self._site(name)
+        query = f"""
+            WITH RECURSIVE reach(code) AS (
+                SELECT value FROM json_each(?)
+                UNION
+                SELECT e.{target} FROM {table} e JOIN reach ON e.site = ? AND e.{source} = reach.code)
+            SELECT code FROM reach"""
+        return {code for (code,) in self.connection.execute(query, (json.dumps(list(codes)), site))}
+
+    def descendants(self, name, codes):
+        """Las unidades y todas las que están por debajo de ellas."""
+        return self._reach(name, codes, "relations", "parent", "son")
+
+    def ancestors(self, name, codes):
+        """Las unidades y todas las que están por encima de ellas."""
+        return self._reach(name, codes, "relations", "son", "parent")
+
+    def with_equivalents(self, name, codes):
+        """Las unidades y todas las equivalentes a ellas."""
+        return self._reach(name, codes, "equivalences", "code", "other")
+
+    def with_fact_members(self, name, codes):
+        """Las unidades y, recursivamente, las que pertenecen a los hechos que hay entre ellas."""
+        return self._reach(name, codes, "facts", "fact", "member")
+
+    def load(self, name, codes=None):
+        """Modelo con las unidades indicadas (todas si es None) y las relaciones entre ellas, en su orden."""
+        site, columns = self._site(name)
+        connection = self.connection
+        connection.execute("CREATE TEMP TABLE IF NOT EXISTS selection (code TEXT PRIMARY KEY) WITHOUT ROWID")
+        connection.execute("DELETE FROM selection")
+        if codes is None:
+            connection.execute("INSERT INTO selection SELECT code FROM units WHERE site = ?", (site,))
+        else:
+            connection.executemany("INSERT OR IGNORE INTO selection VALUES (?)", ((code,) for code in codes))
+
+        model = StratigraphicModel(columns)
+        order = [code for (code,) in connection.execute(
+            "SELECT u.code FROM selection s CROSS JOIN units u ON u.site = ? AND u.code = s.code ORDER BY u.row", (site,))]
+        model.order = order
+        model.row_index = {code: i for i, code in enumerate(order)}
+        model.units = {code: dict.fromkeys(model.attribute_columns(), "") for code in order}
+        for code, col, value in connection.execute(
+                "SELECT a.code, a.col, a.value FROM selection s CROSS JOIN attributes a ON a.site = ? AND a.code = s.code",
+                (site,)):
+            model.units[code][col] = value
+        model.codes_by_name = {attributes["Nombre"]: code for code, attributes in model.units.items()}
+        for adjacency in model._adjacencies():
+            adjacency.update((code, {}) for code in order)
+
+        # Aristas con los dos extremos en la selección, en el orden en que las escribe el CSV
+        for (table, source, target), (forward, backward) in zip(
+                self.EDGE_TABLES,
+                ((model.children, model.parents), (model.equivalents, None), (model.fact_members, model.member_of))):
+            for code, other in connection.execute(f"""
+                    SELECT e.{source}, e.{target} FROM selection a
+                    CROSS JOIN {table} e ON e.site = ? AND e.{source} = a.code
+                    JOIN selection b ON b.code = e.{target}
+                    JOIN units u ON u.site = e.site AND u.code = e.{source}
+                    ORDER BY u.row, e.position""", (site,)):
+                forward[code][other] = None
+                if backward is not None:
+                    backward[other][code] = None
+        return model
+
+
+class FileChecker:
+    """Reglas de validación de un CSV cargado.
+
+    Las listas de 'Hijos', 'Equivalencias' y 'Hecho' se separan una sola vez en tablas de aristas
+    (una fila por valor) y todas las reglas se evalúan sobre ellas, de modo que se obtienen todos
+    los errores de una vez como tuplas (regla, unidad, fila, detalle).
+    """
+
+    COLUMNS = ("Regla", "Unidad", "Fila", "Detalle")
+
+    @staticmethod
+    def check_columns(df):
+        """Comprobaciones de las columnas del CSV. Devuelve el mensaje de error o None."""
+        main_columns = ["Nombre", "Hijos", "Equivalencias", "Hecho", "Tipo", "Fase", "Descripcion"]
+
+        # Comprobar que las columnas principales existen
+        if not all(col in df.columns for col in main_columns):
+            return f"El archivo CSV no contiene alguna de las siguientes columnas: {main_columns}."
+        
+        # Comprobar que en las columnas no existe una columna con el nombre 'Codigo'
+        if 'Codigo' in df.columns:
+            return "El archivo CSV no puede contener una columna de nombre 'Codigo'."
+        
+        # Comprobar que no hay dos columnas con el mismo nombre
+        # Cuando hay dos columnas con el mismo nombre en el CSV, la segunda columna con el mismo nombre se carga con “nombre.X”, siendo X el número de veces que se repite.
+        if any(df.columns.duplicated()):
+            return "El archivo CSV contiene columnas duplicadas."
+
+        return None
+
+    def __init__(self, df):
+        self.df = df
+        self.names = df["Nombre"]
+        self.types = dict(zip(df["Nombre"], df["Tipo"]))
+        self.edges = {col: self._edge_table(col) for col in StratigraphicModel.RELATION_COLUMNS}
+        self.errors = []
+
+    def _edge_table(self, col):
+        """Tabla (fila, nombre, valor) con un registro por cada valor de la columna."""
+        edges = pd.DataFrame({"row": self.df.index, "name": self.names,
+                              "value": self.df[col].fillna("").astype(str).str.split(",")})
+        edges = edges.explode("value")
+        edges["value"] = edges["value"].str.strip()
+        return edges[edges["value"] != ""].reset_index(drop=True)
+
+    def add(self, rule, rows, details=None):
+        """Añade un error por cada fila (índice del DataFrame) indicada."""
+        rows = list(rows)
+        details = [""] * len(rows) if details is None else list(details)
+        names = self.names.loc[rows].tolist()
+        self.errors.extend((rule, name, row, detail) for name, row, detail in zip(names, rows, details))
+
+    def check(self):
+        """Evalúa todas las reglas y devuelve la lista de errores."""
+        self.check_names()
+        self.check_references()
+        self.check_repeated_values()
+        self.check_cycles()
+        self.check_equivalences()
+        self.check_facts()
+        self.check_types()
+        return self.errors
+
+    def check_names(self):
+        df = self.df
+        self.add("'Nombre' con ',' o ';'", df.index[self.names.str.contains('[,;]', regex=True)])
+        self.add("Fila sin 'Nombre'", df.index[self.names == ''])
+        duplicated = self.names.duplicated() & (self.names != '')
+        self.add("'Nombre' duplicado", df.index[duplicated])
+
+    def check_references(self):
+        for col, edges in self.edges.items():
+            unknown = edges[~edges["value"].isin(self.names)]
+            self.add(f"Valor de '{col}' que no está en 'Nombre'", unknown["row"], unknown["value"])
+
+    def check_repeated_values(self):
+        # El mismo valor no puede aparecer dos veces entre 'Nombre', 'Hijos', 'Equivalencias' y 'Hecho' de una fila
+        names = pd.DataFrame({"row": self.df.index, "value": self.names.str.strip()})
+        values = pd.concat([names[names["value"] != ""]] + [edges[["row", "value"]] for edges in self.edges.values()])
+        repeated = values[values.duplicated()].drop_duplicates("row")
+        self.add("Valor repetido en 'Nombre', 'Hijos', 'Equivalencias' o 'Hecho'", repeated["row"], repeated["value"])
+
+    def check_cycles(self):
+        G = nx.DiGraph()
+        for col in ("Hijos", "Hecho"):
+            G.add_edges_from(zip(self.edges[col]["name"], self.edges[col]["value"]))
+        first_rows = self.names.drop_duplicates()
+        rows = dict(zip(first_rows, first_rows.index))
+        cycles = self.witness_cycles(G)
+        self.add("Ciclo padre-hijo", [rows[cycle[0]] for cycle in cycles], [" -> ".join(cycle) for cycle in cycles])
+
+    def witness_cycles(self, G):
+        """Devuelve un ciclo de cada componente fuertemente conexa del grafo que tenga ciclos. Tiempo O(V+E)."""
+        cycles = []
+        for component in nx.strongly_connected_components(G):
+            node = next(iter(component))
+            if len(component) == 1 and not G.has_edge(node, node):
+                continue
+            edges = nx.find_cycle(G.subgraph(component), source=node)
+            cycles.append([u for u, _ in edges])
+        return cycles
+
+    def check_equivalences(self):
+        equivalences = self.edges["Equivalencias"]
+        if equivalences.empty:
+            return
+
+        # La equivalencia se debe indicar en 'Equivalencias' de ambos nodos
+        reverse = equivalences[["name", "value"]].rename(columns={"name": "value", "value": "name"})
+        merged = equivalences.merge(reverse.drop_duplicates(), on=["name", "value"], how="left", indicator=True)
+        one_way = (merged["_merge"] == "left_only").to_numpy()
+        self.add("Equivalencia no bidireccional", merged["row"][one_way], merged["value"][one_way])
+
+        # Los nodos equivalentes deben tener los mismos padres y los mismos hijos (cada pareja una vez)
+        pairs = equivalences[(equivalences["name"] < equivalences["value"]).to_numpy() | one_way]
+        sons = self.edges["Hijos"]
+        empty = frozenset()
+        for rule, groups in (("Equivalentes con distintos padres", sons.groupby("value")["name"].agg(frozenset)),
+                             ("Equivalentes con distintos hijos", sons.groupby("name")["value"].agg(frozenset))):
+            groups = groups.to_dict()
+            different = pairs["name"].map(lambda n: groups.get(n, empty)) != pairs["value"].map(lambda n: groups.get(n, empty))
+            self.add(rule, pairs["row"][different], pairs["value"][different])
+
+    def check_facts(self):
+        # Una unidad no puede estar en más de un 'Hecho'
+        members = self.edges["Hecho"]
+        repeated = members[members["value"].duplicated()]
+        self.add("Unidad en más de un 'Hecho'", repeated["row"], repeated["value"])
+
+    def check_types(self):
+        df = self.df
+        types = df["Tipo"]
+        self.add("Fila sin 'Tipo'", df.index[types == ''])
+        self.add("'Tipo' distinto de 'P', 'N' o 'H'", df.index[~types.isin(["P", "N", "H", ""])], types[~types.isin(["P", "N", "H", ""])])
+
+        is_PN = types.isin(["P", "N"])
+        self.add("Nodo 'P' o 'N' con valores en 'Hecho'", df.index[is_PN & (df["Hecho"] != "")])
+        is_H = types == "H"
+        self.add("Nodo 'H' con valores en 'Hijos' o 'Equivalencias'",
+                 df.index[is_H & ((df["Hijos"] != "") | (df["Equivalencias"] != ""))])
+
+        # En las relaciones y equivalencias de las unidades no puede haber hechos
+        edges = pd.concat([self.edges["Hijos"], self.edges["Equivalencias"]])
+        edges = edges[edges["name"].map(self.types).isin(["P", "N"]) & (edges["value"].map(self.types) == "H")]
+        edges = edges.drop_duplicates("row")
+        self.add("Nodo 'H' en 'Hijos' o 'Equivalencias'", edges["row"], edges["value"])
+
+class UnitFilter:
+    """Filtro de unidades compilado a partir del texto y las opciones de filtrado.
+
+    Una unidad pasa si alguno de los términos (separados por comas) está contenido en alguna de las
+    columnas seleccionadas o, con palabras completas, es igual a alguna. Los términos se normalizan
+    una sola vez; las columnas de la BD se toman ya normalizadas de 'NormalizedColumns'.
+    """
+
+    def __init__(self, filtro, columns, match_case=False, full_words=False, diacritics=False):
+        self.empty = filtro == ""
+        self.columns = list(columns)
+        self.match_case = match_case
+        self.full_words = full_words
+        self.diacritics = diacritics
+        self.terms = list(dict.fromkeys(self.normalize(term, match_case, diacritics) for term in filtro.split(",")))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=2**18)
+    def normalize(text, match_case=False, diacritics=False):
+        """Texto tal como lo compara el filtro: sin espacios alrededor y, salvo que se pida, sin mayúsculas ni diacríticos."""
+        text = text.strip()
+        if not match_case:
+            text = text.lower()
+        if not diacritics and not text.isascii():
+            text = unicodedata.normalize('NFD', text)
+            text = "".join(c for c in text if unicodedata.category(c) != 'Mn')
+        return text
+
+    def passes(self, row):
+        """Comprueba una sola fila (Series o diccionario columna -> valor)."""
+        if self.empty:
+            return True
+        values = [self.normalize(str(row[col]), self.match_case, self.diacritics) for col in self.columns]
+        if self.full_words:
+            return any(term in values for term in self.terms)
+        return any(term in value for term in self.terms for value in values)
+
+    def mask(self, bd, normalized):
+        """Máscara de las filas de la BD que pasan el filtro."""
+        n = len(bd)
+        if self.empty:
+            return np.ones(n, dtype=bool)
+        mask = np.zeros(n, dtype=bool)
+        terms = self.terms
+        for col in self.columns:
+            if self.full_words:
+                # Palabras completas: cada término se busca en el índice invertido de la columna
+                groups, rows, bounds = normalized.index(bd, col, self.match_case, self.diacritics)
+                for term in terms:
+                    group = groups.get(term)
+                    if group is not None:
+                        mask[rows[bounds[group]:bounds[group + 1]]] = True
+            elif "" in terms:
+                # El término vacío está contenido en cualquier valor
+                mask[:] = True
+            else:
+                # Se busca en todos los valores de la columna a la vez y cada aparición se lleva a su fila
+                text, starts = normalized.joined(bd, col, self.match_case, self.diacritics)
+                pattern = re.compile("|".join(map(re.escape, terms)))
+                positions = np.fromiter((match.start() for match in pattern.finditer(text)), dtype=np.int64)
+                mask[np.searchsorted(starts, positions, side="right") - 1] = True
+        return mask
+
+
+class NormalizedColumns:
+    """Columnas de la BD ya normalizadas para el filtro, calculadas una vez por versión del modelo.
+
+    La normalización de cada texto se guarda además en 'UnitFilter.normalize', así que tras una edición
+    solo se normalizan de nuevo los valores que han cambiado.
+    """
+
+    def __init__(self):
+        self.version = None
+        self._values = {}
+        self._joined = {}
+        self._index = {}
+
+    def sync(self, version):
+        if version != self.version:
+            self.version = version
+            self._values.clear()
+            self._joined.clear()
+            self._index.clear()
+
+    def values(self, bd, col, match_case, diacritics):
+        key = (col, match_case, diacritics)
+        if key not in self._values:
+            normalize = UnitFilter.normalize
+            self._values[key] = [normalize(str(value), match_case, diacritics) for value in bd[col].tolist()]
+        return self._values[key]
+
+    def joined(self, bd, col, match_case, diacritics):
+        """Valores unidos por un separador que no aparece en los términos, y posición donde empieza cada uno."""
+        key = (col, match_case, diacritics)
+        if key not in self._joined:
+            values = self.values(bd, col, match_case, diacritics)
+            starts = np.zeros(len(values), dtype=np.int64)
+            np.cumsum([len(value) + 1 for value in values[:-1]], out=starts[1:])
+            self._joined[key] = ("\0".join(values), starts)
+        return self._joined[key]
+
+    def index(self, bd, col, match_case, diacritics):
+        """Índice invertido de la columna: valor -> grupo, filas ordenadas por grupo y límites de cada grupo."""
+        key = (col, match_case, diacritics)
+        if key not in self._index:
+            groups, uniques = pd.factorize(np.array(self.values(bd, col, match_case, diacritics), dtype=object))
+            # Filas agrupadas por valor: las del valor i son rows[bounds[i]:bounds[i + 1]]
+            rows = np.argsort(groups, kind="stable")
+            bounds = np.searchsorted(groups[rows], np.arange(len(uniques) + 1))
+            self._index[key] = (dict(zip(uniques.tolist(), range(len(uniques)))), rows, bounds)
+        return self._index[key]
+
+
+class JobCancelled(Exception):
+    """Se lanza dentro de un trabajo en segundo plano cuando el usuario lo cancela."""
+
+class BackgroundJob:
+    """Trabajo que se ejecuta en un hilo aparte. Solo se comunica con Tk a través de su cola."""
+
+    def __init__(self, title, work, on_done):
+        self.title = title
+        self.work = work
+        self.on_done = on_done
+        self.cancelled = threading.Event()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        try:
+            result = self.work(self)
+        except JobCancelled:
+            self.queue.put(("cancelled", None))
+        except Exception as e:
+            self.queue.put(("error", e))
+        else:
+            self.queue.put(("done", result))
+
+    def report(self, percentage, text=""):
+        """Informa del progreso (0-100). Es también el punto en el que se atiende la cancelación."""
+        self.check_cancelled()
+        self.queue.put(("progress", (percentage, text)))
+
+    def check_cancelled(self):
+        if self.cancelled.is_set():
+            raise JobCancelled()
+
+    def cancel(self):
+        self.cancelled.set()
+
+class JobScheduler:
+    """Ejecuta los trabajos largos fuera del hilo de Tk y entrega sus resultados con 'root.after'.
+
+    Hay como mucho un trabajo por nombre: lanzar uno nuevo cancela y descarta el anterior.
+    'on_done' se ejecuta en el hilo de Tk, que es el único que toca la interfaz.
+    """
+
+    POLL_MS = 50
+
+    def __init__(self, root, on_progress):
+        self.root = root
+        # on_progress(título, porcentaje, texto); título None cuando no queda ningún trabajo
+        self.on_progress = on_progress
+        self.jobs = {}
+        self._polling = False
+
+    def submit(self, name, title, work, on_done):
+        previous = self.jobs.get(name)
+        if previous is not None:
+            previous.cancel()
+        job = BackgroundJob(title, work, on_done)
+        self.jobs[name] = job
+        job.thread.start()
+        self.on_progress(title, 0, "")
+        if not self._polling:
+            self._polling = True
+            self.root.after(self.POLL_MS, self._poll)
+        return job
+
+    def busy(self):
+        return bool(self.jobs)
+
+    def cancel(self, name):
+        """Cancela y descarta el trabajo con ese nombre, si lo hay."""
+        job = self.jobs.pop(name, None)
+        if job is not None:
+            job.cancel()
+
+    def cancel_all(self):
+        for job in self.jobs.values():
+            job.cancel()
+
+    def _poll(self):
+        for name, job in list(self.jobs.items()):
+            while True:
+                try:
+                    kind, value = job.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if kind == "progress":
+                    self.on_progress(job.title, *value)
+                    continue
+                del self.jobs[name]
+                if kind == "done" and not job.cancelled.is_set():
+                    job.on_done(value)
+                elif kind == "error":
+                    messagebox.showerror("Error", f"{job.title}: {value}")
+                break
+
+        if self.jobs:
+            self.root.after(self.POLL_MS, self._poll)
+        else:
+            self._polling = False
+            self.on_progress(None, 0, "")
+
+class ArrowHeadCollection(PathCollection):
+    """Puntas de flecha de muchas aristas en un único artista.
+
+    Como en FancyArrowPatch, las puntas se construyen en puntos de pantalla al dibujar: conservan
+    su tamaño y orientación al hacer zoom y quedan a 'shrink' puntos del extremo de la arista.
+    """
+
+    # Cabeza de cada extremo, con la punta en el origen apuntando hacia +x
+    # (vértices en unidades de 'mutation_scale', rellena o no)
+    HEADS = {
+        "open": ([(-0.4, 0.2), (0, 0), (-0.4, -0.2)], False),
+        "filled": ([(-0.4, 0.2), (0, 0), (-0.4, -0.2), (-0.4, 0.2)], True),
+        "bracket": ([(0.2, 0.5), (0, 0.5), (0, -0.5), (0.2, -0.5)], False),
+        "bar": ([(0, 0.5), (0, -0.5)], False),
+    }
+    START_HEADS = {"": None, "<": "open", "<|": "filled", "]": "bracket", "|": "bar"}
+    END_HEADS = {"": None, ">": "open", "|>": "filled", "[": "bracket", "|": "bar"}
+
+    def __init__(self, starts, ends, arrowstyle, color, width, shrink=0, mutation_scale=10, **kwargs):
+        super().__init__([], transform=transforms.IdentityTransform(), **kwargs)
+        # (k, 2, 2) en coordenadas de datos: [punto de referencia, punta]; la cabeza apunta de uno a otra
+        self.set_edges(starts, ends)
+        self.shrink = shrink
+        self.mutation_scale = mutation_scale
+        self.set_head_style(arrowstyle, color, width)
+
+    def set_edges(self, starts, ends):
+        self.starts = np.asarray(starts, dtype=float).reshape(-1, 2, 2)
+        self.ends = np.asarray(ends, dtype=float).reshape(-1, 2, 2)
+        self.stale = True
+
+    def set_head_style(self, arrowstyle, color, width):
+        start, end = arrowstyle.split("-", 1)
+        self.heads = (self.START_HEADS[start], self.END_HEADS[end])
+        self.head_color = color
+        self.set_edgecolor(color)
+        self.set_linewidth(width)
+        self.stale = True
+
+    def head_paths(self, segments, kind, scale, shrink):
+        """Vértices y códigos de las cabezas de todos los segmentos, en píxeles."""
+        vertices, filled = self.HEADS[kind]
+        reference = self.axes.transData.transform(segments[:, 0])
+        tip = self.axes.transData.transform(segments[:, 1])
+        direction = tip - reference
+        length = np.hypot(direction[:, 0], direction[:, 1])
+        keep = length > 0
+        direction = direction[keep] / length[keep, None]
+        normal = direction[:, ::-1] * (-1, 1)
+        tip = tip[keep] - shrink * direction
+
+        template = np.asarray(vertices, dtype=float) * scale
+        heads = (tip[:, None, :] + template[None, :, :1] * direction[:, None, :]
+                 + template[None, :, 1:] * normal[:, None, :])
+        codes = np.full(len(template), Path.LINETO, dtype=Path.code_type)
+        codes[0] = Path.MOVETO
+        if filled:
+            codes[-1] = Path.CLOSEPOLY
+        return filled, heads.reshape(-1, 2), np.tile(codes, len(heads))
+
+    def draw(self, renderer):
+        if not self.get_visible():
+            return
+        scale = renderer.points_to_pixels(self.mutation_scale)
+        shrink = renderer.points_to_pixels(self.shrink)
+
+        # Un camino compuesto para las cabezas rellenas y otro para las de solo trazo
+        parts = {True: [], False: []}
+        for segments, kind in ((self.starts, self.heads[0]), (self.ends, self.heads[1])):
+            if kind is not None and len(segments):
+                filled, vertices, codes = self.head_paths(segments, kind, scale, shrink)
+                parts[filled].append((vertices, codes))
+
+        paths, facecolors = [], []
+        for filled, facecolor in ((True, self.head_color), (False, "none")):
+            if parts[filled]:
+                paths.append(Path(np.concatenate([v for v, _ in parts[filled]]),
+                                  np.concatenate([c for _, c in parts[filled]])))
+                facecolors.append(facecolor)
+        self.set_paths(paths)
+        self.set_facecolor(facecolors)
+        super().draw(renderer)
+
+
+class LabelCollection(PathCollection):
+    """Etiquetas de muchos nodos en un único artista, centradas en cada posición.
+
+    Cada etiqueta se compone con los trazos de sus caracteres, que se calculan una sola vez por
+    carácter y tamaño. Dibujar un objeto Text por nodo es mucho más lento; a cambio se ignora el
+    interletraje, que a este tamaño apenas se nota.
+    """
+
+    # (carácter, tamaño) -> (vértices, códigos, avance), en puntos
+    _glyphs = {}
+
+    def __init__(self, labels, offsets, fontsize=10, color="k", **kwargs):
+        self.prop = FontProperties(size=fontsize)
+        self.font = get_font(findfont(self.prop))
+        # Desplazamiento vertical que centra la línea de texto, como va='center'
+        _, height, descent = text_to_path.get_text_width_height_descent("lp", self.prop, ismath=False)
+        self.baseline = descent - height / 2
+        # sizes=[1] escala los caminos de puntos a píxeles según los dpi, igual que en scatter
+        super().__init__([], sizes=[1], facecolors=color, edgecolors="none",
+                         transform=transforms.IdentityTransform(), **kwargs)
+        # Ajustar a píxeles las letras rectilíneas (T, L, ...) puede hacer desaparecer sus trazos
+        self.set_snap(False)
+        self.set_labels(labels, offsets)
+
+    def set_labels(self, labels, offsets):
+        self.set_paths([self.label_path(label) for label in labels])
+        self.set_offsets(np.asarray(offsets, dtype=float).reshape(-1, 2))
+
+    def glyph(self, char):
+        key = (char, self.prop.get_size_in_points())
+        if key not in self._glyphs:
+            size = self.prop.get_size_in_points()
+            self.font.set_size(size, 72)
+            advance = self.font.load_char(ord(char)).linearHoriAdvance / 65536
+            if char.isspace():
+                vertices, codes = np.empty((0, 2)), np.empty(0, dtype=Path.code_type)
+            else:
+                path = TextPath((0, 0), char, size=size, prop=self.prop)
+                vertices, codes = path.vertices, path.codes
+            self._glyphs[key] = (vertices, codes, advance)
+        return self._glyphs[key]
+
+    def label_path(self, label):
+        vertices, codes, x = [], [], 0.0
+        for char in label:
+            glyph_vertices, glyph_codes, advance = self.glyph(char)
+            if len(glyph_vertices):
+                vertices.append(glyph_vertices + (x, 0))
+                codes.append(glyph_codes)
+            x += advance
+        if not vertices:
+            return Path(np.empty((0, 2)))
+        path = Path(np.concatenate(vertices) - (x / 2, -self.baseline), np.concatenate(codes))
+        # Como en TextPath: simplificar el trazo deforma las letras pequeñas
+        path.should_simplify = False
+        return path
+
+
+class VirtualTreeview(ttk.Frame):
+    """Treeview virtual: las filas se guardan en listas de Python y en Tk solo existen las que se ven.
+
+    Ofrece la parte de la interfaz de ttk.Treeview que usan las pestañas (insert, delete, item,
+    get_children, selection...), así que insertar o borrar filas no pasa por Tcl. Al desplazarse o al
+    cambiar los datos se vuelve a crear solo la ventana visible. Pulsar un encabezado ordena las filas.
+    """
+
+    # Alto de fila de ttk.Treeview si el estilo no indica otro
+    ROW_HEIGHT = 20
+    # Filas que se desplaza la vista con cada paso de la rueda del ratón
+    WHEEL_ROWS = 3
+    # Teclas de desplazamiento que mueven la selección por todas las filas, no solo por las creadas en Tk
+    KEYS = ("<Up>", "<Down>", "<Prior>", "<Next>", "<Home>", "<End>")
+
+    _ids = itertools.count()
+
+    def __init__(self, master, columns=(), **options):
+        super().__init__(master)
+        self.tree = ttk.Treeview(self, columns=columns, **options)
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        # Filas en orden, sus valores y las seleccionadas
+        self._items = []
+        self._values = {}
+        self._selection = set()
+        # Posición de cada fila (se recalcula al cambiar el orden) y fila con el foco
+        self._positions = None
+        self._focus = None
+        # Primera fila visible, filas que caben y filas creadas en Tk
+        self._first = 0
+        self._rows = int(options.get("height", 10))
+        self._shown = ()
+        self._render_pending = None
+        # (columna, descendente) de la última ordenación
+        self._sort = None
+        self.tree.bind("<Configure>", self._on_configure)
+        self.tree.bind("<<TreeviewSelect>>", self._on_select)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.tree.bind(sequence, self._on_wheel)
+        for sequence in self.KEYS:
+            self.tree.bind(sequence, self._on_key)
+
+    # Interfaz de ttk.Treeview
+
+    def insert(self, parent, index, iid=None, values=()):
+        if iid is None:
+            iid = f"V{next(self._ids)}"
+        self._values[iid] = tuple(str(value) for value in values)
+        if index == "end":
+            self._items.append(iid)
+        else:
+            self._items.insert(int(index), iid)
+        self._positions = None
+        self._schedule()
+        return iid
+
+    def delete(self, *items):
+        items = self._flatten(items)
+        if len(items) == 1:
+            self._items.remove(items[0])
+        else:
+            removed = set(items)
+            self._items = [iid for iid in self._items if iid not in removed]
+        for iid in items:
+            del self._values[iid]
+            self._selection.discard(iid)
+        if self._focus not in self._values:
+            self._focus = None
+        self._positions = None
+        self._schedule()
+
+    def item(self, iid, option=None, **options):
+        if isinstance(iid, (tuple, list)):
+            iid = iid[0]
+        if "values" in options:
+            self._values[iid] = tuple(str(value) for value in options["values"])
+            if iid in self._shown:
+                self._schedule()
+            return None
+        if option == "values":
+            return self._values[iid]
+        return {"text": "", "image": "", "values": list(self._values[iid]), "open": 0, "tags": ""}
+
+    def get_children(self, item=None):
+        return tuple(self._items)
+
+    def selection(self):
+        # En el orden de las filas, sin recorrer todas
+        return tuple(sorted(self._selection, key=self._position))
+
+    def selection_set(self, *items):
+        self._selection = set(self._flatten(items))
+        self._schedule()
+
+    def heading(self, column, **options):
+        if "text" in options and "command" not in options:
+            options["command"] = lambda: self.sort(column)
+        return self.tree.heading(column, **options)
+
+    def column(self, column, **options):
+        return self.tree.column(column, **options)
+
+    def bind(self, sequence=None, func=None, add=None):
+        return self.tree.bind(sequence, func, add)
+
+    def configure(self, cnf=None, **options):
+        return self.tree.configure(cnf, **options)
+
+    config = configure
+
+    def cget(self, key):
+        return self.tree.cget(key)
+
+    def __getitem__(self, key):
+        return self.tree[key]
+
+    def __setitem__(self, key, value):
+        self.tree[key] = value
+
+    def xview(self, *args):
+        return self.tree.xview(*args)
+
+    def yview(self, *args):
+        """Como Treeview.yview, pero sobre todas las filas y no solo las creadas en Tk."""
+        total = max(len(self._items), 1)
+        if not args:
+            return self._first / total, min(1.0, (self._first + self._rows) / total)
+        if args[0] == "moveto":
+            first = round(float(args[1]) * len(self._items))
+        else:
+            step = self._rows if args[2] == "pages" else 1
+            first = self._first + int(args[1]) * step
+        self._scroll_to(first)
+
+    def sort(self, column):
+        """Ordena las filas por una columna (orden natural: 'UE2' antes que 'UE10'); otra vez, al revés."""
+        self._sort_rows(column, self._sort == (column, False))
+
+    def resort(self):
+        """Vuelve a aplicar la última ordenación por encabezado. Devuelve False si no se ha ordenado."""
+        if self._sort is None:
+            return False
+        self._sort_rows(*self._sort)
+        return True
+
+    def reorder(self, items):
+        """Sustituye el orden de las filas por el de 'items' (las mismas filas)."""
+        self._items = list(items)
+        self._positions = None
+        self._schedule()
+
+    def _sort_rows(self, column, descending):
+        position = list(self.tree["columns"]).index(column)
+        self._items.sort(key=lambda iid: self._natural_key(self._values[iid][position]), reverse=descending)
+        self._sort = (column, descending)
+        self._positions = None
+        self._schedule()
+
+    def _position(self, iid):
+        if self._positions is None:
+            self._positions = {item: index for index, item in enumerate(self._items)}
+        return self._positions[iid]
+
+    # Ventana visible
+
+    @staticmethod
+    def _flatten(items):
+        return [iid for item in items for iid in (item if isinstance(item, (tuple, list)) else (item,))]
+
+    @staticmethod
+    def _natural_key(value):
+        return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", value)]
+
+    def _scroll_to(self, first):
+        first = max(0, min(first, len(self._items) - self._rows))
+        if first != self._first:
+            self._first = first
+            self._schedule()
+
+    def _schedule(self):
+        if self._render_pending is None:
+            self._render_pending = self.after_idle(self._render)
+
+    def _render(self):
+        self._render_pending = None
+        self._first = max(0, min(self._first, len(self._items) - self._rows))
+        shown = self._items[self._first:self._first + self._rows]
+        if self._shown:
+            self.tree.delete(*self._shown)
+        for iid in shown:
+            self.tree.insert("", "end", iid=iid, values=self._values[iid])
+        self._shown = tuple(shown)
+        self.tree.selection_set([iid for iid in shown if iid in self._selection])
+        self.scrollbar.set(*self.yview())
+
+    def _on_configure(self, event):
+        style = ttk.Style(self)
+        row_height = int(style.lookup("Treeview", "rowheight") or self.ROW_HEIGHT)
+        # Una fila menos por los encabezados
+        rows = max(1, event.height // row_height - 1)
+        if rows != self._rows:
+            self._rows = rows
+            self._schedule()
+
+    def _on_select(self, event):
+        # Solo cambia la selección de las filas visibles; la del resto se conserva
+        self._selection.difference_update(self._shown)
+        self._selection.update(self.tree.selection())
+        focus = self.tree.focus()
+        if focus in self._values:
+            self._focus = focus
+
+    def _on_key(self, event):
+        """Mueve el foco y la selección por todas las filas y desplaza la vista para que se vea."""
+        if not self._items:
+            return "break"
+        current = self._position(self._focus) if self._focus is not None else self._first
+        index = {"Up": current - 1, "Down": current + 1, "Prior": current - self._rows,
+                 "Next": current + self._rows, "Home": 0, "End": len(self._items) - 1}[event.keysym]
+        index = max(0, min(index, len(self._items) - 1))
+        iid = self._items[index]
+        self._focus = iid
+        self._selection = {iid}
+        if index < self._first:
+            self._first = index
+        elif index >= self._first + self._rows:
+            self._first = index - self._rows + 1
+        # Se crea ya la ventana visible para poder dar el foco a la fila
+        if self._render_pending is not None:
+            self.after_cancel(self._render_pending)
+        self._render()
+        self.tree.focus(iid)
+        return "break"
+
+    def _on_wheel(self, event):
+        up = event.num == 4 or getattr(event, "delta", 0) > 0
+        self._scroll_to(self._first + (-self.WHEEL_ROWS if up else self.WHEEL_ROWS))
+        return "break"
+
 
 class GraphApp:
+
+    # A partir de este número de nodos los niveles se calculan con numpy
+    VECTORIZED_LEVELS_MIN_NODES = 20000
+    # Tamaño de los nodos del grafo, en puntos al cuadrado
+    GRAPH_NODE_SIZE = 4500
+    # Con más nodos visibles que estos se ocultan las etiquetas y las puntas de flecha
+    GRAPH_DETAIL_MAX_NODES = 300
+    # Lado, en celdas de imagen, de los bloques en que se calcula la matriz visible
+    MATRIX_TILE = 256
+    # Órdenes posibles de las filas y columnas de la matriz
+    MATRIX_ORDERS = ("Inserción", "Niveles", "Ancho de banda")
+    # Memoria máxima del historial de deshacer/rehacer, en bytes (aproximada)
+    HISTORY_MAX_BYTES = 64 * 2**20
+    # Cada cuántas ediciones se guarda una copia completa del modelo en el historial (None: nunca)
+    HISTORY_CHECKPOINT_EVERY = None
+    # Milisegundos como máximo entre una edición y su volcado al disco en el diario de autoguardado
+    JOURNAL_SYNC_MS = 1000
+    # Formatos que se pueden abrir y guardar: CSV separado por ';' y proyecto nativo (ver 'ProjectFile')
+    FILE_TYPES = [("Archivos CSV", "*.csv"), ("Proyectos HAMMON", "*" + ProjectFile.EXTENSION)]
+    # Archivos de excavaciones con varias matrices (ver 'SiteArchive')
+    ARCHIVE_TYPES = [("Archivos de excavaciones", "*" + SiteArchive.EXTENSION)]
+    # Número de disposiciones del grafo que se guardan (p. ej. para deshacer/rehacer sin recalcular)
+    LAYOUT_CACHE_SIZE = 8
     
     def __init__(self, root):
         self.root = root
@@ -44,21 +2184,53 @@ class GraphApp:
         # Variables importantes
         # Archivo cargado
         self.uploaded_file = None
-        # Base de datos
-        self.BD = None
+        # Modelo de la matriz y vista DataFrame (BD) que se genera a partir de él
+        self.model = None
+        self._BD_view = None
+        self._BD_view_version = None
         # Treeviews - Indican qué se dibuja en el grafo/ Se les aplica filtrado
         self.relations_tab_tree = None
         self.equivalences_tab_tree = None
         self.nodes_fact_tab_tree = None
         self.facts_tab_tree = None
         self.nodes_tab_tree = None
+        # Índices de lo que muestra cada Treeview, actualizados a la vez que ellos, para búsquedas O(1)
+        # Aristas como pares no ordenados (ver 'edge_key')
+        self.relations_index = EdgeTabIndex()
+        self.equivalences_index = EdgeTabIndex()
+        self.facts_index = EdgeTabIndex()
+        # Códigos que muestran las pestañas de unidades
+        self.nodes_index = set()
+        # Fila de cada uno: código -> (Treeview, fila)
+        self.nodes_rows = {}
+        self.nodes_columns = []
+        # Modelo y filtro con los que están sincronizadas las pestañas, para actualizar solo lo que cambia
+        self._synced_model = None
+        self._synced_filter = None
         # Grafo que se dibuja
         self.graph = nx.DiGraph()
+        # Posiciones de la última disposición dibujada
+        self.pos = {}
+        # Trabajos en segundo plano (carga, validación y disposición del grafo)
+        self.jobs = JobScheduler(self.root, self.show_job_progress)
+        # Disposiciones ya calculadas, por estructura del grafo (ver 'layout_key')
+        self.layout_cache = {}
+        # Última reducción transitiva: (nodos y aristas del grafo, aristas que quedan)
+        self.reduction_cache = None
+        # Artistas del grafo dibujado, para cambiar su estilo sin redibujar
+        self.graph_artists = None
+        # Geometría completa del grafo dibujado; de ella se toma lo que cae en la vista (ver 'update_graph_detail')
+        self.graph_view = None
+        # Celdas de la matriz dibujada y ventana de la imagen actual (ver 'update_matrix_detail')
+        self.matrix_view = None
         # Contador para el "Codigo"
         self.code_counter = 0
-        # Pilas UNDO y REDO
-        self.undo_stack = []
-        self.redo_stack = []
+        # Pilas UNDO y REDO: ediciones como operaciones invertibles (ver 'EditHistory')
+        self.history = EditHistory(self.HISTORY_MAX_BYTES, self.HISTORY_CHECKPOINT_EVERY)
+        self.undo_stack = self.history.undo_stack
+        self.redo_stack = self.history.redo_stack
+        # Diario de autoguardado del archivo cargado (ver 'EditJournal')
+        self.journal = None
         # Variables que guardan los nodos no dibujados e indican cuándo mostrarlos
         self.not_drawn_nodes = set()
         # Variable para mostrar la leyenda
@@ -66,6 +2238,14 @@ class GraphApp:
         self.show_legend_matrix = False
         # Variable para indicar redundancia
         self.redundancy = False
+        # Columnas normalizadas para el filtro y último filtro compilado (ver 'UnitFilter')
+        self.normalized_columns = NormalizedColumns()
+        self._unit_filter = None
+        # Hechos indicados en 'facts_entry' y resolución precalculada de hechos
+        self.entries_strings = []
+        self.fact_forest = {}
+        self.outermost_visible_fact = {}
+        self._fact_resolution_key = None
 
         # Crear la BD
         self.upload_BD(self.graph_default())
@@ -86,6 +2266,7 @@ class GraphApp:
         
         self.create_notebook(frame2)
         self.create_filter_container(frame2)
+        self.create_status_bar()
 
         # Actualizar BD
         self.update_all()
@@ -94,6 +2275,27 @@ class GraphApp:
         root.protocol("WM_DELETE_WINDOW", self.cerrar_ventana_principal)
 
     # Organización de los widgets
+
+    def create_status_bar(self):
+        frame = tk.Frame(self.root)
+        frame.grid(row=1, column=0, columnspan=2, sticky="ew")
+
+        self.job_label = tk.Label(frame, text="", anchor="w")
+        self.job_label.pack(side="left", padx=5)
+        self.job_cancel_button = tk.Button(frame, text="Cancelar", state="disabled", command=lambda: self.jobs.cancel_all())
+        self.job_cancel_button.pack(side="right", padx=5)
+        self.job_progressbar = ttk.Progressbar(frame, length=200, maximum=100)
+        self.job_progressbar.pack(side="right", padx=5)
+
+    def show_job_progress(self, title, percentage, text):
+        if title is None:
+            self.job_label.config(text="")
+            self.job_progressbar["value"] = 0
+            self.job_cancel_button.config(state="disabled")
+            return
+        self.job_label.config(text=f"{title}... {text}" if text else f"{title}...")
+        self.job_progressbar["value"] = percentage
+        self.job_cancel_button.config(state="normal")
     
     def toolbar_container(self):
 
@@ -102,9 +2304,12 @@ class GraphApp:
 
         archivo_menu = tk.Menu(self.menu_bar, tearoff=0)
         archivo_menu.add_command(label="Nuevo", command=lambda: self.new_file())
-        archivo_menu.add_command(label="Cargar CSV", command=lambda: self.upload_CSV())
+        archivo_menu.add_command(label="Cargar CSV o proyecto", command=lambda: self.upload_CSV())
         archivo_menu.add_command(label="Guardar", command=lambda: self.save_csv())
         archivo_menu.add_command(label="Guardar como", command=lambda: self.download_csv())
+        archivo_menu.add_separator()
+        archivo_menu.add_command(label="Guardar en archivo de excavaciones", command=lambda: self.store_in_archive())
+        archivo_menu.add_command(label="Abrir de archivo de excavaciones", command=lambda: self.open_from_archive())
         self.menu_bar.add_cascade(label="Archivo", menu=archivo_menu)
 
         self.menu_bar.add_command(label="← Undo", command=lambda: self.undo(), state="disabled")
@@ -113,6 +2318,7 @@ class GraphApp:
         self.submenu = tk.Menu(self.menu_bar, tearoff=0)
         self.menu_bar.add_cascade(label="Opciones", menu=self.submenu)
         self.submenu.add_checkbutton(label="Redundancia", variable=self.redundancy, command=lambda: self.change_redundancy())
+        self.submenu.add_command(label="Relaciones redundantes", command=lambda: self.show_redundant_relations())
 
     def create_fig_notebook(self, master_frame):
         notebook_frame = tk.Frame(master_frame)
@@ -169,6 +2375,13 @@ class GraphApp:
         self.toolbar_matrix = self.Toolbar(self.canvas_matrix, frame)
         show_legend_button = tk.Button(self.toolbar_matrix, text="Mostrar leyenda", command=lambda: (self.toggle_button_style(show_legend_button), self.toggle_show_legend_matrix()), height=1)
         show_legend_button.pack(side=tk.LEFT, padx=2, pady=2)
+
+        # Orden de filas y columnas
+        tk.Label(self.toolbar_matrix, text="Orden").pack(side=tk.LEFT, padx=2, pady=2)
+        self.matrix_order = ttk.Combobox(self.toolbar_matrix, values=self.MATRIX_ORDERS, state="readonly", width=14)
+        self.matrix_order.set(self.MATRIX_ORDERS[0])
+        self.matrix_order.pack(side=tk.LEFT, padx=2, pady=2)
+        self.matrix_order.bind("<<ComboboxSelected>>", lambda event: self.draw_matrix())
         self.toolbar_matrix.update()
         self.toolbar_matrix.pack(fill=tk.X)
 
@@ -201,11 +2414,11 @@ class GraphApp:
         tk.Label(frame, text="RELACIONES", font=("Arial", 12, "bold")).pack()
 
         # Obtener lista de códigos de los nodos existentes
-        nodes_codes = list(self.BD[self.BD["Tipo"].isin(["P","N"])]["Codigo"])
+        nodes_codes = self.model.codes_of_type(("P", "N"))
 
         # Treeview
         columns = ["Unidad 1", "Unidad 2"]
-        self.relations_tab_tree = ttk.Treeview(frame, columns=columns, height=3, show="headings")
+        self.relations_tab_tree = VirtualTreeview(frame, columns=columns, height=3, show="headings")
         tree_width = self.relations_tab_tree.winfo_width()
         for col in columns:
             self.relations_tab_tree.heading(col, text=col)
@@ -261,11 +2474,11 @@ class GraphApp:
         tk.Label(frame, text="EQUIVALENCIAS", font=("Arial", 12, "bold")).pack()
 
         # Obtener lista de códigos de los nodos existentes
-        nodes_codes = list(self.BD[self.BD["Tipo"].isin(["P","N"])]["Codigo"])
+        nodes_codes = self.model.codes_of_type(("P", "N"))
         
         # Treeview
         columns = ["Unidad 1", "Unidad 2"]
-        self.equivalences_tab_tree = ttk.Treeview(frame, columns=columns, height=3, show="headings")
+        self.equivalences_tab_tree = VirtualTreeview(frame, columns=columns, height=3, show="headings")
         tree_width = self.equivalences_tab_tree.winfo_width()
         for col in columns:
             self.equivalences_tab_tree.heading(col, text=col)
@@ -349,7 +2562,7 @@ class GraphApp:
         frame_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
 
         # Treeview
-        self.nodes_fact_tab_tree = ttk.Treeview(frame_tree, columns=("Unidad 1", "Unidad 2"), height=3, show="headings")
+        self.nodes_fact_tab_tree = VirtualTreeview(frame_tree, columns=("Unidad 1", "Unidad 2"), height=3, show="headings")
         # self.nodes_fact_tab_tree.heading("Unidad 1", text="Unidad 1")
         # self.nodes_fact_tab_tree.heading("Unidad 2", text="Unidad 2")
         self.nodes_fact_tab_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -382,11 +2595,11 @@ class GraphApp:
         tk.Label(frame, text="AGRUPAMIENTO", font=("Arial", 12, "bold")).pack()
 
         # Obtener lista de códigos de los nodos existentes
-        nodes_codes = list(self.BD[self.BD["Tipo"] == "H"]["Codigo"])
+        nodes_codes = self.model.codes_of_type(("H",))
 
         # Treeview
         columns = ["Hecho", "Unidades"]
-        self.facts_tab_tree = ttk.Treeview(frame, columns=columns, height=3, show="headings")
+        self.facts_tab_tree = VirtualTreeview(frame, columns=columns, height=3, show="headings")
         tree_width = self.facts_tab_tree.winfo_width()
         for col in columns:
             self.facts_tab_tree.heading(col, text=col)
@@ -459,7 +2672,7 @@ class GraphApp:
         frame_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
 
         # Treeview
-        self.nodes_tab_tree = ttk.Treeview(frame_tree, columns=("Unidad 1", "Unidad 2"), height=3, show="headings")
+        self.nodes_tab_tree = VirtualTreeview(frame_tree, columns=("Unidad 1", "Unidad 2"), height=3, show="headings")
         self.nodes_tab_tree.heading("Unidad 1", text="Unidad 1")
         self.nodes_tab_tree.heading("Unidad 2", text="Unidad 2")
         self.nodes_tab_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -653,7 +2866,7 @@ class GraphApp:
             self.phase_color_tab_tree.heading(col, text=col)
             self.phase_color_tab_tree.column(col, anchor="center")
         
-        phases = self.BD['Fase'].unique()
+        phases = self.model.phases()
         for phase in phases:
             if phase != '':
                 self.phase_color_tab_tree.insert("", "end", values=(str(phase), "#0080ff"))
@@ -715,7 +2928,7 @@ class GraphApp:
         scrollbar = ttk.Scrollbar(frame_listbox, orient=tk.VERTICAL)
         scrollbar.pack(fill=tk.BOTH, side=tk.LEFT)
 
-        for col in self.BD.columns:
+        for col in self.model.columns:
             self.filter_listbox.insert(tk.END, str(col))        
 
         self.filter_listbox.config(yscrollcommand = scrollbar.set) 
@@ -740,7 +2953,8 @@ class GraphApp:
     # Cerrar ventanas
 
     def cerrar_ventana_principal(self):
-        if len(self.undo_stack) > 0:
+        respuesta = None
+        if len(self.undo_stack) > 0 or (self.journal is not None and self.journal.entries > 0):
             respuesta = messagebox.askyesnocancel(
                 "Cambios no guardados",
                 "Tienes cambios sin guardar. ¿Deseas guardar antes de salir?"
@@ -755,7 +2969,11 @@ class GraphApp:
                 else:
                     self.save_csv()
 
+        # Si se ha guardado el diario queda vacío; si se descartan los cambios, también sobra
+        self.close_journal(remove=respuesta is False or self.journal is None or self.journal.entries == 0)
+
         print("Cerrando la ventana principal...")
+        self.jobs.cancel_all()
         root.quit()  # Termina el bucle principal de tkinter
         root.destroy()  # Asegura que todos los recursos de la ventana sean liberados
         exit()  # Finaliza el programa completamente (si es necesario)
@@ -776,317 +2994,285 @@ class GraphApp:
 
     # Cargar el BD
 
-    def upload_BD(self, df=None):
+    def upload_BD(self, df=None, model=None):
         # Limpiar estructuras previas
         self.clean_structures()
-        
+
+        # El modelo puede venir ya construido desde un trabajo en segundo plano
+        self.model = self.build_model(df) if model is None else model
+
+    def build_model(self, df):
+        """Crea el modelo a partir de la tabla del CSV. No toca la interfaz."""
         # Crear un DataFrame para 'tabla', con las columnas del CSV más 'Codigo'
-        self.BD = df
-        self.BD.insert(0, "Codigo", None)
-
-        for idx, row in df.iterrows():
-            # Codigo
-            # codigo = self.generate_numerical_code()  # Supongo que esta función existe
-            codigo = self.BD.at[idx, "Nombre"]
-            self.BD.at[idx, "Codigo"] = codigo
-
-        for idx, row in df.iterrows():
-            # Hijos
-            sons = str(row.get("Hijos", "")).split(',') if pd.notna(row.get("Hijos")) else []
-            sons_codes = []
-            for son in sons:
-                son = son.strip()
-                if son:
-                    son_code = self.name_to_code(son)
-                    sons_codes.append(son_code)
-            sons_codes = ",".join(map(str, sons_codes))
-            self.BD.at[idx, "Hijos"] = sons_codes
-        
-            # Equivalences
-            equis = str(row.get("Equivalencias", "")).split(',') if pd.notna(row.get("Equivalencias")) else []
-            equis_codes = []
-            for equi in equis:
-                equi = equi.strip()
-                if equi:
-                    equi_code = self.name_to_code(equi)
-                    equis_codes.append(equi_code)
-            equis_codes = ",".join(map(str, equis_codes))
-            self.BD.at[idx, "Equivalencias"] = equis_codes
-        
-            # Facts
-            fact_values = str(row.get("Hecho", "")).split(',') if pd.notna(row.get("Hecho")) else []
-            fact_codes = []
-            for fact in fact_values:
-                fact = fact.strip()
-                if fact:
-                    fact_code = self.name_to_code(fact)
-                    fact_codes.append(fact_code)
-            fact_codes = ",".join(map(str, fact_codes))
-            self.BD.at[idx, "Hecho"] = fact_codes
-        
+        # codigo = self.generate_numerical_code()  # Supongo que esta función existe
+        df.insert(0, "Codigo", df["Nombre"])
+
+        # Crear el modelo a partir de la tabla
+        return StratigraphicModel.from_dataframe(df)
+
         #print(self.BD)
 
+    @property
+    def BD(self):
+        """Vista DataFrame del modelo. Solo se regenera si el modelo ha cambiado."""
+        if self.model is None:
+            return None
+        if self._BD_view_version != self.model.version:
+            self._BD_view = self.model.to_dataframe()
+            self._BD_view_version = self.model.version
+        return self._BD_view
+
+    def export_dataframe(self, codes=None):
+        """DataFrame listo para guardar: relaciones por 'Nombre' y sin la columna 'Codigo'."""
+        return self.model.to_dataframe(codes, use_names=True).drop(columns="Codigo")
+
     # Funciones de cargar/descargar archivo
 
     def upload_CSV(self):
         # Cargar archivo
-        file = filedialog.askopenfilename(title="Seleccionar archivo CSV", filetypes=[("Archivos CSV", "*.csv")])
+        file = filedialog.askopenfilename(title="Seleccionar archivo CSV o proyecto", filetypes=self.FILE_TYPES)
 
         if not file:
             return
-        
+
+        # Lectura, validación y creación del modelo en segundo plano
+        self.jobs.submit("upload", "Cargando archivo", lambda job: self.read_CSV(job, file),
+                         lambda result: self.finish_upload_CSV(file, result))
+
+    def read_CSV(self, job, file):
+        """Lee, valida y convierte el CSV en un modelo. Se ejecuta en segundo plano: no toca la interfaz.
+
+        Devuelve ('model', modelo), ('project', (modelo, personalización)) o el tipo y el contenido del error.
+        """
+        job.report(0, "Leyendo")
+        if file.lower().endswith(ProjectFile.EXTENSION):
+            # El proyecto lo escribe HAMMON a partir de un modelo ya validado
+            try:
+                return "project", ProjectFile.load(file)
+            except Exception as e:
+                return "read_error", str(e)
         try:
             df = pd.read_csv(file, sep=";", engine='python', dtype=str)
         except Exception as e:
-            messagebox.showerror("Error", f"No se pudo leer el archivo CSV.\n{str(e)}")
-            return
+            return "read_error", str(e)
         
         df.columns = df.columns.str.strip()  # Limpiar espacios en los nombres de las columnas
         df = df.fillna("")  # Reemplazar NaN con cadenas vacías
         df = df.astype(str)
 
-        def limpiar_lista_string(s):
-            return ",".join(part.strip() for part in s.split(",")) if isinstance(s, str) else s
-
+        # Quitar espacios alrededor de cada elemento de las listas separadas por comas
         for col in df.columns:
             if df[col].dtype == "object" or df[col].dtype == "string":
                 if col in ("Nombre", "Hijos", "Equivalencias", "Hecho", "Tipo", "Fase"):
-                    df[col] = df[col].map(limpiar_lista_string)
+                    df[col] = df[col].str.replace(r"\s*,\s*", ",", regex=True).str.strip()
 
         #df = df.applymap(lambda x: x.replace(" ", "") if isinstance(x, str) else x)
         #print(df) 
 
-        # Si la revisión del archivo es correcta
-        if self.check_file(df):
+        # Revisión del archivo
+        job.report(30, "Validando")
+        message = FileChecker.check_columns(df)
+        if message:
+            return "columns", message
+        errors = FileChecker(df).check()
+        if errors:
+            return "errors", errors
+
+        job.report(70, "Creando el modelo")
+        return "model", self.build_model(df)
+
+    def finish_upload_CSV(self, file, result):
+        kind, value = result
+        if kind == "read_error":
+            messagebox.showerror("Error", f"No se pudo leer el archivo CSV.\n{value}")
+        elif kind == "columns":
+            messagebox.showerror("Error", value)
+        elif kind == "errors":
+            self.show_file_errors(value)
+        else:
+            settings = None
+            if kind == "project":
+                value, settings = value
+
+            # Cambios sin guardar de una sesión anterior que se cerró sin guardar
+            recovered = 0
+            if file is not None:
+                value, recovered = self.recover_journal(file, value)
 
             # Cargar a BD
-            self.upload_BD(df)
+            self.upload_BD(model=value)
 
             # Actualizar
             self.reset_apply_facts()
             self.reset_filter_widgets_PART_1()
             #self.update_all()
+            self.reset_change_tracking()
             self.update_nodes_tab()
             self.update_relations_tab()
             self.update_equivalences_tab()
             self.update_facts_tab()
             self.update_widgets()
             self.reset_custom_tab()
+            if settings:
+                self.apply_project_settings(settings)
             self.reset_filter_widgets_PART_2()
-            self.draw_figure()
-            if len(self.not_drawn_nodes) > 0:
-                mensaje = "Las siguientes unidades estratigráficas no tienen padre, hijos o equivalencias, por lo que no se han dibujado:\n"
-                mensaje += ", ".join(self.not_drawn_nodes)
-                messagebox.showinfo("Advertencia", mensaje)
+            self.draw_figure(then=self.show_not_drawn_nodes)
             self.uploaded_file = file
+            if file is None:
+                # Lo abierto desde el archivo de excavaciones no tiene un archivo sobre el que guardar
+                self.close_journal(remove=True)
+            else:
+                self.open_journal(file, recovered)
         print("Uploading finished")
 
-    def check_file(self, df):
-        main_columns = ["Nombre", "Hijos", "Equivalencias", "Hecho", "Tipo", "Fase", "Descripcion"]
+    # Diario de autoguardado
 
-        # Comprobar que las columnas principales existen
-        if not all(col in df.columns for col in main_columns):
-            messagebox.showerror("Error", f"El archivo CSV no contiene alguna de las siguientes columnas: {main_columns}.")
-            return False
-        
-        # Comprobar que en las columnas no existe una columna con el nombre 'Codigo'
-        if 'Codigo' in df.columns:
-            messagebox.showerror("Error", f"El archivo CSV no puede contener una columna de nombre 'Codigo'.")
-            return False
-        
-        # Comprobar que no hay dos columnas con el mismo nombre
-        # Cuando hay dos columnas con el mismo nombre en el CSV, la segunda columna con el mismo nombre se carga con “nombre.X”, siendo X el número de veces que se repite.
-        if any(df.columns.duplicated()):
-            messagebox.showerror("Error", f"El archivo CSV contiene columnas duplicadas.")
-            return False
+    def recover_journal(self, file, model):
+        """Si el CSV tiene un diario de una sesión anterior, ofrece reproducirlo sobre el modelo cargado.
 
-        # ---- NAME ----
-        # Comprobar que en "Nombre" no hay nombres con , o ;
-        df_with_commas_semicolons = df[df['Nombre'].str.contains('[,;]', regex=True)]
-        if len(df_with_commas_semicolons) > 0:
-            messagebox.showerror("Error", f"No puede haber caracteres ',' o ';' dentro del nombre. Unidades {list(df_with_commas_semicolons["Nombre"])}")
-            return False
+        Devuelve el modelo resultante y el número de operaciones recuperadas.
+        """
+        try:
+            operations = EditJournal.read(file)
+        except OSError:
+            return model, 0
+        if not operations:
+            return model, 0
+        if not messagebox.askyesno("Recuperar cambios",
+                                   f"Hay {len(operations)} cambios sin guardar de una sesión anterior. ¿Deseas recuperarlos?"):
+            return model, 0
+        try:
+            recovered = EditJournal.replay(model.copy(), operations)
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudieron recuperar los cambios: {e}")
+            return model, 0
+        return recovered, len(operations)
+
+    def open_journal(self, file, entries=0):
+        """Empieza a anotar las ediciones en el diario del archivo, o sigue el recuperado con 'entries' operaciones."""
+        self.close_journal(remove=self.journal is not None and self.journal.path != file + EditJournal.SUFFIX)
+        journal = EditJournal(file, self.root, self.JOURNAL_SYNC_MS)
+        try:
+            if entries:
+                journal.resume(entries)
+            else:
+                journal.start()
+        except OSError as e:
+            messagebox.showwarning("Aviso", f"No se pudo crear el archivo de autoguardado: {e}")
+            return
+        self.journal = journal
+        self.model.journal = journal
 
-        # Comprobar que no hay filas sin nombre
-        df_without_name = df[df['Nombre'] == '']
-        # print(df_without_name)
-        if len(df_without_name) > 0:
-            messagebox.showerror("Error", f"No puede haber filas sin 'Nombre'. Filas: {df_without_name.index.tolist()}")
-            return False
-    
-        # Encontrar índices de las filas duplicadas en la columna 'Nombre'
-        df_duplicated_names = df[df['Nombre'].duplicated()]
-        if len(df_duplicated_names) > 0:
-            messagebox.showerror("Error", f"No puede haber duplicados en 'Nombre'. Filas: {list(df_duplicated_names["Nombre"])}")
-            return False
-        
-        names = []
-        sons = []
-        equi = []
-        facts = []
-        for _, row in df.iterrows():
-            names.append(row.get("Nombre", ""))
-            sons.append(str(row.get("Hijos", "")).split(',') if pd.notna(row.get("Hijos")) else [])
-            equi.append(str(row.get("Equivalencias", "")).split(',') if pd.notna(row.get("Equivalencias")) else [])
-            facts.append(str(row.get("Hecho", "")).split(',') if pd.notna(row.get("Hecho")) else [])
-
-        # Comprobar que los valores en 'Hijos', 'Equivalencias' y 'Hecho' están en 'Nombre', si no están vacíos
-        for index, (hijos, equivalencias, nodos_hechos) in enumerate(zip(sons, equi, facts)):
-            for hijo in hijos:
-                if hijo and hijo not in names:
-                    messagebox.showerror("Error", f"El valor '{hijo}' en 'Hijos' no está en 'Nombre'. Fila {index}")
-                    return False
-            for equivalente in equivalencias:
-                if equivalente and equivalente not in names:
-                    messagebox.showerror("Error", f"El valor '{equivalente}' en 'Equivalencias' no está en 'Nombre'. Fila {index}")
-                    return False
-            for nodo_hecho in nodos_hechos:
-                if nodo_hecho and nodo_hecho not in names:
-                    messagebox.showerror("Error", f"El valor '{nodo_hecho}' en 'Hecho' no está en 'Nombre'. Fila {index}")
-                    return False
-        
-        # Comprobar que no está el mismo valor en "Nombre", "Hijos", "Equivalencias" o "Hecho" en la misma fila
-        def indices_con_duplicados(df):
-            columnas = ['Nombre', 'Hijos', 'Equivalencias', 'Hecho']
-            # indices = []
-            duplicates = []
-
-            for idx, row in df.iterrows():
-                # Obtener valores, convertirlos en string y filtrar vacíos
-                valores = self.get_values_from_string(",".join([str(row["Nombre"]), str(row["Hijos"]), str(row["Equivalencias"]), str(row["Hecho"])]))
-                #print(f"{valores} <=> {set(valores)}; {len(valores)} <=> {len(set(valores))}")
-                if len(valores) != len(set(valores)):
-                    # indices.append(idx)
-                    duplicates.append(str(row["Nombre"]))
-
-            return duplicates
-        duplicados = indices_con_duplicados(df)
-
-        if len(duplicados) > 0:
-            messagebox.showerror("Error", f"No puede haber valores duplicados en 'Nombre', 'Hijos', 'Equivalencias' y 'Hecho'. Unidades: {duplicados}")
-            return False
-        
-        # No puede haber ciclos padre-hijo
-        # Crear un grafo dirigido
-        G = nx.DiGraph()
+    def attach_journal(self, model):
+        """El diario sigue al modelo actual; si es otro (una copia restaurada), se anota completo."""
+        if self.journal is None or model is self.model:
+            return
+        self.model.journal = None
+        model.journal = self.journal
+        self.journal.write_model(model)
 
-        # Llenar el grafo con las relaciones padre-hijo
-        for index, row in df.iterrows():
-            father = row['Nombre']
-            # print(f"FATHER: {father}")
-            sons = row.get("Hijos", "").split(',') if pd.notna(row.get("Hijos")) else []
-            for son in sons:
-                G.add_edge(father, son)
-                """# PARENT EQUIVALENCES
-                print("FATHER")
-                equi_str_father = df.loc[df["Nombre"] == father, "Equivalencias"].values
-                father_equis = []
-                if len(equi_str_father) > 0 and isinstance(equi_str_father[0], str) and not equi_str_father[0].isspace():  # Verificar si hay hijos
-                    father_equis = equi_str_father[0].split(",")  # Convertir a lista
-                if len(father_equis) > 0:
-                    for father_equi in father_equis:
-                            if father_equi != '':
-                                print(f"{father_equi} - {son}")
-                                G.add_edge(father_equi, son)
-                # SON EQUIVALENCES
-                print("SON")
-                #son_equis = self.get_equivalences(son)
-                equi_str_son = df.loc[df["Nombre"] == son, "Equivalencias"].values
-                son_equis = []
-                if len(equi_str_son) > 0 and isinstance(equi_str_son[0], str) and not equi_str_son[0].isspace():  # Verificar si hay hijos
-                    son_equis = equi_str_son[0].split(",")  # Convertir a lista
-                if len(son_equis) > 0:
-                    for son_equi in son_equis:
-                            if son_equi != '':
-                                print(f"{father} - {son_equi}")
-                                G.add_edge(father, son_equi)"""
-            facts = row.get("Hecho", "").split(',') if pd.notna(row.get("Hecho")) else []
-            for fact in facts:
-                G.add_edge(father, fact)
-
-        # Detectar ciclos
-        cycles = list(nx.simple_cycles(G))
-
-        # Comprobar si existen ciclos
-        if cycles:
-            mensaje = "Se han encontrado ciclos: "
-            for cycle in cycles:
-                mensaje += "".join(" -> ".join(cycle)) + "; "
-            messagebox.showerror("Error", mensaje)
-            return False
+    def close_journal(self, remove=False):
+        if self.journal is None:
+            return
+        if self.model is not None:
+            self.model.journal = None
+        try:
+            self.journal.close(remove)
+        except OSError:
+            pass
+        self.journal = None
 
-        # La equivalencia se debe indicar en 'Equivalencias' de ambos nodos
-        for name, equivalences in zip(names, equi):
-            for eq in equivalences:
-                # Comprobar bidireccionalidad
-                if eq and name not in df[df['Nombre'] == eq]['Equivalencias'].values[0]:
-                    messagebox.showerror("Error", f"La equivalencia entre '{name}' y '{eq}' no es bidireccional.")
-                    return False
-                if name and eq:
-                    # Comprobar que los nodos en cada equivalencia tienen los mismos padres
-                    if not self.contains_both(df, name, eq, 'Hijos'):
-                        messagebox.showerror("Error", f"Los nodos equivalentes '{name}' y '{eq}' no tienen los mismos padres")
-                        return False
-                    # Comprobar que los nodos en cada equivalencia tienen los mismos hijos
-                    # Paso 1-3: dividir, limpiar espacios y convertir en conjuntos
-                    set_a = set(item.strip() for item in df[df['Nombre'] == name]['Hijos'].values[0].split(','))
-                    set_b = set(item.strip() for item in df[df['Nombre'] == eq]['Hijos'].values[0].split(','))
-                    if set_a != set_b:
-                        messagebox.showerror("Error", f"Los nodos equivalentes '{name}' y '{eq}' no tienen los mismos hijos")
-                        return False
-        
-    
-        # Comprobar que no haya valores duplicados en 'Hecho'
-        df_all_facts = df['Hecho'].str.split(',').explode()
-        df_all_facts = df_all_facts[df_all_facts != '']
-        duplicated_values = df_all_facts[df_all_facts.duplicated()]
+    def show_not_drawn_nodes(self):
+        if len(self.not_drawn_nodes) > 0:
+            mensaje = "Las siguientes unidades estratigráficas no tienen padre, hijos o equivalencias, por lo que no se han dibujado:\n"
+            mensaje += ", ".join(self.not_drawn_nodes)
+            messagebox.showinfo("Advertencia", mensaje)
 
-        if len(duplicated_values) > 0:
-            messagebox.showerror("Error", f"No puede haber duplicados en 'Hecho'. Unidades: {list(df.loc[duplicated_values.index.tolist(), "Nombre"])}")
-            return False
+    def show_file_errors(self, errors):
+        """Ventana con la lista de errores del archivo, que se puede recorrer y exportar a CSV."""
+        popup = tk.Toplevel(root)
+        popup.title("Errores en el archivo")
+        popup.geometry("700x400")
+
+        tk.Label(popup, text=f"Se han encontrado {len(errors)} errores. El archivo no se ha cargado.").pack(pady=5)
+
+        frame = tk.Frame(popup)
+        frame.pack(fill="both", expand=True, padx=5)
+        tree = ttk.Treeview(frame, columns=FileChecker.COLUMNS, show="headings")
+        for col in FileChecker.COLUMNS:
+            tree.heading(col, text=col)
+            tree.column(col, anchor="center")
+        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side="right", fill="y")
+        tree.pack(side="left", fill="both", expand=True)
+        for error in errors:
+            tree.insert("", "end", values=error)
+
+        tk.Button(popup, text="Exportar errores", command=lambda: self.download_file_errors(errors)).pack(pady=5)
+
+    def redundant_relations(self):
+        """Relaciones (padre, hijo) que se deducen de otras; None si hay un ciclo.
+
+        Solo cuentan las relaciones 'Hijos', como en la reducción que dibuja el grafo: ser equivalente de un
+        descendiente no hace redundante una relación.
+        """
+        return self.model.arrays().redundant_children
+
+    def show_redundant_relations(self):
+        """Ventana con las relaciones que ya se deducen de otras, para eliminarlas de una vez."""
+        redundant = self.redundant_relations()
+        if redundant is None:
+            messagebox.showerror("Error", "Las relaciones forman un ciclo: no se pueden buscar las redundantes.")
+            return
+        if not redundant:
+            messagebox.showinfo("Relaciones redundantes", "No hay relaciones redundantes.")
+            return
 
-        # Comprobar que no hay filas sin tipo
-        df_without_type = df[df['Tipo'] == '']
-        if len(df_without_type) > 0:
-            messagebox.showerror("Error", f"No puede haber filas sin 'Tipo'. Unidades: {list(df_without_type["Nombre"])}")
-            return False
-        
-        # Comprobar que en 'Tipo' solo hay tres valores: 'P' o 'N' o 'H'
-        df_incorrect_type = df[~df["Tipo"].isin(["P", "N", "H"])]
-        if len(df_incorrect_type) > 0:
-            messagebox.showerror("Error", f"La columna 'Tipo' solo puede contener los valores 'P', 'N' o 'H'. Unidades {list(df_incorrect_type["Nombre"])}")
-            return False
-        
-        # Comprobar que los nodos 'P' y 'N' no tienen información en 'Hecho'
-        df_PN = df[df["Tipo"].isin(['P','N'])]
-        df_incorrect_PN = df_PN[df_PN["Hecho"] != ""]
-        if len(df_incorrect_PN) > 0:
-            messagebox.showerror("Error", f"Los nodos 'P' y 'N' no pueden tener valores en 'Hecho'. Unidades {list(df_incorrect_PN["Nombre"])}")
-            return False
-        
-        # Comprobar que los nodos 'H' no tienen información en 'Hijos' o 'Equivalencias'
-        df_H = df[df["Tipo"] == "H"]
-        df_incorrect_H = df_H[(df_H["Hijos"] != "") | (df_H["Equivalencias"] != "")]
-        if len(df_incorrect_H) > 0:
-            messagebox.showerror("Error", f"Los nodos 'H' no pueden tener valores en 'Hijos' o 'Equivalencias'. Unidades {list(df_incorrect_H["Nombre"])}")
-            return False
-        
-        # Comprobar que en las relaciones y equivalencias de las unidades no hay hechos
-        fact_names = set(df_H['Nombre'].tolist())
+        popup = tk.Toplevel(root)
+        popup.title("Relaciones redundantes")
+        popup.geometry("500x400")
 
-        def contiene_nombre(cadena):
-            if pd.isna(cadena):
-                return False
-            valores = set(map(str.strip, cadena.split(',')))
-            return not fact_names.isdisjoint(valores)
-        
-        filtro = df_PN['Hijos'].apply(contiene_nombre) | df_PN['Equivalencias'].apply(contiene_nombre)
-        df_facts_in_rel_eq = df_PN[filtro].copy()
-        if len(df_facts_in_rel_eq) > 0:
-            messagebox.showerror("Error", f"Los nodos 'H' no pueden estar en 'Hijos' o 'Equivalencias'. Unidades {list(df_facts_in_rel_eq["Nombre"])}")
-            return False
+        tk.Label(popup, text=f"{len(redundant)} relaciones se deducen de otras y pueden eliminarse.").pack(pady=5)
 
-        return True
+        columns = ("Padre", "Hijo")
+        tree = VirtualTreeview(popup, columns=columns, show="headings")
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, anchor="center")
+        tree.pack(fill="both", expand=True, padx=5)
+        for relation in redundant:
+            tree.insert("", "end", values=relation)
+
+        tk.Button(popup, text="Eliminar todas", command=lambda: self.delete_redundant_relations(popup, redundant)).pack(pady=5)
+
+    def delete_redundant_relations(self, popup, relations):
+        # Una sola entrada de deshacer para todas
+        self.history.begin(self.model)
+        self.update_undo_redo_status()
+
+        for node_origin, node_destination in relations:
+            self.model.remove_child(node_origin, node_destination)
+
+        popup.destroy()
+        self.history.end(self.model)
+        self.update_all()
+
+    def download_file_errors(self, errors):
+        archivo = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            filetypes=[("Archivos CSV", "*.csv")],
+            title="Guardar errores"
+        )
+
+        if not archivo:
+            return  # El usuario canceló la operación
+
+        try:
+            pd.DataFrame(errors, columns=FileChecker.COLUMNS).to_csv(archivo, sep=";", index=False, encoding="utf-8-sig")
+            messagebox.showinfo("Éxito", "Los errores se han guardado correctamente.")
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudo guardar el archivo: {e}")
 
     def new_file(self):
         respuesta = messagebox.askyesnocancel("Aviso", f"Al generar un nuevo archivo se perderá todo el progreso. ¿Continuar?")
@@ -1095,44 +3281,29 @@ class GraphApp:
             return
         elif respuesta:
             self.uploaded_file = None # No hay un archivo "original" sobre el que guardar
+            self.close_journal(remove=True)
             self.upload_BD(self.graph_default())
             self.update_all()
         else:
             return
         
     def download_csv(self):
-        # Crear un DataFrame con los datos
-        df_to_download = self.BD.copy()
-
-        for idx, row in self.BD.iterrows():
-            for col in ["Hijos", "Equivalencias", "Hecho"]:
-                elements = str(row.get(col, "")).split(',') if pd.notna(row.get(col)) else []
-                elements_codes = []
-                for element in elements:
-                    element = element.strip()
-                    if element:
-                        element_code = self.code_to_name(element)
-                        elements_codes.append(element_code)
-                elements_codes = ",".join(map(str, elements_codes))
-                df_to_download.at[idx, col] = elements_codes
-        
-        df_to_download = df_to_download.drop(df_to_download.columns[0], axis=1).copy()
-
         # Abrir cuadro de diálogo para elegir ubicación
         archivo = filedialog.asksaveasfilename(
             defaultextension=".csv",
-            filetypes=[("Archivos CSV", "*.csv")],
-            title="Guardar archivo CSV"
+            filetypes=self.FILE_TYPES,
+            title="Guardar archivo CSV o proyecto"
         )
 
         if not archivo:
             return  # El usuario canceló la operación
 
         try:
-            # Guardar el DataFrame como CSV
-            df_to_download.to_csv(archivo, sep=";", index=False, encoding="utf-8-sig")
+            # Guardar como CSV o como proyecto
+            self.write_file(archivo)
             self.uploaded_file = archivo
-            messagebox.showinfo("Éxito", "El archivo CSV se ha guardado correctamente.")
+            self.open_journal(archivo)
+            messagebox.showinfo("Éxito", self.saved_message(archivo))
         except Exception as e:
             messagebox.showerror("Error", f"No se pudo guardar el archivo: {e}")
 
@@ -1142,35 +3313,54 @@ class GraphApp:
             messagebox.showerror("Error", "No hay un archivo CSV cargado para sobrescribir.")
             return
 
-        # Crear un DataFrame con los datos
-        df_to_save = self.BD.copy()
-
-        for idx, row in self.BD.iterrows():
-            for col in ["Hijos", "Equivalencias", "Hecho"]:
-                elements = str(row.get(col, "")).split(',') if pd.notna(row.get(col)) else []
-                elements_codes = []
-                for element in elements:
-                    element = element.strip()
-                    if element:
-                        element_code = self.code_to_name(element)
-                        elements_codes.append(element_code)
-                elements_codes = ",".join(map(str, elements_codes))
-                df_to_save.at[idx, col] = elements_codes
-
-        df_to_save = df_to_save.drop(df_to_save.columns[0], axis=1).copy()
-
         try:
             # Sobrescribir el archivo original
-            df_to_save.to_csv(self.uploaded_file, sep=";", index=False, encoding="utf-8-sig")
-            messagebox.showinfo("Éxito", "El archivo CSV se ha guardado correctamente.")
+            self.write_file(self.uploaded_file)
+            self.open_journal(self.uploaded_file)
+            messagebox.showinfo("Éxito", self.saved_message(self.uploaded_file))
         except Exception as e:
             messagebox.showerror("Error", f"No se pudo guardar el archivo: {e}")
 
+    def write_file(self, path):
+        """Guarda el modelo como proyecto o como CSV según la extensión del archivo."""
+        if path.lower().endswith(ProjectFile.EXTENSION):
+            ProjectFile.save(path, self.model, self.project_settings())
+        else:
+            self.export_dataframe().to_csv(path, sep=";", index=False, encoding="utf-8-sig")
+
+    def saved_message(self, path):
+        if path.lower().endswith(ProjectFile.EXTENSION):
+            return "El proyecto se ha guardado correctamente."
+        return "El archivo CSV se ha guardado correctamente."
+
+    def project_settings(self):
+        """Personalización del grafo que se guarda en el proyecto."""
+        return {
+            "relations": [self.relation_color, self.style_relations.get(), self.arrowstyle_relations.get(), self.width_relations.get()],
+            "equivalences": [self.equi_color, self.style_equivalences.get(), self.arrowstyle_equivalences.get(), self.width_equivalences.get()],
+            "phases": [list(self.phase_color_tab_tree.item(item, "values")) for item in self.phase_color_tab_tree.get_children()],
+        }
+
+    def apply_project_settings(self, settings):
+        if "relations" in settings:
+            self.relation_color, style, arrowstyle, width = settings["relations"]
+            self.style_relations.set(style)
+            self.arrowstyle_relations.set(arrowstyle)
+            self.width_relations.set(width)
+        if "equivalences" in settings:
+            self.equi_color, style, arrowstyle, width = settings["equivalences"]
+            self.style_equivalences.set(style)
+            self.arrowstyle_equivalences.set(arrowstyle)
+            self.width_equivalences.set(width)
+        colors = dict(settings.get("phases", []))
+        for item in self.phase_color_tab_tree.get_children():
+            phase = self.phase_color_tab_tree.item(item, "values")[0]
+            if phase in colors:
+                self.phase_color_tab_tree.item(item, values=(phase, colors[phase]))
+
     def download_filtered_csv(self):
         # Tomar todos los nodos en los treeview de relaciones y equivalencias
         open_nodes = []
-        closed_nodes = []
-        closed_indexes = []
 
         for item in self.relations_tab_tree.get_children():
             item = self.relations_tab_tree.item(item, "values")
@@ -1182,55 +3372,29 @@ class GraphApp:
             open_nodes.append(item[0]) # Nodo 1
             open_nodes.append(item[1]) # Nodo 2
         
-        open_nodes = list(set(open_nodes))
-
-        while len(open_nodes) > 0:
-            
-            # Tomamos el primer nodo
-            node = open_nodes.pop()
-            df_row = self.BD[self.BD["Codigo"] == node]
-            row_index = self.BD[self.BD["Codigo"] == node].index[0]
-            #print(df_row)
-            #print(self.BD.at[row_index, "Tipo"])
-
-            if self.BD.at[row_index, "Tipo"] == "H":
-                fact_nodes = str(self.BD.at[row_index, "Hecho"]).split(',') if pd.notna(self.BD.at[row_index, "Hecho"]) else []
-                for fact_node in fact_nodes:
-                    if fact_node not in closed_nodes:
-                        open_nodes.append(fact_node)
-                closed_nodes.append(node)
-            else:
-                closed_nodes.append(node)
-            closed_indexes.append(row_index)
-        
-        closed_nodes = list(set(closed_nodes))
-        closed_indexes = list(set(closed_indexes))
-        indexes_of_rows_to_delete = [i for i in range(len(self.BD)) if i not in closed_indexes]
-        #print(indexes_of_rows_to_delete)
-
-        df_to_download = self.BD.copy()
-        df_to_download = df_to_download.drop(indexes_of_rows_to_delete)
-        #df_to_download = df_to_download.reset_index(drop=True, inplace=True)
-
-        for idx, row in df_to_download.iterrows():
-            code = str(row.get("Codigo", ""))
-            for col in ["Hijos", "Equivalencias", "Hecho"]:
-                elements = str(row.get(col, "")).split(',') if pd.notna(row.get(col)) else []
+        # Añadir los miembros de los hechos, recursivamente
+        arrays = self.model.arrays()
+        closed_mask = arrays.closure(arrays.to_ids(set(open_nodes)), "fact_members")
+        # Los identificadores son las filas: se mantiene el orden de la BD
+        closed_codes = arrays.to_codes(np.flatnonzero(closed_mask))
+        closed_nodes = set(closed_codes)
+
+        df_to_download = self.export_dataframe(closed_codes)
+
+        for col in StratigraphicModel.RELATION_COLUMNS:
+            adjacency = self.model.relation_adjacency(col)
+            column_values = []
+            for code in closed_codes:
                 elements_codes = []
-                for element in elements:
-                    element = element.strip()
-                    if element and element in closed_nodes:
+                for element in adjacency[code]:
+                    if element in closed_nodes:
                         if col == "Hijos" and not self.exists_relation(self.find_fact_with_path(code), self.find_fact_with_path(element)):
                             continue
                         if col == "Equivalencias" and not self.exists_equivalencie(self.find_fact_with_path(code), self.find_fact_with_path(element)):
                             continue
-                        element_code = self.code_to_name(element)
-                        elements_codes.append(element_code)
-                elements_codes = ",".join(map(str, elements_codes))
-                df_to_download.at[idx, col] = elements_codes
-
-
-        df_to_download = df_to_download.drop(df_to_download.columns[0], axis=1).copy()
+                        elements_codes.append(self.code_to_name(element))
+                column_values.append(",".join(elements_codes))
+            df_to_download[col] = column_values
         #df_to_download = df_to_download.reindex(columns=['Nombre', 'Hijos', 'Equivalencias', 'Hecho', 'Tipo', 'Fase', 'Descripcion'])
 
         print(df_to_download)
@@ -1248,21 +3412,123 @@ class GraphApp:
         try:
             # Guardar el DataFrame como CSV
             df_to_download.to_csv(archivo, sep=";", index=False, encoding="utf-8-sig")
+            # El diario sigue en el archivo completo: las ediciones siguientes son del modelo entero
             self.uploaded_file = archivo
             messagebox.showinfo("Éxito", "El archivo CSV se ha guardado correctamente.")
         except Exception as e:
             messagebox.showerror("Error", f"No se pudo guardar el archivo: {e}")
 
+    # Archivo de excavaciones
+
+    def store_in_archive(self):
+        archivo = filedialog.asksaveasfilename(
+            defaultextension=SiteArchive.EXTENSION,
+            filetypes=self.ARCHIVE_TYPES,
+            title="Guardar en archivo de excavaciones",
+            confirmoverwrite=False
+        )
+
+        if not archivo:
+            return  # El usuario canceló la operación
+
+        default = os.path.splitext(os.path.basename(self.uploaded_file))[0] if self.uploaded_file else ""
+        name = simpledialog.askstring("Archivo de excavaciones", "Nombre del yacimiento o campaña:", initialvalue=default)
+        if not name:
+            return
+
+        try:
+            with SiteArchive(archivo) as archive:
+                exists = name in archive.sites()
+        except sqlite3.Error as e:
+            messagebox.showerror("Error", f"No se pudo abrir el archivo: {e}")
+            return
+        if exists and not messagebox.askyesno("Aviso", f"'{name}' ya está en el archivo. ¿Deseas sustituirlo?"):
+            return
+
+        # Se guarda una copia: el modelo se puede seguir editando mientras tanto
+        model = self.model.copy()
+
+        def work(job):
+            job.report(0, "Guardando")
+            with SiteArchive(archivo) as archive:
+                archive.store(name, model)
+
+        self.jobs.submit("archive", "Guardando en el archivo", work,
+                         lambda result: messagebox.showinfo("Éxito", f"'{name}' se ha guardado en el archivo de excavaciones."))
+
+    def open_from_archive(self):
+        archivo = filedialog.askopenfilename(title="Abrir archivo de excavaciones", filetypes=self.ARCHIVE_TYPES)
+
+        if not archivo:
+            return
+
+        try:
+            with SiteArchive(archivo) as archive:
+                sites = archive.sites()
+        except sqlite3.Error as e:
+            messagebox.showerror("Error", f"No se pudo abrir el archivo: {e}")
+            return
+        if not sites:
+            messagebox.showinfo("Aviso", "El archivo de excavaciones está vacío.")
+            return
+
+        popup = tk.Toplevel(root)
+        popup.title("Abrir de archivo de excavaciones")
+        popup.geometry("350x400")
+
+        tk.Label(popup, text="Yacimiento o campaña").pack(pady=5)
+        listbox = tk.Listbox(popup, exportselection=False)
+        for site in sites:
+            listbox.insert(tk.END, site)
+        listbox.selection_set(0)
+        listbox.pack(fill="both", expand=True, padx=5)
+
+        # Solo se cargan las unidades que pasan el filtro (y las relacionadas con ellas)
+        tk.Label(popup, text="Filtro (vacío: toda la matriz)").pack(pady=5)
+        filter_entry = tk.Entry(popup)
+        filter_entry.pack(fill="x", padx=5)
+        full_words = tk.BooleanVar(value=False)
+        tk.Checkbutton(popup, text="Palabras completas", variable=full_words).pack(anchor="w", padx=5)
+        related = tk.BooleanVar(value=True)
+        tk.Checkbutton(popup, text="Con ancestros y descendientes", variable=related).pack(anchor="w", padx=5)
+
+        tk.Button(popup, text="Abrir", command=lambda: self.load_from_archive(
+            popup, archivo, sites[(listbox.curselection() or (0,))[0]], filter_entry.get(), full_words.get(), related.get())
+        ).pack(pady=5)
+
+    def load_from_archive(self, popup, archivo, name, filtro, full_words, related):
+        """Carga del archivo la matriz de un yacimiento, o solo la parte que pasa el filtro."""
+        popup.destroy()
+        terms = [term for term in (item.strip() for item in filtro.split(",")) if term]
+
+        def work(job):
+            job.report(0, "Buscando")
+            with SiteArchive(archivo) as archive:
+                codes = None
+                if terms:
+                    codes = archive.search(name, terms, full_words=full_words)
+                    if related:
+                        codes = archive.ancestors(name, codes) | archive.descendants(name, codes)
+                    codes = archive.with_fact_members(name, archive.with_equivalents(name, codes))
+                job.report(50, "Cargando")
+                return "model", archive.load(name, codes)
+
+        self.jobs.submit("upload", "Cargando del archivo", work, lambda result: self.finish_upload_CSV(None, result))
+
     # Funciones de actualización
 
     def update_all(self):
-        self.todos_los_hechos = {
-            str(row['Codigo']): set(row['Hecho'].split(','))
-            for _, row in self.BD.iterrows()
-        }
         self.entries_strings = self.get_values_from_string(str(self.facts_entry.get()))
-        self.hechos_visibles = {clave: valor for clave, valor in self.todos_los_hechos.items() if clave in self.entries_strings}
+        previous_resolution = self.outermost_visible_fact
+        self.update_fact_resolution()
 
+        # Si solo han cambiado unas pocas unidades o aristas, se actualiza solo lo afectado
+        if (self._synced_model is self.model and self._synced_filter == self.filter_key()
+                and self.outermost_visible_fact == previous_resolution):
+            self.apply_changes(self.model.take_changes())
+            return
+
+        self.reset_change_tracking()
         self.update_nodes_tab()
         self.update_relations_tab()
         self.update_equivalences_tab()
@@ -1270,76 +3536,84 @@ class GraphApp:
         self.update_widgets()
         self.draw_figure()
         # print(self.BD)
+
+    def filter_key(self):
+        """Estado del filtro del que dependen las pestañas."""
+        return (self.filtro, self.filter_listbox.curselection(), self.filterApplyMayMin.get(),
+                self.filterApplyFullWords.get(), self.filterApplyDiacritics.get())
+
+    def reset_change_tracking(self):
+        """Descarta los cambios pendientes: las pestañas se van a reconstruir desde el modelo."""
+        self.model.take_changes()
+        self._synced_model = self.model
+        self._synced_filter = self.filter_key()
+
+    def apply_changes(self, changes):
+        """Refleja en la interfaz solo las unidades y aristas que han cambiado en el modelo."""
+        if not changes:
+            return
+
+        dirty_units = changes.units | changes.removed
+        if self.filtro != "":
+            # Con filtro, las columnas de relación también deciden qué unidades se muestran
+            for edges in changes.edges.values():
+                for edge in edges:
+                    dirty_units.update(edge)
+        flipped = self.update_nodes_rows(dirty_units, changes.renamed)
+        flipped -= changes.added | changes.removed | set(changes.renamed.values())
+
+        changed_columns = set()
+        if flipped:
+            # Se muestran u ocultan unidades con aristas ya cargadas: se rehacen las pestañas de aristas
+            self.update_relations_tab()
+            self.update_equivalences_tab()
+            self.update_facts_tab()
+            changed_columns.update(StratigraphicModel.RELATION_COLUMNS)
+        else:
+            for column, edges in changes.edges.items():
+                if self.update_edge_rows(column, edges):
+                    changed_columns.add(column)
+
+        if changes.added or changes.removed or changes.renamed or changes.columns & {"Tipo", "Fase"}:
+            self.update_widgets()
+
+        # El grafo y la matriz solo dependen de las relaciones, las equivalencias y el tipo y fase de sus nodos
+        drawn = changes.columns & {"Tipo", "Fase"} and any(code in self.graph for code in changes.units)
+        if changed_columns & {"Hijos", "Equivalencias"} or (drawn and "Tipo" in changes.columns):
+            self.draw_figure()
+        else:
+            if drawn:
+                # La fase solo da el color de los nodos: se recolorean los ya dibujados
+                self.update_graph_style()
+            # Unidades nuevas sin aristas: no se dibujan
+            self.not_drawn_nodes -= changes.removed
+            self.not_drawn_nodes |= changes.added
     
     def draw_figure_event(self, event):
-        self.update_widgets()
-        self.draw_figure()
+        # Los combobox y escalas de estilo solo cambian el aspecto del grafo
+        self.update_graph_style()
     
     def update_relations_tab(self):
-        inicio = time.time()
-        searching_fact_time = 0
-
         # Limpiar el Treeview
         self.clean_tree(self.relations_tab_tree)
+        self.relations_index.clear()
+
+        # Cargar datos del modelo
+        for code in self.model.codes_of_type(("P", "N")):
+            for son_code in self.model.children[code]:
+                self.add_edge_row("Hijos", (code, son_code))
 
-        # Cargar datos de la BD
-        for _, row in self.BD.iterrows():
-            node_type = str(row["Tipo"]).strip()
-            if node_type == "P" or node_type == "N":
-                parent_code = str(row["Codigo"]).strip()
-                sons_codes = str(row.get("Hijos", "")).split(',') if pd.notna(row.get("Hijos")) else []
-                for son_code in sons_codes:
-                    son_code = son_code.strip()
-                    if son_code:
-                        #inicio_fact = time.time()
-                        parent_code = self.find_fact_with_path(parent_code)
-                        son_code = self.find_fact_with_path(son_code)
-                        #searching_fact_time = searching_fact_time + (time.time() - inicio_fact)
-                        if parent_code == son_code:
-                            continue
-                        codes = [parent_code, son_code]
-                        if not self.exists_relation(parent_code, son_code):
-                            if (self.value_in_treeview(self.nodes_tab_tree, parent_code, "Codigo") or self.value_in_treeview(self.nodes_tab_tree, son_code, "Codigo")
-                             or self.value_in_treeview(self.nodes_fact_tab_tree, parent_code, "Codigo") or self.value_in_treeview(self.nodes_fact_tab_tree, son_code, "Codigo")):
-                                self.relations_tab_tree.insert("", "end", values=codes)
-        fin = time.time()
-        upload_relations_time = fin - inicio
-        # print(f"upload_relations: {upload_relations_time: 4f} segundos")
-        """print(f"searching_fact_time: {searching_fact_time: 4f} segundos")
-        if searching_fact_time > 0:
-            print(f"percentage of time seaching facts: {(searching_fact_time * 100)/upload_relations_time}%")
-        print(f"tiempo_total: {tiempos['Total'] : 4f} segundos")
-        if tiempos["Contenedores"] > 0:
-            print(f"tiempo_contenedores: {tiempos['Contenedores'] : 4f} segundos. {(tiempos['Contenedores'] * 100 / tiempos['Total']) : 4f}%")
-        if tiempos["Rutas"] > 0:
-            print(f"tiempo_rutas: {tiempos['Rutas'] : 4f} segundos. {(tiempos['Rutas'] * 100 / tiempos['Total']) : 4f}%")
-        if tiempos["Jerarquia"] > 0:
-            print(f"tiempo_jerarquia: {tiempos['Jerarquia'] : 4f} segundos. {(tiempos['Jerarquia'] * 100 / tiempos['Total']) : 4f}%")"""
-        
     def update_equivalences_tab(self):
         inicio = time.time()
 
         # Limpiar el Treeview
         self.clean_tree(self.equivalences_tab_tree)
+        self.equivalences_index.clear()
 
-        # Cargar datos de la BD
-        for _, row in self.BD.iterrows():
-            node_type = str(row["Tipo"]).strip()
-            if node_type == "P" or node_type == "N":
-                main_code = str(row["Codigo"]).strip()
-                equis_codes = str(row.get("Equivalencias", "")).split(',') if pd.notna(row.get("Equivalencias")) else []
-                for equi_code in equis_codes:
-                    equi_code = equi_code.strip()
-                    if equi_code:
-                        main_code = self.find_fact_with_path(main_code)
-                        equi_code = self.find_fact_with_path(equi_code)
-                        if main_code == equi_code:
-                            continue
-                        codes = [main_code, equi_code]
-                        if not self.exists_equivalencie(main_code, equi_code) and main_code != equi_code:
-                            if (self.value_in_treeview(self.nodes_tab_tree, main_code, "Codigo") or self.value_in_treeview(self.nodes_tab_tree, equi_code, "Codigo")
-                             or self.value_in_treeview(self.nodes_fact_tab_tree, main_code, "Codigo") or self.value_in_treeview(self.nodes_fact_tab_tree, equi_code, "Codigo")):
-                                self.equivalences_tab_tree.insert("", "end", values=codes)
+        # Cargar datos del modelo
+        for code in self.model.codes_of_type(("P", "N")):
+            for equi_code in self.model.equivalents[code]:
+                self.add_edge_row("Equivalencias", (code, equi_code))
         # print(f"upload_equivalences: {time.time() - inicio: 4f} segundos")
 
     def update_facts_tab(self):
@@ -1347,21 +3621,12 @@ class GraphApp:
 
         # Limpiar el Treeview
         self.clean_tree(self.facts_tab_tree)
+        self.facts_index.clear()
 
-        # Cargar datos de la BD
-        for _, row in self.BD.iterrows():
-            main_code = str(row["Codigo"]).strip()
-            node_type = str(row["Tipo"]).strip()
-            if node_type == "H":
-                facts_codes = str(row.get("Hecho", "")).split(',') if pd.notna(row.get("Hecho")) else []
-                for fact_code in facts_codes:
-                    fact_code = fact_code.strip()
-                    if fact_code:
-                        codes = [main_code, fact_code]
-                        if not self.exists_fact(main_code, fact_code):
-                            if (self.value_in_treeview(self.nodes_tab_tree, main_code, "Codigo") or self.value_in_treeview(self.nodes_tab_tree, fact_code, "Codigo")
-                             or self.value_in_treeview(self.nodes_fact_tab_tree, main_code, "Codigo") or self.value_in_treeview(self.nodes_fact_tab_tree, fact_code, "Codigo")):
-                                self.facts_tab_tree.insert("", "end", values=codes)
+        # Cargar datos del modelo
+        for main_code in self.model.codes_of_type(("H",)):
+            for fact_code in self.model.fact_members[main_code]:
+                self.add_edge_row("Hecho", (main_code, fact_code))
         # print(f"upload_facts: {time.time() - inicio: 4f} segundos")
            
     def update_nodes_tab(self):
@@ -1373,6 +3638,9 @@ class GraphApp:
         # Limpiar el Treeview
         self.clean_tree(self.nodes_tab_tree)
         self.clean_tree(self.nodes_fact_tab_tree)
+        self.nodes_index.clear()
+        self.nodes_rows.clear()
+        self.nodes_columns = columns_NODES
 
         # Asignar las nuevas columnas
         self.nodes_tab_tree["columns"] = columns_NODES
@@ -1391,15 +3659,70 @@ class GraphApp:
                 self.nodes_fact_tab_tree.heading(col, text=col)
                 self.nodes_fact_tab_tree.column(col, anchor="center", stretch=False)  # Opcional: Alinear contenido
 
-        # Cargar datos de la BD
-        for _, row in self.BD.iterrows():
-            if self.pass_filter(row):
-                if str(row.get("Tipo", "")) in ["P", "N"]:
-                    self.nodes_tab_tree.insert("", "end", values=[row[col] for col in columns_NODES])
-                elif str(row.get("Tipo", "")) == "H":
-                    self.nodes_fact_tab_tree.insert("", "end", values=[row[col] for col in columns_NODES])
+        # Cargar datos de la BD: solo las filas que pasan el filtro
+        BD = self.BD[self.filter_mask()]
+        for code, tipo, values in zip(BD["Codigo"].tolist(), BD["Tipo"].astype(str).tolist(), BD[columns_NODES].values.tolist()):
+            if tipo in ["P", "N"]:
+                item = self.nodes_tab_tree.insert("", "end", values=values)
+                self.nodes_index.add(code)
+                self.nodes_rows[code] = (self.nodes_tab_tree, item)
+            elif tipo == "H":
+                item = self.nodes_fact_tab_tree.insert("", "end", values=values)
+                self.nodes_index.add(code)
+                self.nodes_rows[code] = (self.nodes_fact_tab_tree, item)
         # print(f"upload_nodes: {time.time() - inicio: 4f} segundos")
 
+    def update_nodes_rows(self, codes, renamed):
+        """Actualiza en las pestañas de unidades solo las filas de las unidades indicadas.
+
+        Devuelve las unidades que han pasado a mostrarse u ocultarse.
+        """
+        for old_code, new_code in renamed.items():
+            if old_code in self.nodes_rows:
+                self.nodes_rows[new_code] = self.nodes_rows.pop(old_code)
+                self.nodes_index.discard(old_code)
+                self.nodes_index.add(new_code)
+
+        flipped = set()
+        # Pestañas con filas nuevas: se insertan al final y se recolocan todas a la vez
+        inserted = set()
+        for code in codes:
+            tree = None
+            if code in self.model:
+                row = self.model.row(code)
+                if self.pass_filter(pd.Series(row)):
+                    if str(row.get("Tipo", "")) in ["P", "N"]:
+                        tree = self.nodes_tab_tree
+                    elif str(row.get("Tipo", "")) == "H":
+                        tree = self.nodes_fact_tab_tree
+
+            current = self.nodes_rows.pop(code, None)
+            if current is not None and current[0] is tree:
+                tree.item(current[1], values=[row[col] for col in self.nodes_columns])
+                self.nodes_rows[code] = current
+                continue
+            if current is not None:
+                current[0].delete(current[1])
+                self.nodes_index.discard(code)
+            if tree is not None:
+                item = tree.insert("", "end", values=[row[col] for col in self.nodes_columns])
+                self.nodes_rows[code] = (tree, item)
+                self.nodes_index.add(code)
+                inserted.add(tree)
+            if (current is None) != (tree is None):
+                flipped.add(code)
+        for tree in inserted:
+            self.order_nodes_rows(tree)
+        return flipped
+
+    def order_nodes_rows(self, tree):
+        """Ordena una pestaña de unidades por su encabezado si se ordenó por uno; si no, como el modelo."""
+        if tree.resort():
+            return
+        row_index = self.model.row_index
+        position = {item: row_index[code] for code, (other, item) in self.nodes_rows.items() if other is tree}
+        tree.reorder(sorted(tree.get_children(), key=position.__getitem__))
+
     def update_filter(self):
 
         self.filtro = self.filtro_entry.get()
@@ -1421,7 +3744,7 @@ class GraphApp:
 
         self.clean_tree(self.phase_color_tab_tree)
 
-        phases = self.BD['Fase'].unique()
+        phases = self.model.phases()
         #print(phases)
         for phase in phases:
             if phase != '':
@@ -1438,22 +3761,21 @@ class GraphApp:
         self.filterApplyDiacritics.set(False)
         
     def reset_filter_widgets_PART_2(self):
-        for col in self.BD.columns:
+        for col in self.model.columns:
             self.filter_listbox.insert(tk.END, str(col)) 
     
     def reset_apply_facts(self):
         self.facts_entry.delete(0, tk.END)
 
-        self.todos_los_hechos.clear()
-        self.entries_strings.clear()
-        self.hechos_visibles.clear()
+        self.entries_strings = []
+        self.update_fact_resolution()
 
     def update_widgets(self):
         inicio = time.time()
 
         # TABS DE RELACIÓN, EQUIVALENCIAS Y HECHOS
-        nodes_codes_PN = list(self.BD[self.BD["Tipo"].isin(["P","N"])]["Codigo"])
-        nodes_codes_H = list(self.BD[self.BD["Tipo"] == "H"]["Codigo"])
+        nodes_codes_PN = self.model.codes_of_type(("P", "N"))
+        nodes_codes_H = self.model.codes_of_type(("H",))
         
         # Actualizar nodos en las entries de relación
         self.node1_entry_rel.config(values=nodes_codes_PN)
@@ -1483,9 +3805,9 @@ class GraphApp:
         
         # ÁRBOL DE COLOR DE FASES
         delete_items_list = []
+        phases = set(self.model.phases())
         for item in self.phase_color_tab_tree.get_children():
-            #print(f"{self.phase_color_tab_tree.item(item, "values")[0]} in {self.BD["Fase"].unique()} = {self.phase_color_tab_tree.item(item, "values")[0] in self.BD["Fase"].unique()}")
-            if self.phase_color_tab_tree.item(item, "values")[0] not in self.BD["Fase"].unique():
+            if self.phase_color_tab_tree.item(item, "values")[0] not in phases:
                 delete_items_list.append(item)
 
         for item in delete_items_list:
@@ -1510,18 +3832,25 @@ class GraphApp:
 
     def clean_tree(self, tree):
         if tree is not None:
-            # Limpiar datos antiguos
-            for item in tree.get_children():
-                tree.delete(item)
+            # Limpiar datos antiguos, de una vez
+            items = tree.get_children()
+            if items:
+                tree.delete(*items)
 
     def clean_structures(self):
-        self.BD = None
+        self.model = None
         self.clean_tree(self.relations_tab_tree)
         self.clean_tree(self.equivalences_tab_tree)
         self.clean_tree(self.facts_tab_tree)
         self.clean_tree(self.nodes_tab_tree)
         self.clean_tree(self.nodes_fact_tab_tree)
-        self.graph.clear()
+        self.relations_index.clear()
+        self.equivalences_index.clear()
+        self.facts_index.clear()
+        self.nodes_index.clear()
+        self.nodes_rows.clear()
+        # El grafo dibujado es el de la disposición guardada en caché: se sustituye, no se vacía
+        self.graph = nx.DiGraph()
         self.code_counter = 0
         self.undo_stack.clear()
         self.redo_stack.clear()
@@ -1532,95 +3861,203 @@ class GraphApp:
 
     # Funciones de dibujo
 
-    def draw_figure(self):
-        self.draw_graph()
-        self.draw_matrix()
-   
-    def draw_graph(self):
+    def draw_figure(self, then=None):
+        """Calcula la disposición del grafo en segundo plano y, al terminar, dibuja el grafo y la matriz."""
+        inputs = self.layout_inputs()
 
-        tiempos = {}
-        inicio = time.time()
+        key = self.layout_key(inputs)
 
-        self.not_drawn_nodes.clear()
+        def render(layout):
+            self.draw_graph(layout)
+            self.draw_matrix()
+            if then is not None:
+                then()
 
-        self.ax_graph.clear()
-        self.ax_graph.set_frame_on(False)
-        self.ax_graph.axis("off")
-        self.fig_graph.subplots_adjust(left=0, right=1, top=1, bottom=0)
+        # Misma estructura que una disposición ya calculada: se dibuja sin recalcular
+        layout = self.layout_cache.get(key)
+        if layout is not None:
+            self.jobs.cancel("layout")
+            render(layout)
+            return
 
-        # Crear los diccionarios para acceso rápido
-        type_dict = dict(zip(self.BD['Codigo'], self.BD['Tipo']))
-        phase_dict = dict(zip(self.BD['Codigo'], self.BD['Fase']))
+        def store_and_render(layout):
+            self.store_layout(key, layout)
+            render(layout)
+
+        # El trabajo recibe su propia referencia a la última reducción; la caché solo se toca en este hilo
+        reduction = self.reduction_cache
+
+        self.jobs.submit("layout", "Calculando disposición",
+                         lambda job: self.compute_layout(job, *inputs, reduction=reduction), store_and_render)
+
+    def layout_key(self, inputs):
+        """Clave estructural de la disposición: nodos y su tipo, relaciones, equivalencias y redundancia.
+
+        Los hechos aplicados y el filtro ya están reflejados en las aristas de las pestañas.
+        """
+        order, type_dict, relations, equivalences, _, redundancy = inputs
+        return (tuple(order), tuple(type_dict[code] for code in order),
+                tuple(map(tuple, relations)), tuple(map(tuple, equivalences)), redundancy)
+
+    def store_layout(self, key, layout):
+        if layout["reduction"] is not None:
+            self.reduction_cache = layout["reduction"]
+        self.layout_cache.pop(key, None)
+        self.layout_cache[key] = layout
+        while len(self.layout_cache) > self.LAYOUT_CACHE_SIZE:
+            del self.layout_cache[next(iter(self.layout_cache))]
 
-        # Obtener relaciones y equivalencias
+    def layout_inputs(self):
+        """Copia de lo que necesita 'compute_layout', tomada en el hilo de Tk."""
+        type_dict = {code: attributes['Tipo'] for code, attributes in self.model.units.items()}
         relations = self.get_edgelist_from_treeview(self.relations_tab_tree)
         equivalences = self.get_edgelist_from_treeview(self.equivalences_tab_tree)
+        return (list(self.model.order), type_dict, relations, equivalences,
+                set(self.relations_index.keys), self.redundancy)
 
-        self.graph = nx.DiGraph()
+    def compute_layout(self, job, order, type_dict, relations, equivalences, relation_keys, redundancy, reduction=None):
+        """Grafo, niveles y posiciones de los nodos. No toca la interfaz: puede ejecutarse en segundo plano.
+
+        'reduction' es la última reducción transitiva calculada; si sirve se reutiliza, y si no la nueva
+        se devuelve en la disposición para que 'store_layout' la guarde.
+        """
+        graph = nx.DiGraph()
         G_aux = nx.DiGraph()
+        not_drawn_nodes = set()
 
         nodes_in_relations = set()
         for rel in relations + equivalences:
             nodes_in_relations.update(rel)
 
-        for node, nodeType in zip(self.BD['Codigo'], self.BD['Tipo']):
+        for node in order:
+            nodeType = type_dict[node]
             if node in nodes_in_relations:
-                self.graph.add_node(node)
+                graph.add_node(node)
                 G_aux.add_node(node)
             else:
                 if nodeType in ["P", "N"]:
-                    self.not_drawn_nodes.add(node)
+                    not_drawn_nodes.add(node)
 
-        self.graph.add_edges_from(relations)
+        graph.add_edges_from(relations)
         G_aux.add_edges_from(relations)
 
         # Mejorar el filtrado de equivalencias
-        nodes_set = set(self.graph.nodes)
-        equivalences = [e for e in equivalences if all(node in nodes_set for node in e) and not self.exists_relation(e[0], e[1])]
+        nodes_set = set(graph.nodes)
+        equivalences = [e for e in equivalences if all(node in nodes_set for node in e) and self.edge_key(e[0], e[1]) not in relation_keys]
 
+        if job is not None:
+            job.report(20, "Reducción transitiva")
+        if not redundancy:
+            graph, reduction = self.transitive_reduction(graph, reduction)
 
-        if not self.redundancy:
-            self.graph = nx.transitive_reduction(self.graph)
-
-        self.assign_levels()
+        if job is not None:
+            job.report(50, "Niveles")
+        self.assign_levels(graph)
         self.assign_levels_AUX(G_aux)
 
         # Posicionamiento de nodos
-        self.pos = nx.multipartite_layout(G_aux, subset_key="subset")
-        self.pos = {n: (y, -x) for n, (x, y) in self.pos.items()}
-        etiquetas = {n: f"{n[:11]}" for n in self.graph.nodes}
+        if job is not None:
+            job.report(70, "Posiciones")
+        pos = nx.multipartite_layout(G_aux, subset_key="subset")
+        pos = {n: (y, -x) for n, (x, y) in pos.items()}
 
-        # Alinear nodos equivalentes
+        # Alinear nodos equivalentes; los que quedan en la misma columna se unen con una curva
+        curves = []
         for n1, n2 in equivalences:
-            if n1 in self.pos and n2 in self.pos:
-                avg_y = (self.pos[n1][1] + self.pos[n2][1]) / 2
-                if self.pos[n1][0] != self.pos[n2][0]:
-                    self.pos[n1] = (self.pos[n1][0], avg_y)
-                    self.pos[n2] = (self.pos[n2][0], avg_y)
+            if n1 in pos and n2 in pos:
+                avg_y = (pos[n1][1] + pos[n2][1]) / 2
+                if pos[n1][0] != pos[n2][0]:
+                    pos[n1] = (pos[n1][0], avg_y)
+                    pos[n2] = (pos[n2][0], avg_y)
                 else:
-                    # continue
-                    x1, y1 = self.pos[n1]
-                    x2, y2 = self.pos[n2]
-                    
-                    # Crear una curva de Bezier entre los nodos
-                    rad = 0.3 if y1 != y2 else 0.15  # Curvatura adaptativa
-                    
-                    arrow = FancyArrowPatch(
-                        (x1, y1), (x2, y2),
-                        connectionstyle=f"arc3,rad={rad}",
-                        arrowstyle=self.arrowstyle_equivalences.get(),
-                        color=self.equi_color,
-                        linewidth=self.width_equivalences.get(),
-                        linestyle=self.style_equivalences.get(),
-                        mutation_scale=15,
-                    )
-                    self.ax_graph.add_patch(arrow)
+                    # Curvatura adaptativa
+                    rad = 0.3 if pos[n1][1] != pos[n2][1] else 0.15
+                    curves.append((pos[n1], pos[n2], rad))
+
+        return {"graph": graph, "pos": pos, "equivalences": equivalences, "curves": curves,
+                "not_drawn_nodes": not_drawn_nodes, "reduction": None if redundancy else reduction}
+
+    @staticmethod
+    def transitive_reduction(graph, cached=None):
+        """Reducción transitiva del grafo de relaciones y la entrada (nodos y aristas, aristas que quedan).
+
+        Si 'cached' es la entrada de las mismas aristas se reutiliza. No toca el estado de la aplicación.
+        """
+        nodes = list(graph.nodes)
+        edges = list(graph.edges)
+        key = (nodes, edges)
+        if cached is not None and cached[0] == key:
+            kept = cached[1]
+        else:
+            index = {node: i for i, node in enumerate(nodes)}
+            src = np.fromiter((index[u] for u, _ in edges), dtype=np.int64, count=len(edges))
+            dst = np.fromiter((index[v] for _, v in edges), dtype=np.int64, count=len(edges))
+            keep = GraphArrays.transitive_reduction(len(nodes), src, dst)
+            if keep is None:
+                # Con ciclos la reducción no es única: networkx da el error de siempre
+                return nx.transitive_reduction(graph), None
+            kept = list(itertools.compress(edges, keep.tolist()))
+        reduced = nx.DiGraph()
+        reduced.add_nodes_from(nodes)
+        reduced.add_edges_from(kept)
+        return reduced, (key, kept)
+
+    def draw_graph(self, layout=None):
+
+        tiempos = {}
+        inicio = time.time()
+
+        # Sin disposición calculada (p. ej. al mostrar la leyenda) se usa la guardada o se calcula aquí mismo
+        if layout is None:
+            inputs = self.layout_inputs()
+            key = self.layout_key(inputs)
+            layout = self.layout_cache.get(key)
+            if layout is None:
+                layout = self.compute_layout(None, *inputs, reduction=self.reduction_cache)
+                self.store_layout(key, layout)
+
+        self.graph = layout["graph"]
+        self.pos = layout["pos"]
+        equivalences = layout["equivalences"]
+        self.not_drawn_nodes = set(layout["not_drawn_nodes"])
+
+        self.ax_graph.clear()
+        self.ax_graph.set_frame_on(False)
+        self.ax_graph.axis("off")
+        self.fig_graph.subplots_adjust(left=0, right=1, top=1, bottom=0)
+
+        # Crear los diccionarios para acceso rápido
+        type_dict = {code: attributes['Tipo'] for code, attributes in self.model.units.items()}
+        phase_dict = {code: attributes['Fase'] for code, attributes in self.model.units.items()}
+
+        etiquetas = {n: f"{n[:11]}" for n in self.graph.nodes}
+        self.graph_artists = {"nodes": [], "relations": [], "equivalences": []}
+        self.graph_view = {"nodes": [], "edges": [], "heads": [], "labels": None}
+
+        # Equivalencias entre nodos de la misma columna: curvas de Bezier en una sola colección
+        if layout["curves"]:
+            arcs, starts, ends = [], [], []
+            for (x1, y1), (x2, y2), rad in layout["curves"]:
+                # Punto de control de 'arc3'
+                control = ((x1 + x2) / 2 + rad * (y2 - y1), (y1 + y2) / 2 - rad * (x2 - x1))
+                arcs.append(Path([(x1, y1), control, (x2, y2)], [Path.MOVETO, Path.CURVE3, Path.CURVE3]))
+                starts.append((control, (x1, y1)))
+                ends.append((control, (x2, y2)))
+            curves = PathCollection(arcs, facecolors="none", edgecolors=self.equi_color,
+                                    linestyles=self.style_equivalences.get(),
+                                    linewidths=self.width_equivalences.get(), zorder=1)
+            heads = ArrowHeadCollection(starts, ends, self.arrowstyle_equivalences.get(), self.equi_color,
+                                        self.width_equivalences.get(), shrink=2, mutation_scale=15, zorder=1)
+            self.ax_graph.add_collection(curves)
+            self.ax_graph.add_collection(heads, autolim=False)
+            self.graph_artists["equivalences"].extend([curves, heads])
+            self.graph_view["heads"].append(heads)
 
         # Dibujar líneas de separación
         y_levels = sorted(set(y for _, y in self.pos.values()))
-        for y, y_next in zip(y_levels[:-1], y_levels[1:]):
-            espacio = y/2 + y_next/2
-            self.ax_graph.hlines(espacio, xmin=-1, xmax=1, colors='gray', linestyles='dashed', alpha=0.6)
+        espacios = [y/2 + y_next/2 for y, y_next in zip(y_levels[:-1], y_levels[1:])]
+        if espacios:
+            self.ax_graph.hlines(espacios, xmin=-1, xmax=1, colors='gray', linestyles='dashed', alpha=0.6)
 
         inicio_nodos = time.time()
 
@@ -1645,23 +4082,28 @@ class GraphApp:
         for forma, nodos in nodos_por_forma.items():
             if nodos:
                 colores = [colores_por_nodo[n] for n in nodos]
-                nx.draw_networkx_nodes(self.graph, self.pos, nodelist=nodos, node_color=colores,
-                                    node_shape=forma, node_size=4500, ax=self.ax_graph)
+                collection = nx.draw_networkx_nodes(self.graph, self.pos, nodelist=nodos, node_color=colores,
+                                    node_shape=forma, node_size=self.GRAPH_NODE_SIZE, ax=self.ax_graph)
+                self.graph_artists["nodes"].append((collection, nodos))
+                self.graph_view["nodes"].append((collection, np.array([self.pos[n] for n in nodos], dtype=float),
+                                                 to_rgba_array(colores)))
 
         tiempos['Nodos'] = time.time() - inicio_nodos
         inicio_edges_and_labels = time.time()
 
         # Dibujar aristas y etiquetas
-        nx.draw_networkx_edges(self.graph, self.pos, ax=self.ax_graph, arrows=True,
-                            edge_color=self.relation_color, style=self.style_relations.get(),
-                            arrowstyle=self.arrowstyle_relations.get(), width=self.width_relations.get())
-
-        if equivalences:
-            nx.draw_networkx_edges(self.graph, self.pos, edgelist=equivalences, ax=self.ax_graph, arrows=True,
-                                edge_color=self.equi_color, style=self.style_equivalences.get(),
-                                arrowstyle=self.arrowstyle_equivalences.get(), width=self.width_equivalences.get())
-
-        nx.draw_networkx_labels(self.graph, self.pos, labels=etiquetas, font_size=10, ax=self.ax_graph)
+        self.graph_artists["relations"].extend(self.draw_edge_collections(
+            list(self.graph.edges), self.relation_color, self.style_relations.get(),
+            self.arrowstyle_relations.get(), self.width_relations.get()))
+        self.graph_artists["equivalences"].extend(self.draw_edge_collections(
+            equivalences, self.equi_color, self.style_equivalences.get(),
+            self.arrowstyle_equivalences.get(), self.width_equivalences.get()))
+
+        # Las etiquetas se crean solo para los nodos visibles, en 'update_graph_detail'
+        labels = LabelCollection([], [], fontsize=10, offset_transform=self.ax_graph.transData, zorder=3)
+        self.ax_graph.add_collection(labels, autolim=False)
+        self.graph_view["labels"] = (labels, list(etiquetas.values()),
+                                     np.array([self.pos[n] for n in etiquetas], dtype=float).reshape(-1, 2))
 
         tiempos['Edges and labels'] = time.time() - inicio_edges_and_labels
         inicio_leyenda = time.time()
@@ -1679,6 +4121,11 @@ class GraphApp:
         tiempos['Leyenda'] = time.time() - inicio_leyenda
         inicio_draw = time.time()
 
+        # Al hacer zoom o desplazar la vista solo se dibuja lo visible ('clear' borra estas conexiones)
+        self.update_graph_detail()
+        self.ax_graph.callbacks.connect("xlim_changed", lambda ax: self.update_graph_detail())
+        self.ax_graph.callbacks.connect("ylim_changed", lambda ax: self.update_graph_detail())
+
         self.canvas_graph.draw()
 
         tiempos['Draw'] = time.time() - inicio_draw
@@ -1690,33 +4137,151 @@ class GraphApp:
         # print(f"Tiempo leyenda: {tiempos['Leyenda']: 4f} segundos. {(tiempos['Leyenda'] * 100 / tiempos['Total']):4f}%")
         # print(f"Tiempo draw: {tiempos['Draw']: 4f} segundos. {(tiempos['Draw'] * 100 / tiempos['Total']):4f}%")
 
-    def assign_levels(self):
-        """Asigna niveles a los nodos del diagrama de Hasse."""
-        niveles = {}
-        fuentes = [n for n in self.graph.nodes if self.graph.in_degree(n) == 0]
-        cola = [(n, 0) for n in fuentes]
+    def draw_edge_collections(self, edges, color, style, arrowstyle, width):
+        """Dibuja las aristas rectas como una LineCollection y sus puntas como una ArrowHeadCollection."""
+        if not edges:
+            return []
+        segments = np.array([(self.pos[u], self.pos[v]) for u, v in edges], dtype=float)
+        lines = LineCollection(segments, colors=color, linestyles=style, linewidths=width, zorder=1)
+        # Las puntas se separan del centro el radio del nodo para que no queden tapadas
+        heads = ArrowHeadCollection(segments[:, ::-1], segments, arrowstyle, color, width,
+                                    shrink=np.sqrt(self.GRAPH_NODE_SIZE) / 2, mutation_scale=10, zorder=1)
+        self.ax_graph.add_collection(lines)
+        self.ax_graph.add_collection(heads, autolim=False)
+        self.graph_view["edges"].append((lines, heads, segments))
+
+        # Margen del 5% alrededor de las aristas, como el que dejaba networkx
+        points = segments.reshape(-1, 2)
+        minimo, maximo = points.min(axis=0), points.max(axis=0)
+        margen = 0.05 * (maximo - minimo)
+        self.ax_graph.update_datalim((minimo - margen, maximo + margen))
+        self.ax_graph.autoscale_view()
+        return [lines, heads]
+
+    def update_graph_style(self):
+        """Aplica colores, estilos y grosores a los artistas ya dibujados, sin recalcular la disposición."""
+        if self.graph_artists is None:
+            self.draw_figure()
+            return
+
+        phase_dict = {code: attributes['Fase'] for code, attributes in self.model.units.items()}
+        for (collection, nodos), (_, _, colors) in zip(self.graph_artists["nodes"], self.graph_view["nodes"]):
+            colors[:] = to_rgba_array([self.obtener_rgb_por_phase(phase_dict.get(n, "Default")) for n in nodos])
+
+        styles = (("relations", self.relation_color, self.style_relations, self.arrowstyle_relations, self.width_relations),
+                  ("equivalences", self.equi_color, self.style_equivalences, self.arrowstyle_equivalences, self.width_equivalences))
+        for artists, color, style, arrowstyle, width in styles:
+            for artist in self.graph_artists[artists]:
+                if isinstance(artist, ArrowHeadCollection):
+                    artist.set_head_style(arrowstyle.get(), color, width.get())
+                else:
+                    artist.set_edgecolor(color)
+                    artist.set_linestyle(style.get())
+                    artist.set_linewidth(width.get())
+
+        self.update_graph_detail()
+        self.canvas_graph.draw()
+
+    def update_graph_detail(self):
+        """Deja en los artistas del grafo solo lo que cae en la vista actual.
+
+        Con muchos nodos visibles se ocultan además las etiquetas y las puntas de flecha, que son lo
+        más caro de dibujar y a ese zoom no se distinguen.
+        """
+        if self.graph_view is None:
+            return
+
+        # Vista ampliada con el radio de un nodo, en unidades de datos
+        xmin, xmax = sorted(self.ax_graph.get_xlim())
+        ymin, ymax = sorted(self.ax_graph.get_ylim())
+        radius = np.sqrt(self.GRAPH_NODE_SIZE) / 2 * self.fig_graph.dpi / 72
+        margin_x = radius * (xmax - xmin) / max(self.ax_graph.bbox.width, 1)
+        margin_y = radius * (ymax - ymin) / max(self.ax_graph.bbox.height, 1)
+        xmin, xmax, ymin, ymax = xmin - margin_x, xmax + margin_x, ymin - margin_y, ymax + margin_y
+
+        def inside(xy):
+            return (xy[:, 0] >= xmin) & (xy[:, 0] <= xmax) & (xy[:, 1] >= ymin) & (xy[:, 1] <= ymax)
+
+        visible_nodes = 0
+        for collection, xy, colors in self.graph_view["nodes"]:
+            mask = inside(xy)
+            collection.set_offsets(xy[mask])
+            collection.set_facecolor(colors[mask])
+            visible_nodes += int(mask.sum())
+        detail = visible_nodes <= self.GRAPH_DETAIL_MAX_NODES
+
+        # Aristas cuyo rectángulo corta la vista
+        for lines, heads, segments in self.graph_view["edges"]:
+            x, y = segments[:, :, 0], segments[:, :, 1]
+            mask = (x.min(axis=1) <= xmax) & (x.max(axis=1) >= xmin) & (y.min(axis=1) <= ymax) & (y.max(axis=1) >= ymin)
+            lines.set_segments(segments[mask])
+            heads.set_edges(segments[mask][:, ::-1], segments[mask])
+            heads.set_visible(detail)
+        for heads in self.graph_view["heads"]:
+            heads.set_visible(detail)
+
+        labels, names, xy = self.graph_view["labels"]
+        if detail:
+            mask = inside(xy)
+            labels.set_labels([names[i] for i in np.flatnonzero(mask)], xy[mask])
+        else:
+            labels.set_labels([], [])
 
-        while cola:
-            nodo, nivel = cola.pop(0)
-            niveles[nodo] = nivel
-            for sucesor in self.graph.successors(nodo):
-                cola.append((sucesor, nivel + 1))
+    def assign_levels(self, graph=None):
+        """Asigna niveles a los nodos del diagrama de Hasse.
 
-        nx.set_node_attributes(self.graph, niveles, "subset")
+        El nivel de un nodo es el camino más largo desde una fuente, calculado en O(V+E).
+        """
+        graph = self.graph if graph is None else graph
+        if graph.number_of_nodes() >= self.VECTORIZED_LEVELS_MIN_NODES:
+            niveles = self.longest_path_levels_vectorized(graph)
+        else:
+            niveles = self.longest_path_levels(graph)
+        nx.set_node_attributes(graph, niveles, "subset")
     
     def assign_levels_AUX(self, graph):
         """Asigna niveles a los nodos del diagrama de Hasse."""
-        niveles = {}
-        fuentes = [n for n in graph.nodes if graph.in_degree(n) == 0]
-        cola = [(n, 0) for n in fuentes]
+        self.assign_levels(graph)
 
-        while cola:
-            nodo, nivel = cola.pop(0)
-            niveles[nodo] = nivel
-            for sucesor in graph.successors(nodo):
-                cola.append((sucesor, nivel + 1))
-
-        nx.set_node_attributes(graph, niveles, "subset")
+    def longest_path_levels(self, graph):
+        """Nivel de cada nodo: cada generación topológica está un nivel por debajo de la anterior."""
+        niveles = {}
+        for nivel, generation in enumerate(nx.topological_generations(graph)):
+            for nodo in generation:
+                niveles[nodo] = nivel
+        return niveles
+
+    def longest_path_levels_vectorized(self, graph):
+        """Mismo resultado que 'longest_path_levels', quitando cada generación de golpe con numpy."""
+        nodes = list(graph.nodes)
+        index = {node: i for i, node in enumerate(nodes)}
+        src = np.fromiter((index[u] for u, _ in graph.edges), dtype=np.int64, count=graph.number_of_edges())
+        dst = np.fromiter((index[v] for _, v in graph.edges), dtype=np.int64, count=graph.number_of_edges())
+        return dict(zip(nodes, self.levels_from_edge_arrays(len(nodes), src, dst).tolist()))
+
+    def levels_from_edge_arrays(self, n, src, dst):
+        """Niveles de camino más largo de un DAG con nodos 0..n-1 y aristas src[i] -> dst[i]."""
+        levels = np.zeros(n, dtype=np.int64)
+        if len(src) == 0:
+            return levels
+
+        csr = GraphArrays.from_edges(n, src, dst)
+        indegree = np.bincount(dst, minlength=n)
+        frontier = np.flatnonzero(indegree == 0)
+        level = 0
+        processed = 0
+        while frontier.size:
+            levels[frontier] = level
+            processed += frontier.size
+            # Sucesores de la generación actual
+            successors = GraphArrays.neighbors(csr, frontier)
+            np.subtract.at(indegree, successors, 1)
+            frontier = np.unique(successors[indegree[successors] == 0])
+            level += 1
+        if processed < n:
+            # Los nodos de un ciclo nunca quedan sin predecesores: mismo error que 'longest_path_levels'
+            raise nx.NetworkXUnfeasible("Graph contains a cycle or graph changed during iteration")
+        return levels
 
     def draw_matrix(self):
 
@@ -1728,19 +4293,21 @@ class GraphApp:
 
         # Obtener nodos en orden
         nodos = list(self.graph.nodes)
+        self.matrix_view = None
         if len(nodos) <= 0:
             self.ax_matrix.axis('off')  # Oculta ejes, ticks y labels
             self.canvas_matrix.draw()
             return
 
-        # Obtener la matriz de adyacencia
-        matrix = nx.to_numpy_array(self.graph, nodelist=nodos, dtype=int)
+        # Celdas no nulas de la matriz de adyacencia; la imagen densa solo se crea para la parte visible
+        rows, cols, values = self.matrix_cells(nodos)
 
-        # Incluir equivalencias
-        for i, nodoA in enumerate(nodos):
-            for j, nodoB in enumerate(nodos):
-                if self.exists_equivalencie(nodoA, nodoB):
-                    matrix[i][j] = 2
+        # Reordenar filas y columnas según el orden elegido
+        order = self.matrix_ordering(nodos, rows, cols)
+        rank = np.empty(len(nodos), dtype=np.intp)
+        rank[order] = np.arange(len(nodos))
+        nodos = [nodos[i] for i in order]
+        rows, cols = rank[rows], rank[cols]
 
         cmap = cmaps["Blues"]
 
@@ -1768,18 +4335,120 @@ class GraphApp:
         
             self.ax_matrix.legend(handles=legend_elements, loc="upper right")
 
-        # Añadir etiquetas
-        self.ax_matrix.set_xticks(ticks=np.arange(len(self.graph.nodes)), labels=self.graph.nodes)
-        self.ax_matrix.set_yticks(ticks=np.arange(len(self.graph.nodes)), labels=self.graph.nodes)
-
         # Anadir títulos de los ejes
         self.ax_matrix.set_xlabel("Hijos", loc='right')
         self.ax_matrix.set_ylabel("Padres", loc='bottom')
         self.ax_matrix.yaxis.set_label_position("right")
         
-        self.ax_matrix.matshow(matrix, cmap=cmap)
+        # La imagen y las etiquetas de los ejes se rellenan en 'update_matrix_detail' según la vista
+        n = len(nodos)
+        image = self.ax_matrix.matshow(np.zeros((1, 1), dtype=np.int8), cmap=cmap, vmin=0,
+                                       vmax=values.max() if len(values) else 0,
+                                       extent=(-0.5, n - 0.5, n - 0.5, -0.5))
+        # Cambiar el 'extent' de la imagen no debe mover la vista
+        self.ax_matrix.set_autoscale_on(False)
+        self.matrix_view = {"nodes": nodos, "cells": (rows, cols, values), "image": image, "window": None}
+
+        self.update_matrix_detail()
+        self.ax_matrix.callbacks.connect("xlim_changed", lambda ax: self.update_matrix_detail())
+        self.ax_matrix.callbacks.connect("ylim_changed", lambda ax: self.update_matrix_detail())
         self.canvas_matrix.draw()
         # print(f"draw_matrix: {time.time() - inicio: 4f} segundos.")
+
+    def matrix_cells(self, nodos):
+        """Celdas no nulas de la matriz de adyacencia como arrays (filas, columnas, valores).
+
+        Las relaciones valen 1 y las equivalencias 2, en ambos sentidos; una equivalencia tapa a una relación.
+        """
+        index = {nodo: i for i, nodo in enumerate(nodos)}
+        relations = np.array([(index[u], index[v]) for u, v in self.graph.edges], dtype=np.intp).reshape(-1, 2)
+        equivalences = np.array([(index[a], index[b]) for a, b in self.equivalences_index.keys
+                                 if a in index and b in index], dtype=np.intp).reshape(-1, 2)
+        rows = np.concatenate([relations[:, 0], equivalences[:, 0], equivalences[:, 1]])
+        cols = np.concatenate([relations[:, 1], equivalences[:, 1], equivalences[:, 0]])
+        values = np.concatenate([np.ones(len(relations), dtype=np.int8),
+                                 np.full(2 * len(equivalences), 2, dtype=np.int8)])
+        return rows, cols, values
+
+    def matrix_ordering(self, nodos, rows, cols):
+        """Orden de las filas y columnas de la matriz, como índices de 'nodos'.
+
+        Se guarda en el propio grafo, que se vuelve a crear cada vez que cambia su estructura.
+        """
+        mode = self.matrix_order.get()
+        cache = self.graph.graph.setdefault("matrix_orders", {})
+        if mode not in cache:
+            if mode == "Niveles":
+                # Por nivel del diagrama y, dentro de cada nivel, por orden de inserción
+                levels = np.array([self.graph.nodes[nodo].get("subset", 0) for nodo in nodos])
+                order = np.argsort(levels, kind="stable")
+            elif mode == "Ancho de banda":
+                # Cuthill-McKee inverso sobre la matriz simetrizada: las celdas se agrupan junto a la diagonal
+                symmetric = nx.Graph()
+                symmetric.add_nodes_from(range(len(nodos)))
+                symmetric.add_edges_from(zip(rows.tolist(), cols.tolist()))
+                order = np.fromiter(nx.utils.reverse_cuthill_mckee_ordering(symmetric), dtype=np.intp,
+                                    count=len(nodos))
+            else:
+                order = np.arange(len(nodos))
+            cache[mode] = order
+        return cache[mode]
+
+    @staticmethod
+    def matrix_image(rows, cols, values, window, factor):
+        """Matriz densa de la ventana (fila0, fila1, columna0, columna1) con 'factor' x 'factor' nodos por celda.
+
+        Cada celda toma el mayor valor de los que agrupa, para que ninguna relación desaparezca al reducir.
+        """
+        r0, r1, c0, c1 = window
+        mask = (rows >= r0) & (rows < r1) & (cols >= c0) & (cols < c1)
+        image = np.zeros((-(-(r1 - r0) // factor), -(-(c1 - c0) // factor)), dtype=np.int8)
+        np.maximum.at(image, ((rows[mask] - r0) // factor, (cols[mask] - c0) // factor), values[mask])
+        return image
+
+    def update_matrix_detail(self):
+        """Dibuja solo la ventana visible de la matriz, reducida a la resolución de pantalla.
+
+        La ventana se amplía a bloques de MATRIX_TILE celdas de imagen, así que al desplazarse un poco
+        no hace falta recalcularla. Las etiquetas de los ejes se reparten para que no se solapen.
+        """
+        if self.matrix_view is None:
+            return
+        nodos = self.matrix_view["nodes"]
+        n = len(nodos)
+
+        # Filas y columnas visibles
+        x0, x1 = sorted(self.ax_matrix.get_xlim())
+        y0, y1 = sorted(self.ax_matrix.get_ylim())
+        c0, c1 = max(0, int(np.floor(x0 + 0.5))), min(n, int(np.ceil(x1 + 0.5)))
+        r0, r1 = max(0, int(np.floor(y0 + 0.5))), min(n, int(np.ceil(y1 + 0.5)))
+        if r0 >= r1 or c0 >= c1:
+            return
+
+        # Nodos por celda de imagen: potencia de dos para que los niveles de reducción sean estables
+        width, height = max(self.ax_matrix.bbox.width, 1), max(self.ax_matrix.bbox.height, 1)
+        ratio = max((c1 - c0) / width, (r1 - r0) / height)
+        factor = 2 ** max(0, int(np.ceil(np.log2(ratio)))) if ratio > 1 else 1
+
+        tile = factor * self.MATRIX_TILE
+        window = (r0 // tile * tile, min(n, -(-r1 // tile) * tile),
+                  c0 // tile * tile, min(n, -(-c1 // tile) * tile))
+        if (factor, window) != self.matrix_view["window"]:
+            self.matrix_view["window"] = (factor, window)
+            image = self.matrix_image(*self.matrix_view["cells"], window, factor)
+            wr0, _, wc0, _ = window
+            self.matrix_view["image"].set_data(image)
+            self.matrix_view["image"].set_extent((wc0 - 0.5, wc0 + image.shape[1] * factor - 0.5,
+                                                  wr0 + image.shape[0] * factor - 0.5, wr0 - 0.5))
+
+        # Etiquetas: tantas como quepan, en múltiplos de un mismo paso
+        label_px = plt.rcParams["font.size"] * self.fig_matrix.dpi / 72
+        name_length = min(max(len(str(nodo)) for nodo in nodos), 11)
+        for axis, start, stop, pixels, spacing in ((self.ax_matrix.xaxis, c0, c1, width, label_px * 0.6 * name_length + 4),
+                                                   (self.ax_matrix.yaxis, r0, r1, height, label_px * 1.4)):
+            step = max(1, int(np.ceil((stop - start) / max(pixels / spacing, 1))))
+            ticks = range(-(-start // step) * step, stop, step)
+            axis.set_ticks(ticks, labels=[nodos[i] for i in ticks])
  
     def toggle_show_legend_graph(self):
         self.show_legend_graph = not self.show_legend_graph
@@ -1808,7 +4477,7 @@ class GraphApp:
             return
         
         # Verificar equivalencias del nodo destino
-        node_destination_equivalences = self.BD[self.BD["Codigo"]==node_destination]["Equivalencias"].values[0].split(",")
+        node_destination_equivalences = self.get_equivalences(node_destination)
         for equi in node_destination_equivalences:
             if equi != '':
                 # Verificar padres
@@ -1817,7 +4486,7 @@ class GraphApp:
                     return
         
         # Verificar equivalencias del nodo origen
-        node_origin_equivalences = self.BD[self.BD["Codigo"]==node_origin]["Equivalencias"].values[0].split(",")
+        node_origin_equivalences = self.get_equivalences(node_origin)
         for equi in node_origin_equivalences:
             if equi != '':
                 # Verificar hijos
@@ -1836,14 +4505,11 @@ class GraphApp:
             return
         
         # AÑADIR A UNDO
-        self.undo_stack.append(self.BD.copy())
-        self.redo_stack.clear()
+        self.history.begin(self.model)
         self.update_undo_redo_status()
         
-        # Obtener el índice de la fila correspondiente
-        idx = self.BD.index[self.BD["Codigo"] == node_origin][0]
-
-        self.BD.at[idx, "Hijos"] = self.add_string(self.BD.at[idx, "Hijos"], node_destination)
+        self.model.add_child(node_origin, node_destination)
+        self.history.end(self.model)
         
         # ACTUALIZAR BD
         self.update_all()
@@ -1879,16 +4545,11 @@ class GraphApp:
             return
         
         # AÑADIR A UNDO
-        self.undo_stack.append(self.BD.copy())
-        self.redo_stack.clear()
+        self.history.begin(self.model)
         self.update_undo_redo_status()
         
-        # Obtener el índice de la fila correspondiente
-        idx_A = self.BD.index[self.BD["Codigo"] == node_A][0]
-        idx_B = self.BD.index[self.BD["Codigo"] == node_B][0]
-        
-        self.BD.at[idx_A, "Equivalencias"] = self.add_string(self.BD.at[idx_A, "Equivalencias"], node_B)
-        self.BD.at[idx_B, "Equivalencias"] = self.add_string(self.BD.at[idx_B, "Equivalencias"], node_A)
+        self.model.add_equivalence(node_A, node_B)
+        self.history.end(self.model)
         
         # ACTUALIZAR BD
         self.update_all()
@@ -1917,29 +4578,16 @@ class GraphApp:
             return
         
         # Verificar si ya existe como hecho
-        nodes_already_in_facts = set()
-        for _, row in self.BD.iterrows():
-            node_type = str(row["Tipo"]).strip()
-            if node_type == "H":
-                facts_codes = str(row.get("Hecho", "")).split(',') if pd.notna(row.get("Hecho")) else []
-                for fact_code in facts_codes:
-                    fact_code = fact_code.strip()
-                    if fact_code:
-                        nodes_already_in_facts.add(fact_code)
-        
-        if node_inside in nodes_already_in_facts:
+        if self.model.member_of[node_inside]:
             messagebox.showerror("Error", f"{node_inside} ya está dentro de otro hecho")
             return
 
         # AÑADIR A UNDO
-        self.undo_stack.append(self.BD.copy())
-        self.redo_stack.clear()
+        self.history.begin(self.model)
         self.update_undo_redo_status()
         
-        # Obtener el índice de la fila correspondiente
-        idx = self.BD.index[self.BD["Codigo"] == node_fact][0]
-
-        self.BD.at[idx, "Hecho"] = self.add_string(self.BD.at[idx, "Hecho"], node_inside)
+        self.model.add_member(node_fact, node_inside)
+        self.history.end(self.model)
         
         # ACTUALIZAR BD
         self.update_all()
@@ -1957,7 +4605,7 @@ class GraphApp:
         self.error_label = tk.Label(popup, text="", fg="red")
 
         # Excluir columnas "Hijos" y "Equivalencias" para las que se mostrará la tabla
-        columns = [col for col in self.BD.columns if col not in ["Codigo", "Hijos", "Equivalencias", "Hecho"]]
+        columns = [col for col in self.model.columns if col not in ["Codigo", "Hijos", "Equivalencias", "Hecho"]]
 
         entries = []
 
@@ -1997,7 +4645,7 @@ class GraphApp:
         self.error_label = tk.Label(popup, text="", fg="red")
 
         # Excluir columnas "Hijos" y "Equivalencias" para las que se mostrará la tabla
-        columns = [col for col in self.BD.columns if col not in ["Codigo", "Hijos", "Equivalencias", "Hecho"]]
+        columns = [col for col in self.model.columns if col not in ["Codigo", "Hijos", "Equivalencias", "Hecho"]]
 
         entries = []
 
@@ -2031,11 +4679,10 @@ class GraphApp:
     def save_node(self, columns, entries, popup):
         
         # AÑADIR A UNDO
-        self.undo_stack.append(self.BD.copy())
-        self.redo_stack.clear()
+        self.history.begin(self.model)
         self.update_undo_redo_status()
 
-        nuevos_valores_dict = {col: "" for col in self.BD.columns}  # Inicializar todas las columnas con valores vacíos
+        nuevos_valores_dict = {col: "" for col in self.model.columns}  # Inicializar todas las columnas con valores vacíos
         
         # Llenar los valores correspondientes en el diccionario
         for col, valor in zip(columns, [entry.get() for entry in entries]):  # "columnas" solo tiene Codigo, Nombre, Tipo
@@ -2049,13 +4696,13 @@ class GraphApp:
         # nuevos_valores_dict['Codigo'] = self.generate_numerical_code()    
         nuevos_valores_dict['Codigo'] = nuevos_valores_dict['Nombre']
 
-        # Insertar el nuevo nodo en self.BD con los valores correctos
-        new_idx = len(self.BD)
-        self.BD.loc[new_idx] = nuevos_valores_dict
+        # Insertar el nuevo nodo en el modelo con los valores correctos
+        self.model.add_unit(nuevos_valores_dict['Codigo'], nuevos_valores_dict)
 
         # Destruir la ventana
         popup.destroy()
         self.root.grab_set()
+        self.history.end(self.model)
 
         # ACTUALIZAR
         self.update_all()
@@ -2067,8 +4714,7 @@ class GraphApp:
     def delete_relations(self, rows_selected):
 
         # AÑADIR A UNDO
-        self.undo_stack.append(self.BD.copy())
-        self.redo_stack.clear()
+        self.history.begin(self.model)
         self.update_undo_redo_status()
         
         # Eliminamos los nodos seleccionados
@@ -2077,8 +4723,8 @@ class GraphApp:
                 item = self.relations_tab_tree.item(row, "values")
                 node_origin = item[0]
                 node_destination = item[1]
-                node_origin_idx = self.BD.index[self.BD["Codigo"] == node_origin][0]
-                self.BD.at[node_origin_idx, "Hijos"] = self.delete_string(self.BD.iloc[node_origin_idx]["Hijos"], node_destination)
+                self.model.remove_child(node_origin, node_destination)
+        self.history.end(self.model)
         
         # ACTUALIZAR BD
         self.update_all()
@@ -2089,8 +4735,7 @@ class GraphApp:
     def delete_equivalences(self, rows_selected):
 
         # AÑADIR A UNDO
-        self.undo_stack.append(self.BD.copy())
-        self.redo_stack.clear()
+        self.history.begin(self.model)
         self.update_undo_redo_status()
         
         # Eliminamos los nodos seleccionados
@@ -2099,10 +4744,8 @@ class GraphApp:
                 item = self.equivalences_tab_tree.item(row, "values")
                 node1 = item[0]
                 node2 = item[1]
-                node1_idx = self.BD.index[self.BD["Codigo"] == node1][0]
-                node2_idx = self.BD.index[self.BD["Codigo"] == node2][0]
-                self.BD.at[node1_idx, "Equivalencias"] = self.delete_string(self.BD.iloc[node1_idx]["Equivalencias"], node2)
-                self.BD.at[node2_idx, "Equivalencias"] = self.delete_string(self.BD.iloc[node2_idx]["Equivalencias"], node1)
+                self.model.remove_equivalence(node1, node2)
+        self.history.end(self.model)
         
         # ACTUALIZAR BD
         self.update_all()
@@ -2113,8 +4756,7 @@ class GraphApp:
     def delete_facts(self, rows_selected):
 
         # AÑADIR A UNDO
-        self.undo_stack.append(self.BD.copy())
-        self.redo_stack.clear()
+        self.history.begin(self.model)
         self.update_undo_redo_status()
         
         # Eliminamos los nodos seleccionados
@@ -2123,8 +4765,8 @@ class GraphApp:
                 item = self.facts_tab_tree.item(row, "values")
                 node_origin = item[0]
                 node_destination = item[1]
-                node_origin_idx = self.BD.index[self.BD["Codigo"] == node_origin][0]
-                self.BD.at[node_origin_idx, "Hecho"] = self.delete_string(self.BD.iloc[node_origin_idx]["Hecho"], node_destination)
+                self.model.remove_member(node_origin, node_destination)
+        self.history.end(self.model)
         
         # ACTUALIZAR BD
         self.update_all()
@@ -2134,11 +4776,6 @@ class GraphApp:
 
     def delete_nodes(self):
 
-        # AÑADIR A UNDO
-        self.undo_stack.append(self.BD.copy())
-        self.redo_stack.clear()
-        self.update_undo_redo_status()
-
         selected = self.nodes_tab_tree.selection()
 
         if not selected:
@@ -2148,36 +4785,26 @@ class GraphApp:
         confirmacion = messagebox.askyesno("Confirmar", "¿Seguro que quieres eliminar este nodo?")
         if not confirmacion:
             return
+
+        # AÑADIR A UNDO
+        self.history.begin(self.model)
+        self.update_undo_redo_status()
         
-        rows_to_delete = []
+        codes = []
         for item in selected:
             valores = self.nodes_tab_tree.item(item, "values")  # Obtener los valores de la fila seleccionada
             columns = self.nodes_tab_tree.cget("columns")
-            row_idx = self.BD[self.BD["Codigo"] == valores[columns.index("Codigo")]].index
-            rows_to_delete.append(row_idx[0])
-
-            if not row_idx.empty:
-                for col in ["Hijos", "Equivalencias", "Hecho"]:
-                    for idx in range(len(self.BD)):
-                        self.BD.at[idx, col] = self.delete_string(self.BD.iloc[idx][col], valores[columns.index("Codigo")])
-    
-                
-        # Eliminar de la tabla
-        self.BD.drop(rows_to_delete, inplace=True)
+            codes.append(valores[columns.index("Codigo")])
 
-        # Resetear el índice para evitar problemas futuros
-        self.BD.reset_index(drop=True, inplace=True)
+        # Eliminar las unidades y todas sus referencias, de una vez
+        self.model.remove_units([code for code in codes if code in self.model])
+        self.history.end(self.model)
 
         # ACTUALIZAR
         self.update_all()
     
     def delete_nodes_fact(self):
 
-        # AÑADIR A UNDO
-        self.undo_stack.append(self.BD.copy())
-        self.redo_stack.clear()
-        self.update_undo_redo_status()
-
         selected = self.nodes_fact_tab_tree.selection()
 
         if not selected:
@@ -2187,25 +4814,20 @@ class GraphApp:
         confirmacion = messagebox.askyesno("Confirmar", "¿Seguro que quieres eliminar este nodo?")
         if not confirmacion:
             return
+
+        # AÑADIR A UNDO
+        self.history.begin(self.model)
+        self.update_undo_redo_status()
         
-        rows_to_delete = []
+        codes = []
         for item in selected:
             valores = self.nodes_fact_tab_tree.item(item, "values")  # Obtener los valores de la fila seleccionada
             columns = self.nodes_fact_tab_tree.cget("columns")
-            row_idx = self.BD[self.BD["Codigo"] == valores[columns.index("Codigo")]].index
-            rows_to_delete.append(row_idx[0])
+            codes.append(valores[columns.index("Codigo")])
 
-            if not row_idx.empty:
-                for col in ["Hijos", "Equivalencias", "Hecho"]:
-                    for idx in range(len(self.BD)):
-                        self.BD.at[idx, col] = self.delete_string(self.BD.iloc[idx][col], valores[columns.index("Codigo")])
-    
-                
-        # Eliminar de la tabla
-        self.BD.drop(rows_to_delete, inplace=True)
-
-        # Resetear el índice para evitar problemas futuros
-        self.BD.reset_index(drop=True, inplace=True)
+        # Eliminar las unidades y todas sus referencias, de una vez
+        self.model.remove_units([code for code in codes if code in self.model])
+        self.history.end(self.model)
 
         # ACTUALIZAR
         self.update_all()
@@ -2313,24 +4935,18 @@ class GraphApp:
     def save_node_edition(self, columns, entries, popup, code):
         
         # AÑADIR A UNDO
-        self.undo_stack.append(self.BD.copy())
-        self.redo_stack.clear()
+        self.history.begin(self.model)
         self.update_undo_redo_status()
 
-        idx = self.BD.index[self.BD["Codigo"] == code][0]
-        
         # Llenar los valores correspondientes en el diccionario
         for col, valor in zip(columns, [entry.get() for entry in entries]):  # "columnas" solo tiene Codigo, Nombre, Tipo
             if col in (["Nombre", "Fase"]):
                 valor = valor.strip()
-            if col == "Tipo" and self.BD.at[idx, col] != valor:
-                if ((self.BD.at[idx, col] in ("P", "N") and valor == "H")
-                    or (self.BD.at[idx, col]  == "H" and valor in ("P", "N"))):
-                    for c in ["Hijos", "Equivalencias", "Hecho"]:
-                        for i in range(len(self.BD)):
-                            self.BD.at[i, c] = self.delete_string(self.BD.iloc[i][c], code)
-                            if i == idx:
-                                self.BD.at[i, c] = ""
+            old_value = self.model.get(code, col)
+            if col == "Tipo" and old_value != valor:
+                if ((old_value in ("P", "N") and valor == "H")
+                    or (old_value == "H" and valor in ("P", "N"))):
+                    self.model.detach_unit(code)
                     entry_new_text = self.delete_string(self.facts_entry.get(), code)
                     self.facts_entry.delete(0, tk.END)
                     self.facts_entry.insert(0, entry_new_text)
@@ -2339,19 +4955,15 @@ class GraphApp:
                     print("Nueva fase añadida!!!!")
                     self.phase_color_tab_tree.insert("", "end", values=(str(valor), "#0000FF"))
 
-            self.BD.at[idx, col] = valor
+            self.model.set_attribute(code, col, valor)
 
         # Cambiar el valor del código
-        old_code = self.BD.at[idx, "Codigo"]
-        new_code = self.BD.at[idx, "Nombre"]
-        self.BD.at[idx, "Codigo"] = self.BD.at[idx, "Nombre"]
-
-        for col in ["Hijos", "Equivalencias", "Hecho"]:
-            self.BD[col] = self.BD[col].apply(self.substitute_substring_in_string, args=(old_code, new_code))
+        self.model.rename_unit(code, self.model.get(code, "Nombre"))
 
         # Destruir la ventana
         popup.destroy()
         self.root.grab_set()
+        self.history.end(self.model)
 
         # ACTUALIZAR
         self.update_all()
@@ -2367,7 +4979,7 @@ class GraphApp:
             elif color_container == "Equivalence":
                 self.equi_color = color
             #self.update_all()
-            self.draw_figure()
+            self.update_graph_style()
 
     def edit_phase_color(self):
         color = colorchooser.askcolor(title="Selecciona un color")[1]
@@ -2376,66 +4988,36 @@ class GraphApp:
             item = self.phase_color_tab_tree.item(item_id)["values"]
             self.phase_color_tab_tree.item(item_id, values=(item[0], color))
             #self.update_all()
-            self.draw_figure()
+            self.update_graph_style()
             
     # Funciones de filtrado
 
     def pass_filter(self, to_filter_list):
-
-        #print(list(to_filter_list))
-        
-        if self.filtro == "":
-            #print("VACÍO")
-            return True
-        
-        selected_columns = [i for i in self.filter_listbox.curselection()]
-        if len(selected_columns) == 0:
-            selected_columns = list(range(len(self.BD.columns)))
-
-        selected_columns = [str(col) for col in self.BD.columns[selected_columns]]
-
-        # CAMBIAR LA FORMA EN LA QUE SE CREA el nuevo 'to_filter_list'
-        # Para phase deben añadirse el nodo hecho ¿y/o? los nodos que engloba
-
-        # Tomamos la lista y limpiamos espacios en cada elemento
-        filter_list = [item.strip() for item in self.filtro.split(",")]
-
-        # Tomamos solo las columnas seleccionadas y limpiamos espacios
-        to_filter_list = [str(item).strip() for item in to_filter_list[selected_columns].tolist()]
-
-        # print(f"{to_filter_list} {type(to_filter_list)}")
-
-        # Quitamos las comas
-        # to_filter_list = " ".join(to_filter_list).strip(",")
-
-        # Convertimos todas las mayúculas a minúsculas
-        if not self.filterApplyMayMin.get():
-            filter_list = [f.lower() for f in filter_list]
-            to_filter_list = [f.lower() for f in to_filter_list]
-
-        # Eliminamos diacríticos
-        if not self.filterApplyDiacritics.get():
-            for i, f in enumerate(filter_list):
-                f = unicodedata.normalize('NFD', f)
-                f = "".join(c for c in f if unicodedata.category(c) != 'Mn')
-                filter_list[i] = f
-            for i, f in enumerate(to_filter_list):
-                f = unicodedata.normalize('NFD', f)
-                f = "".join(c for c in f if unicodedata.category(c) != 'Mn')
-                to_filter_list[i] = f
-        # to_filter_list = unicodedata.normalize('NFD', to_filter_list)
-        # to_filter_list = "".join(c for c in to_filter_list if unicodedata.category(c) != 'Mn')
-        
-        if not self.filterApplyFullWords.get():
-            # print(f"{filter_list} <=> {to_filter_list} = {any(elem_fl in elem_tfl for elem_fl in filter_list for elem_tfl in to_filter_list)}")
-            return any(elem_fl in elem_tfl for elem_fl in filter_list for elem_tfl in to_filter_list)
-        else:
-            # print(f"{filter_list} <=> {to_filter_list} = {any(elem in to_filter_list for elem in filter_list)}")
-            return any(elem in to_filter_list for elem in filter_list)
+        return self.compiled_filter().passes(to_filter_list)
+
+    def compiled_filter(self):
+        """Filtro compilado para el estado actual de los widgets de filtrado."""
+        key = (self.filter_key(), tuple(self.model.columns))
+        if self._unit_filter is None or self._unit_filter[0] != key:
+            selected_columns = [i for i in self.filter_listbox.curselection()]
+            if len(selected_columns) == 0:
+                selected_columns = list(range(len(self.model.columns)))
+            selected_columns = [str(self.model.columns[i]) for i in selected_columns]
+            unit_filter = UnitFilter(self.filtro, selected_columns, self.filterApplyMayMin.get(),
+                                     self.filterApplyFullWords.get(), self.filterApplyDiacritics.get())
+            self._unit_filter = (key, unit_filter)
+        return self._unit_filter[1]
+
+    def filter_mask(self):
+        """Máscara de las filas de la BD que pasan el filtro."""
+        self.normalized_columns.sync(self.model.version)
+        return self.compiled_filter().mask(self.BD, self.normalized_columns)
 
     # Funciones de zoom
 
     def zoom_on_nodes(self, selected_nodes):
+        # La disposición se calcula en segundo plano: los nodos que aún no tienen posición no cuentan
+        selected_nodes = [node for node in selected_nodes if node in self.pos]
         if not selected_nodes:
             return
         
@@ -2460,16 +5042,10 @@ class GraphApp:
         #selected_indices = listbox.curselection()
         #selected_nodes = [int(listbox.get(i).split()[1]) for i in selected_indices]
 
-        selected_nodes = []
-        for _, row in self.BD.iterrows():
-            self.pass_filter(row)
-            if self.pass_filter(row):
-                node_code = str(row.get("Codigo",""))
-                if (self.value_in_treeview(self.relations_tab_tree, node_code, "Unidad 1") or
-                    self.value_in_treeview(self.relations_tab_tree, node_code, "Unidad 2") or
-                    self.value_in_treeview(self.equivalences_tab_tree, node_code, "Unidad 1") or
-                    self.value_in_treeview(self.equivalences_tab_tree, node_code, "Unidad 2")):
-                    selected_nodes.append(node_code)
+        # Nodos que aparecen en las pestañas de relaciones y equivalencias
+        nodes_in_edges = {node for edge in self.relations_index.keys | self.equivalences_index.keys for node in edge}
+
+        selected_nodes = [code for code in self.BD["Codigo"][self.filter_mask()].astype(str).tolist() if code in nodes_in_edges]
         print(selected_nodes)
         # Hacer el zoom en los nodos seleccionados
         self.zoom_on_nodes(selected_nodes)
@@ -2483,9 +5059,9 @@ class GraphApp:
         if not self.undo_stack:
             return
         
-        previous_db = self.undo_stack.pop()
-        self.redo_stack.append(self.BD.copy())
-        self.BD = previous_db.copy()
+        model = self.history.undo(self.model)
+        self.attach_journal(model)
+        self.model = model
 
         self.update_undo_redo_status()
         
@@ -2498,9 +5074,9 @@ class GraphApp:
         if not self.redo_stack:
             return
         
-        previous_db = self.redo_stack.pop()
-        self.undo_stack.append(self.BD.copy())
-        self.BD = previous_db.copy()
+        model = self.history.redo(self.model)
+        self.attach_journal(model)
+        self.model = model
 
         self.update_undo_redo_status()
 
@@ -2517,100 +5093,115 @@ class GraphApp:
     # Funciones auxiliares
     
     def has_cycle(self, nodeA, nodeB):
-        return self.search_cycle(nodeA, nodeB)
+        # Con el índice de alcanzabilidad basta leer bits; con demasiadas unidades para el índice,
+        # el orden topológico del modelo limita la búsqueda a la región afectada por la nueva arista
+        reachability = self.model.reachability()
+        cycle = None if reachability is None else reachability.creates_cycle(nodeA, nodeB)
+        if cycle is None:
+            cycle = self.model.topology().creates_cycle(nodeA, nodeB)
+        if cycle is None:
+            return self.search_cycle(nodeA, nodeB)
+        return cycle
 
     def search_cycle(self, node_origin, node_destination):
-        """Verifica si agregar node_destination como hijo de node_origin crearía un ciclo."""
-        to_visit = [node_destination]  # Comenzamos desde el nodo destino
-        to_visit.extend(self.get_equivalences(node_destination))
-        visited = set()
-
-        while to_visit:
-            current = to_visit.pop()
-            # current_equivalences = self.get_equivalences(current)
-            if current in visited:
-                continue
-            visited.add(current)
-            # visited.union(set(current_equivalences))
-
-            # Si encontramos el nodo de origen en la rama, hay un ciclo
-            if current == node_origin:
-                # print(f"{node_origin}, {node_destination}, {visited}")
-                return True
-
-            # Obtener los hijos del nodo actual
-            sons_str = self.BD.loc[self.BD["Codigo"] == current, "Hijos"].values
-            if len(sons_str) > 0 and isinstance(sons_str[0], str):  # Verificar si hay hijos
-                sons_list = sons_str[0].split(",")  # Convertir a lista
-                to_visit.extend(sons_list)  # Agregar hijos a la pila de búsqueda
-                for son in sons_list:
-                    son_equis = self.get_equivalences(son)
-                    for son_equi in son_equis:
-                        if son_equi not in visited:
-                            to_visit.append(son_equi)
-
-        # print(f"{node_origin}, {node_destination}, {visited}")
-        return False  # No se encontró ciclo
+        """Verifica si agregar node_destination como hijo de node_origin crearía un ciclo.
+
+        Hay ciclo si el origen está entre los descendientes del destino (o de sus equivalentes),
+        contando también las equivalencias de cada hijo. Se recorre sobre los arrays CSR del modelo.
+        """
+        arrays = self.model.arrays()
+        if node_origin not in arrays.ids or node_destination not in arrays.ids:
+            return node_origin == node_destination
+        return arrays.reaches_through_equivalents(arrays.ids[node_destination], arrays.ids[node_origin])
     
     def check_same_parents(self, nodeA, nodeB):
-        return self.contains_both(self.BD, nodeA, nodeB, 'Hijos')
+        return self.model.parents[nodeA].keys() == self.model.parents[nodeB].keys()
     
     def check_same_sons(self, nodeA, nodeB):
-        return self.BD[self.BD['Codigo'] == nodeA]['Hijos'].values[0] == self.BD[self.BD['Codigo'] == nodeB]['Hijos'].values[0]
+        return list(self.model.children[nodeA]) == list(self.model.children[nodeB])
     
-    def contains_both(self, df, nodeA, nodeB, column):
-        # print(f"{nodeA} - {nodeB}")
-        return df[column].apply(lambda x: self.contains_both_check(x, nodeA, nodeB)).all()
-
-    def contains_both_check(self, val, nodeA, nodeB):
-        val = val.split(",")
-        contains_nodeA = nodeA in val
-        contains_nodeB = nodeB in val
-        # print(f"{contains_nodeA}, {contains_nodeB} in {val}")
-        return (contains_nodeA and contains_nodeB) or (not contains_nodeA and not contains_nodeB)
-
-    def exists_tuple(self, tree, values_to_search):
-        for item in tree.get_children():  # Recorrer todas las filas
-            row_values = tree.item(item, "values")  # Obtener los valores de la fila
-            if tuple(values_to_search) == row_values:  # Comparar con la tupla buscada
-                return True  # La tupla existe
-        return False  # No se encontró
-    
-    def exists_relation(self, node1, node2):
-        values_to_search_1 = [node1, node2]
-        values_to_search_2 = [node2, node1]
+    def edge_key(self, node1, node2):
+        """Clave de una arista sin importar el orden de sus nodos."""
+        return (node1, node2) if node1 <= node2 else (node2, node1)
+
+    def edge_tab(self, column):
+        """Treeview e índice de la pestaña que muestra una columna de relación."""
+        return {"Hijos": (self.relations_tab_tree, self.relations_index),
+                "Equivalencias": (self.equivalences_tab_tree, self.equivalences_index),
+                "Hecho": (self.facts_tab_tree, self.facts_index)}[column]
+
+    def shown_edge(self, column, node1, node2):
+        """Arista que muestra la pestaña para una arista del modelo, o None si no se muestra."""
+        if column == "Hecho":
+            return (node1, node2) if self.model.get(node1, "Tipo") == "H" else None
+        if self.model.get(node1, "Tipo") not in ("P", "N"):
+            return None
+        # Las unidades dentro de un hecho aplicado se muestran como el hecho
+        node1 = self.find_fact_with_path(node1)
+        node2 = self.find_fact_with_path(node2)
+        return (node1, node2) if node1 != node2 else None
+
+    def add_edge_row(self, column, edge):
+        """Añade una arista del modelo a su pestaña. Devuelve True si se ha insertado una fila."""
+        codes = self.shown_edge(column, *edge)
+        if codes is None:
+            return False
+        tree, index = self.edge_tab(column)
+        key = self.edge_key(*codes)
+        index.origin[edge] = key
+        sources = index.sources.setdefault(key, set())
+        sources.add(edge)
+        # Ya se mostraba, o ninguno de sus nodos pasa el filtro
+        if len(sources) > 1 or (codes[0] not in self.nodes_index and codes[1] not in self.nodes_index):
+            return False
+        index.rows[key] = tree.insert("", "end", values=list(codes))
+        index.keys.add(key)
+        return True
 
-        if self.exists_tuple(self.relations_tab_tree, values_to_search_1):
-            return True
-        if self.exists_tuple(self.relations_tab_tree, values_to_search_2):
-            return True
-        return False
+    def remove_edge_row(self, column, edge):
+        """Quita una arista del modelo de su pestaña. Devuelve True si se ha borrado una fila."""
+        tree, index = self.edge_tab(column)
+        key = index.origin.pop(edge, None)
+        if key is None:
+            return False
+        sources = index.sources[key]
+        sources.discard(edge)
+        if sources:
+            return False
+        del index.sources[key]
+        if key not in index.keys:
+            return False
+        index.keys.discard(key)
+        tree.delete(index.rows.pop(key))
+        return True
 
-    def exists_equivalencie(self, node1, node2):
-        values_to_search_1 = [node1, node2]
-        values_to_search_2 = [node2, node1]
+    def update_edge_rows(self, column, edges):
+        """Actualiza las filas de las aristas del modelo indicadas. Devuelve True si la pestaña ha cambiado."""
+        adjacency = self.model.relation_adjacency(column)
+        changed = False
+        for edge in sorted(edges):
+            changed |= self.remove_edge_row(column, edge)
+            if edge[0] in self.model and edge[1] in adjacency[edge[0]]:
+                changed |= self.add_edge_row(column, edge)
+        if changed:
+            # Las filas nuevas van al final: si la pestaña se ordenó por un encabezado, se reordena
+            self.edge_tab(column)[0].resort()
+        return changed
 
-        if self.exists_tuple(self.equivalences_tab_tree, values_to_search_1):
-            return True
-        if self.exists_tuple(self.equivalences_tab_tree, values_to_search_2):
-            return True
-        return False
+    def exists_relation(self, node1, node2):
+        return self.edge_key(node1, node2) in self.relations_index
+
+    def exists_equivalencie(self, node1, node2):
+        return self.edge_key(node1, node2) in self.equivalences_index
     
     def exists_fact(self, node1, node2):
-        values_to_search_1 = [node1, node2]
-        values_to_search_2 = [node2, node1]
-
-        if self.exists_tuple(self.facts_tab_tree, values_to_search_1):
-            return True
-        if self.exists_tuple(self.facts_tab_tree, values_to_search_2):
-            return True
-        return False
+        return self.edge_key(node1, node2) in self.facts_index
 
     def name_to_code(self, name):
-        return self.BD.loc[self.BD['Nombre'] == name, 'Codigo'].iloc[0]
+        return self.model.codes_by_name[name]
 
     def code_to_name(self, code):
-        return self.BD.loc[self.BD['Codigo'] == code, 'Nombre'].iloc[0]
+        return self.model.get(code, 'Nombre')
     
     def generate_numerical_code(self):
         indice = self.code_counter
@@ -2627,21 +5218,7 @@ class GraphApp:
         return edgelist
     
     def get_equivalences(self, node):
-        equi_str = self.BD.loc[self.BD["Codigo"] == node, "Equivalencias"].values
-        equi_list = []
-        if len(equi_str) > 0 and isinstance(equi_str[0], str):  # Verificar si hay hijos
-            equi_list = equi_str[0].split(",")  # Convertir a lista
-            return equi_list
-        return equi_list
-
-    def add_string(self, original_str, new_value):
-        """Añade un nuevo valor a una cadena separada por comas, evitando duplicados."""
-        if pd.isna(original_str) or original_str == "":
-            return new_value  # Si está vacío, simplemente asignamos el nuevo valor
-        
-        sons_list = original_str.split(",")  # Convertimos la cadena en lista
-        sons_list.append(new_value)  # Agregamos el nuevo valor
-        return ",".join(sons_list)  # Convertimos de vuelta a string
+        return list(self.model.equivalents.get(node, ()))
 
     def delete_string(self, original_str, str_to_delete):
         # Convertir la cadena a lista separada por comas
@@ -2651,13 +5228,6 @@ class GraphApp:
         # Unir la lista de nuevo en un solo string
         return ','.join(filtered_list)
     
-    def substitute_substring_in_string(self, original_str, original_substring, new_substring):
-        if pd.isna(original_str) or original_str == "":
-            return original_str
-        partes = original_str.split(",")
-        partes = [new_substring if parte.strip() == original_substring else parte for parte in partes]
-        return ",".join(partes)
-
     def get_values_from_string(self, entry_string):
         values = [v.strip() for v in entry_string.split(',') if v.strip()]
         return values
@@ -2691,174 +5261,55 @@ class GraphApp:
                 return color
         return "#0080FF"  # Si no se encuentra la fase, devolvemos azul genérico
 
-    def search_path_to_objective(self, origen, objetivo):
-        """Expande sin recursión para encontrar la ruta completa hasta el objetivo."""
-        """self.todos_los_hechos = {
-            str(row['Codigo']): set(row['Hecho'].split(','))
-            for _, row in self.BD.iterrows()
-        }"""
+    def update_fact_resolution(self):
+        """Precalcula el bosque de hechos y, para cada unidad, el hecho visible más externo que la contiene.
 
-        cola = deque([(origen, [origen])])  # (actual, camino)
-
-        while cola:
-            actual, camino = cola.popleft()
-            elementos = self.todos_los_hechos.get(actual, [])
+        Solo se recalcula cuando cambian los hechos de 'facts_entry' o la columna 'Hecho'.
+        """
+        key = (tuple(self.entries_strings), self.model.facts_version)
+        if key == self._fact_resolution_key:
+            return
+        self._fact_resolution_key = key
 
-            for elem in elementos:
-                if elem == objetivo:
-                    return camino + [elem]
-                elif elem in self.todos_los_hechos:
-                    cola.append((elem, camino + [elem]))
+        # Bosque de contención: unidad -> hecho que la contiene
+        self.fact_forest = {}
+        for fact, members in self.model.fact_members.items():
+            for member in members:
+                self.fact_forest.setdefault(member, fact)
 
-        return None  # No se encontró camino
+        # Recorrer el bosque desde las raíces arrastrando el hecho visible más externo
+        visible_facts = set(self.entries_strings)
+        self.outermost_visible_fact = {}
+        visited = set()
+        stack = [(fact, None) for fact in self.model.fact_members if fact not in self.fact_forest]
+        while stack:
+            code, outer = stack.pop()
+            if code in visited:
+                continue
+            visited.add(code)
+            if outer is not None:
+                self.outermost_visible_fact[code] = outer
+            elif code in visible_facts:
+                outer = code
+            for member in self.model.fact_members.get(code, ()):
+                stack.append((member, outer))
 
     def find_fact_with_path(self, objetivo):
-        
-        inicio = time.time()
-        beginning = time.time()
-
-        """self.todos_los_hechos = {
-            str(row['Codigo']): set(row['Hecho'].split(','))
-            for _, row in self.BD.iterrows()
-        }
-        self.entries_strings = self.get_values_from_string(str(self.facts_entry.get()))
-        self.hechos_visibles = {clave: valor for clave, valor in self.todos_los_hechos.items() if clave in self.entries_strings}"""
-
-        contenido_en = defaultdict(set)
-
-        # Relaciones inversas
-        for hecho, elementos in self.todos_los_hechos.items():
-            for elem in elementos:
-                if elem in self.todos_los_hechos:
-                    contenido_en[elem].add(hecho)
-        
-        tiempo_contenedores = time.time() - beginning
-        beginning = time.time()
-
-        # Buscamos rutas completas desde hechos visibles
-        rutas = {}
-        for hecho in self.hechos_visibles:
-            camino = self.search_path_to_objective(hecho, objetivo)
-            if camino:
-                rutas[hecho] = camino
-
-        if not rutas:
-            return objetivo  # No se encontró en ningún hecho visible
-        
-        tiempo_rutas = time.time() - beginning
-        beginning = time.time()
-
-        # Ahora subimos en la jerarquía para encontrar el más externo
-        visitados = set()
-        cola = deque(rutas.keys())
-        resultado = set(rutas.keys())
-
-        while cola:
-            actual = cola.popleft()
-            visitados.add(actual)
-
-            for contenedor in contenido_en.get(actual, []):
-                if contenedor in self.hechos_visibles and contenedor not in visitados:
-                    resultado.discard(actual)
-                    resultado.add(contenedor)
-                    cola.append(contenedor)
-
-        tiempo_jerarquia = time.time() - beginning
-        tiempo_total = time.time() - inicio
-
-        if resultado:
-            hecho_externo = resultado.pop()
-            #return hecho_externo, rutas[hecho_externo]
-            return hecho_externo
-
-        return objetivo
-    
-    def find_fact_with_path_with_times(self, objetivo):
-
-        tiempos = {}
-        tiempos['Total'] = 0.0
-        tiempos['Contenedores'] = 0.0
-        tiempos['Rutas'] = 0.0
-        tiempos['Jerarquia'] = 0.0
-        
-        inicio = time.time()
-        beginning = time.time()
-
-        """self.todos_los_hechos = {
-            str(row['Codigo']): set(row['Hecho'].split(','))
-            for _, row in self.BD.iterrows()
-        }
-        self.entries_strings = self.get_values_from_string(str(self.facts_entry.get()))
-        self.hechos_visibles = {clave: valor for clave, valor in self.todos_los_hechos.items() if clave in self.entries_strings}"""
-
-        contenido_en = defaultdict(set)
-
-        # Relaciones inversas
-        for hecho, elementos in self.todos_los_hechos.items():
-            for elem in elementos:
-                if elem in self.todos_los_hechos:
-                    contenido_en[elem].add(hecho)
-        
-        tiempo_contenedores = time.time() - beginning
-        tiempos["Contenedores"] = tiempo_contenedores
-        beginning = time.time()
-
-        # Buscamos rutas completas desde hechos visibles
-        rutas = {}
-        for hecho in self.hechos_visibles:
-            camino = self.search_path_to_objective(hecho, objetivo)
-            if camino:
-                rutas[hecho] = camino
-
-        tiempo_rutas = time.time() - beginning
-        tiempos["Rutas"] = tiempo_rutas
-        beginning = time.time()
-
-        if not rutas:
-            tiempos["Total"] = time.time() - inicio
-            return objetivo, tiempos  # No se encontró en ningún hecho visible
-        
-
-        # Ahora subimos en la jerarquía para encontrar el más externo
-        visitados = set()
-        cola = deque(rutas.keys())
-        resultado = set(rutas.keys())
-
-        while cola:
-            actual = cola.popleft()
-            visitados.add(actual)
-
-            for contenedor in contenido_en.get(actual, []):
-                if contenedor in self.hechos_visibles and contenedor not in visitados:
-                    resultado.discard(actual)
-                    resultado.add(contenedor)
-                    cola.append(contenedor)
-
-        tiempo_jerarquia = time.time() - beginning
-        tiempos["Jerarquia"] = tiempo_jerarquia
-        tiempo_total = time.time() - inicio
-        tiempos["Total"] = tiempo_total
-
-        if resultado:
-            hecho_externo = resultado.pop()
-            #return hecho_externo, rutas[hecho_externo]
-            return hecho_externo, tiempos
-
-        return objetivo, tiempos
+        """Devuelve el hecho visible más externo que contiene a 'objetivo', o el propio 'objetivo'."""
+        return self.outermost_visible_fact.get(objetivo, objetivo)
 
     def block_scroll(self, event):
         return "break"
 
     def validate_entry(self, *args):
         texto = self.name_entry.get().strip()
-        #print(f"{texto} in {list(self.BD["Nombre"])} -> {texto in list(self.BD["Nombre"])}")
         if texto == "":
             self.error_label.config(text="⚠️ El campo 'Nombre' no puede estar vacío.")
             self.save_node_button.config(state="disabled")
         elif re.search(r'[;,]', texto):
             self.error_label.config(text=f"⚠️ No puede haber ',' ni ';' en el campo 'Nombre'")
             self.save_node_button.config(state="disabled")
-        elif texto in list(self.BD["Nombre"]) and texto != self.OG_name_entry:
+        elif texto in self.model.codes_by_name and texto != self.OG_name_entry:
             self.error_label.config(text=f"🚫 '{texto}' no está permitido.")
             self.save_node_button.config(state="disabled")
         else:
@@ -0,0 +1,67 @@
+import os
+import random
+import sys
+
+import pandas as pd
+import pytest
+
+# HAMMON es un único módulo dentro de su carpeta; se importa sin abrir la ventana de Tk
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "HAMMON"))
+
+import HAMMON  # noqa: E402
+
+# Columnas principales de un CSV de HAMMON
+CSV_COLUMNS = ["Nombre", "Hijos", "Equivalencias", "Hecho", "Tipo", "Fase", "Descripcion"]
+
+
+def csv_frame(rows):
+    """DataFrame como el de un CSV cargado: una fila por tupla con los valores de CSV_COLUMNS."""
+    return pd.DataFrame(rows, columns=CSV_COLUMNS).fillna("").astype(str)
+
+
+def model_from_rows(rows):
+    """Modelo creado como al cargar un CSV: el código de cada unidad es su 'Nombre'."""
+    df = csv_frame(rows)
+    df.insert(0, "Codigo", df["Nombre"])
+    return HAMMON.StratigraphicModel.from_dataframe(df)
+
+
+@pytest.fixture
+def model():
+    # UE1 cubre a UE2 y UE3, que son equivalentes; ambas cubren a UE4. H1 agrupa a UE2 y UE3
+    return model_from_rows([
+        ("UE1", "UE2,UE3", "", "", "P", "I", "Nivel superficial"),
+        ("UE2", "UE4", "UE3", "", "P", "II", "Relleno"),
+        ("UE3", "UE4", "UE2", "", "N", "II", "Corte"),
+        ("UE4", "", "", "", "P", "III", "Suelo"),
+        ("H1", "", "", "UE2,UE3", "H", "II", "Fosa"),
+    ])
+
+
+def random_dag(seed, n, m):
+    """Hasta 'm' aristas sin ciclos entre los nodos 0..n-1, numerados en un orden aleatorio."""
+    rng = random.Random(seed)
+    edges = {(u, v) for u, v in (sorted(rng.sample(range(n), 2)) for _ in range(m))}
+    permutation = list(range(n))
+    rng.shuffle(permutation)
+    return [(permutation[u], permutation[v]) for u, v in sorted(edges)]
+
+
+def random_model(seed, n=30, m=45, equivalences=6):
+    """Modelo con 'n' unidades, relaciones sin ciclos y algunas equivalencias entre unidades sueltas."""
+    rng = random.Random(seed)
+    names = [f"UE{i}" for i in range(n)]
+    model = model_from_rows([(name, "", "", "", "P", "I", "") for name in names])
+    for u, v in random_dag(seed, n, m):
+        model.add_child(names[u], names[v])
+    for _ in range(equivalences):
+        node_A, node_B = rng.sample(names, 2)
+        if not (model.children[node_A] or model.parents[node_A] or model.children[node_B] or model.parents[node_B]):
+            model.add_equivalence(node_A, node_B)
+    return model, names, rng
+
+
+def search_cycle(model, origin, destination):
+    """Mismo criterio que 'GraphApp.search_cycle', sobre los arrays del modelo."""
+    arrays = model.arrays()
+    return arrays.reaches_through_equivalents(arrays.ids[destination], arrays.ids[origin])
@@ -0,0 +1,93 @@
+import HAMMON
+
+from conftest import csv_frame
+
+
+def check(rows):
+    return HAMMON.FileChecker(csv_frame(rows)).check()
+
+
+def rules(errors):
+    return {(rule, unit) for rule, unit, _, _ in errors}
+
+
+def test_valid_file():
+    assert check([
+        ("UE1", "UE2,UE3", "", "", "P", "I", ""),
+        ("UE2", "UE4", "UE3", "", "P", "II", ""),
+        ("UE3", "UE4", "UE2", "", "N", "II", ""),
+        ("UE4", "", "", "", "P", "III", ""),
+        ("H1", "", "", "UE2,UE3", "H", "II", ""),
+    ]) == []
+
+
+def test_names_and_references():
+    errors = check([
+        ("UE1", "UE9", "", "", "P", "I", ""),
+        ("UE1", "", "", "", "P", "I", ""),
+        ("UE,2", "", "", "", "P", "I", ""),
+        ("", "", "", "", "P", "I", ""),
+    ])
+    assert rules(errors) == {
+        ("Valor de 'Hijos' que no está en 'Nombre'", "UE1"),
+        ("'Nombre' duplicado", "UE1"),
+        ("'Nombre' con ',' o ';'", "UE,2"),
+        ("Fila sin 'Nombre'", ""),
+    }
+    unknown = [error for error in errors if error[0].startswith("Valor de")]
+    assert unknown == [("Valor de 'Hijos' que no está en 'Nombre'", "UE1", 0, "UE9")]
+
+
+def test_cycles_and_repeated_values():
+    errors = check([
+        ("UE1", "UE2", "", "", "P", "I", ""),
+        ("UE2", "UE3", "", "", "P", "I", ""),
+        ("UE3", "UE1,UE3", "", "", "P", "I", ""),
+    ])
+    assert ("Valor repetido en 'Nombre', 'Hijos', 'Equivalencias' o 'Hecho'", "UE3") in rules(errors)
+    cycles = [error for error in errors if error[0] == "Ciclo padre-hijo"]
+    assert len(cycles) == 1
+    assert set(cycles[0][3].split(" -> ")) == {"UE1", "UE2", "UE3"}
+
+
+def test_equivalences():
+    errors = check([
+        ("UE1", "UE2", "", "", "P", "I", ""),
+        ("UE2", "", "UE3", "", "P", "I", ""),
+        ("UE3", "UE4", "", "", "P", "I", ""),
+        ("UE4", "", "", "", "P", "I", ""),
+    ])
+    assert rules(errors) == {
+        ("Equivalencia no bidireccional", "UE2"),
+        ("Equivalentes con distintos padres", "UE2"),
+        ("Equivalentes con distintos hijos", "UE2"),
+    }
+
+
+def test_facts_and_types():
+    errors = check([
+        ("UE1", "H1", "", "", "P", "I", ""),
+        ("UE2", "", "", "H1", "P", "I", ""),
+        ("UE3", "", "", "", "X", "I", ""),
+        ("UE4", "", "", "", "", "I", ""),
+        ("H1", "UE2", "", "UE3", "H", "I", ""),
+        ("H2", "", "", "UE3", "H", "I", ""),
+    ])
+    assert rules(errors) - {("Ciclo padre-hijo", "UE2"), ("Ciclo padre-hijo", "H1")} == {
+        ("Nodo 'H' en 'Hijos' o 'Equivalencias'", "UE1"),
+        ("Nodo 'P' o 'N' con valores en 'Hecho'", "UE2"),
+        ("'Tipo' distinto de 'P', 'N' o 'H'", "UE3"),
+        ("Fila sin 'Tipo'", "UE4"),
+        ("Nodo 'H' con valores en 'Hijos' o 'Equivalencias'", "H1"),
+        ("Unidad en más de un 'Hecho'", "H2"),
+    }
+    # El ciclo H1 -> UE2 -> H1 se anota una vez, en una cualquiera de sus unidades
+    assert {unit for rule, unit, _, _ in errors if rule == "Ciclo padre-hijo"} <= {"UE2", "H1"}
+    assert len([error for error in errors if error[0] == "Ciclo padre-hijo"]) == 1
+
+
+def test_check_columns():
+    df = csv_frame([])
+    assert HAMMON.FileChecker.check_columns(df) is None
+    assert HAMMON.FileChecker.check_columns(df.drop(columns="Fase")) is not None
+    assert HAMMON.FileChecker.check_columns(df.assign(Codigo="")) is not None
@@ -0,0 +1,78 @@
+import pytest
+
+import HAMMON
+
+
+def snapshot(model):
+    return model.to_dataframe().to_dict("list")
+
+
+def edit(history, model, *operations):
+    """Una edición del usuario con las operaciones indicadas."""
+    history.begin(model)
+    for method, args in operations:
+        getattr(model, method)(*args)
+    history.end(model)
+
+
+EDITS = [
+    [("add_unit", ("UE5", {"Nombre": "UE5", "Tipo": "P", "Fase": "III"})), ("add_child", ("UE4", "UE5"))],
+    [("set_attribute", ("UE1", "Fase", "0")), ("remove_child", ("UE1", "UE3"))],
+    [("rename_unit", ("UE2", "UE20"))],
+    [("remove_equivalence", ("UE3", "UE20")), ("remove_unit", ("UE3",))],
+    [("add_equivalence", ("UE4", "UE5")), ("add_member", ("H1", "UE4"))],
+]
+
+
+@pytest.mark.parametrize("checkpoint_every", [None, 1, 2])
+def test_undo_redo_restores_every_state(model, checkpoint_every):
+    history = HAMMON.EditHistory(checkpoint_every=checkpoint_every)
+    states = [snapshot(model)]
+    for operations in EDITS:
+        edit(history, model, *operations)
+        states.append(snapshot(model))
+
+    for state in reversed(states[:-1]):
+        model = history.undo(model)
+        assert snapshot(model) == state
+    assert not history.undo_stack
+
+    for state in states[1:]:
+        model = history.redo(model)
+        assert snapshot(model) == state
+    assert not history.redo_stack
+
+
+def test_undo_with_checkpoint_returns_copy(model):
+    history = HAMMON.EditHistory(checkpoint_every=1)
+    before = snapshot(model)
+    edit(history, model, ("remove_unit", ("UE4",)))
+    restored = history.undo(model)
+    assert restored is not model
+    assert snapshot(restored) == before
+
+
+def test_end_detaches_recorder(model):
+    history = HAMMON.EditHistory()
+    edit(history, model, ("set_attribute", ("UE1", "Fase", "0")))
+    model.set_attribute("UE1", "Fase", "1")
+    assert model.recorder is None
+    assert len(history.undo_stack[-1].operations) == 1
+
+
+def test_new_edit_clears_redo(model):
+    history = HAMMON.EditHistory()
+    edit(history, model, ("set_attribute", ("UE1", "Fase", "0")))
+    model = history.undo(model)
+    assert history.redo_stack
+    edit(history, model, ("set_attribute", ("UE1", "Fase", "1")))
+    assert not history.redo_stack
+
+
+def test_trim_keeps_last_edit(model):
+    history = HAMMON.EditHistory(max_bytes=1)
+    for phase in ("A", "B", "C"):
+        edit(history, model, ("set_attribute", ("UE1", "Fase", phase)))
+    assert len(history.undo_stack) == 1
+    model = history.undo(model)
+    assert model.get("UE1", "Fase") == "B"
@@ -0,0 +1,157 @@
+import pandas as pd
+import pytest
+
+import HAMMON
+
+from conftest import csv_frame, model_from_rows
+
+
+class Scheduler:
+    """Sustituto de la ventana de Tk: solo guarda las llamadas programadas con 'after'."""
+
+    def __init__(self):
+        self.pending = {}
+
+    def after(self, ms, func):
+        ident = len(self.pending)
+        self.pending[ident] = func
+        return ident
+
+    def after_cancel(self, ident):
+        self.pending.pop(ident, None)
+
+
+ROWS = [
+    ("UE1", "UE2", "", "", "P", "I", "Nivel"),
+    ("UE2", "", "", "", "P", "II", "Relleno"),
+    ("UE3", "", "", "", "P", "II", "Relleno"),
+]
+
+
+def saved_csv(tmp_path):
+    path = str(tmp_path / "matriz.csv")
+    csv_frame(ROWS).to_csv(path, index=False)
+    return path
+
+
+def edit_model(model):
+    model.add_unit("UE4", {"Nombre": "UE4", "Tipo": "N", "Fase": "III", "Descripcion": "Zanja «norte»"})
+    model.add_child("UE2", "UE4")
+    model.add_equivalence("UE2", "UE3")
+    model.set_attribute("UE1", "Fase", "0")
+    model.remove_child("UE1", "UE2")
+    model.rename_unit("UE3", "UE30")
+
+
+def test_write_read_replay(tmp_path):
+    path = saved_csv(tmp_path)
+    model = model_from_rows(ROWS)
+    journal = HAMMON.EditJournal(path, Scheduler())
+    journal.start()
+    model.journal = journal
+    edit_model(model)
+    journal.close()
+
+    operations = HAMMON.EditJournal.read(path)
+    assert len(operations) == journal.entries
+    replayed = HAMMON.EditJournal.replay(model_from_rows(ROWS), operations)
+    assert replayed.to_dataframe().equals(model.to_dataframe())
+
+
+def test_replay_load_entry(tmp_path):
+    path = saved_csv(tmp_path)
+    model = model_from_rows(ROWS)
+    model.add_child("UE1", "UE3")
+    journal = HAMMON.EditJournal(path, Scheduler())
+    journal.start()
+    journal.write_model(model)
+    journal.close()
+
+    replayed = HAMMON.EditJournal.replay(model_from_rows(ROWS), HAMMON.EditJournal.read(path))
+    assert replayed.to_dataframe().equals(model.to_dataframe())
+
+
+def test_torn_last_line_is_dropped(tmp_path):
+    path = saved_csv(tmp_path)
+    model = model_from_rows(ROWS)
+    journal = HAMMON.EditJournal(path, Scheduler())
+    journal.start()
+    model.journal = journal
+    model.add_child("UE1", "UE3")
+    model.set_attribute("UE2", "Fase", "0")
+    journal.close()
+    with open(journal.path, "a", encoding="utf-8") as file:
+        file.write('{"op": "remove_unit", "args": ["UE')
+
+    assert HAMMON.EditJournal.read(path) == [("add_child", ["UE1", "UE3", None]),
+                                              ("set_attribute", ["UE2", "Fase", "0"])]
+
+
+def test_other_csv_version_is_ignored(tmp_path):
+    path = saved_csv(tmp_path)
+    journal = HAMMON.EditJournal(path, Scheduler())
+    journal.start()
+    journal.write(("set_attribute", ("UE1", "Fase", "0")))
+    journal.close()
+    with open(path, "a", encoding="utf-8") as file:
+        file.write("UE9,,,,P,I,Nueva\n")
+
+    assert HAMMON.EditJournal.read(path) is None
+
+
+def test_missing_journal(tmp_path):
+    assert HAMMON.EditJournal.read(saved_csv(tmp_path)) is None
+
+
+def test_close_remove(tmp_path):
+    path = saved_csv(tmp_path)
+    journal = HAMMON.EditJournal(path, Scheduler())
+    journal.start()
+    journal.close(remove=True)
+    assert HAMMON.EditJournal.read(path) is None
+
+
+class Rows:
+    """Pestaña de relaciones con las filas indicadas, como la lee 'download_filtered_csv'."""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def get_children(self):
+        return tuple(range(len(self.rows)))
+
+    def item(self, item, option):
+        return self.rows[item]
+
+
+def test_filtered_export_keeps_journal(tmp_path, monkeypatch):
+    path = saved_csv(tmp_path)
+    subset = str(tmp_path / "filtrado.csv")
+    monkeypatch.setattr(HAMMON.filedialog, "asksaveasfilename", lambda **options: subset)
+    monkeypatch.setattr(HAMMON.messagebox, "showinfo", lambda *args: None)
+    monkeypatch.setattr(HAMMON.messagebox, "showerror", lambda title, message: pytest.fail(message))
+
+    # Lo mínimo de la aplicación que usa la exportación filtrada: el filtro solo deja ver UE1 -> UE2
+    app = HAMMON.GraphApp.__new__(HAMMON.GraphApp)
+    app.model = model_from_rows(ROWS)
+    app.uploaded_file = path
+    app.journal = HAMMON.EditJournal(path, Scheduler())
+    app.journal.start()
+    app.model.journal = app.journal
+    app.relations_tab_tree = Rows([("UE1", "UE2")])
+    app.equivalences_tab_tree = Rows([])
+    app.relations_index = HAMMON.EdgeTabIndex()
+    app.relations_index.keys.add(app.edge_key("UE1", "UE2"))
+    app.equivalences_index = HAMMON.EdgeTabIndex()
+    app.outermost_visible_fact = {}
+
+    app.model.add_child("UE2", "UE3")
+    app.download_filtered_csv()
+    # Las ediciones siguientes tocan unidades que no están en el subconjunto
+    edit_model(app.model)
+    app.journal.close()
+
+    assert set(pd.read_csv(subset, sep=";", encoding="utf-8-sig")["Nombre"]) == {"UE1", "UE2"}
+    assert HAMMON.EditJournal.read(subset) is None
+    replayed = HAMMON.EditJournal.replay(model_from_rows(ROWS), HAMMON.EditJournal.read(path))
+    assert replayed.to_dataframe().equals(app.model.to_dataframe())
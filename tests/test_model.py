@@ -0,0 +1,42 @@
+import random
+
+import pytest
+
+import HAMMON
+
+from conftest import model_from_rows
+
+
+def units(n):
+    rows = [(f"UE{i}", f"UE{i + 1}" if i + 1 < n else "", "", "", "P", "I", "") for i in range(n)]
+    return model_from_rows(rows)
+
+
+def assert_row_index(model):
+    assert model.row_index == {code: i for i, code in enumerate(model.order)}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_remove_units_and_undo(seed):
+    rng = random.Random(seed)
+    model = units(60)
+    before = model.to_dataframe().to_dict("list")
+    history = HAMMON.EditHistory()
+    history.begin(model)
+    model.remove_units(rng.sample(model.order, 20))
+    history.end(model)
+    assert len(model) == 40
+    assert_row_index(model)
+
+    model = history.undo(model)
+    assert_row_index(model)
+    assert model.to_dataframe().to_dict("list") == before
+
+
+def test_add_unit_at_position():
+    model = units(5)
+    model.add_unit("UE9", {"Nombre": "UE9", "Tipo": "P"}, position=2)
+    assert model.order[:4] == ["UE0", "UE1", "UE9", "UE2"]
+    assert_row_index(model)
+    model.remove_unit("UE1")
+    assert_row_index(model)
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+import HAMMON
+
+
+def test_round_trip(tmp_path, model):
+    model.set_attribute("UE4", "Descripcion", "Suelo de opus signinum, ñ y «comillas»")
+    # Una equivalencia indicada solo en uno de sus lados también se conserva
+    model.equivalents["UE4"]["UE1"] = None
+    settings = {"node_color": "#ff0000", "phases": ["I", "II"]}
+    path = str(tmp_path / ("proyecto" + HAMMON.ProjectFile.EXTENSION))
+
+    HAMMON.ProjectFile.save(path, model, settings)
+    loaded, loaded_settings = HAMMON.ProjectFile.load(path)
+
+    assert loaded.to_dataframe().equals(model.to_dataframe())
+    assert loaded.order == model.order
+    assert loaded.equivalents == model.equivalents
+    assert loaded.member_of == model.member_of
+    assert loaded_settings == settings
+
+
+def test_round_trip_empty_model(tmp_path, model):
+    for code in list(model.order):
+        model.remove_unit(code)
+    path = str(tmp_path / "vacio.hammon")
+    HAMMON.ProjectFile.save(path, model)
+    loaded, settings = HAMMON.ProjectFile.load(path)
+    assert len(loaded) == 0
+    assert list(loaded.columns) == list(model.columns)
+    assert settings == {}
+
+
+def test_newer_version_is_rejected(tmp_path, model):
+    path = str(tmp_path / "nuevo.hammon")
+    HAMMON.ProjectFile.save(path, model)
+    with np.load(path) as data:
+        arrays = dict(data)
+    arrays["version"] = np.array(HAMMON.ProjectFile.VERSION + 1)
+    with open(path, "wb") as file:
+        np.savez(file, **arrays)
+    with pytest.raises(ValueError):
+        HAMMON.ProjectFile.load(path)
@@ -0,0 +1,41 @@
+import pytest
+
+import HAMMON
+
+from conftest import random_model, search_cycle
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_creates_cycle_matches_search_cycle(seed):
+    model, names, rng = random_model(seed)
+    for step in range(150):
+        origin, destination = rng.choice(names), rng.choice(names)
+        expected = search_cycle(model, origin, destination)
+        assert model.reachability().creates_cycle(origin, destination) == expected
+        # Las relaciones nuevas se añaden al índice; quitar una lo rehace en la siguiente consulta
+        if not expected:
+            model.add_child(origin, destination)
+        if step % 10 == 0:
+            parent = rng.choice([code for code in names if model.children[code]])
+            model.remove_child(parent, next(iter(model.children[parent])))
+        if step % 25 == 0:
+            node_A, node_B = rng.sample(names, 2)
+            if not (search_cycle(model, node_A, node_B) or search_cycle(model, node_B, node_A)):
+                model.add_equivalence(node_A, node_B)
+                if not model.topology().valid:
+                    model.remove_equivalence(node_A, node_B)
+
+
+def test_queries(model):
+    index = model.reachability()
+    assert index.is_above("UE1", "UE4")
+    assert not index.is_above("UE4", "UE1")
+    assert not index.is_above("UE1", "UE1")
+    assert index.are_above(["UE1", "UE2", "UE4"], ["UE3", "UE4", "UE2"]).tolist() == [True, True, False]
+    assert sorted(index.descendants("UE1")) == ["UE2", "UE3", "UE4"]
+    assert sorted(index.ancestors("UE4")) == ["UE1", "UE2", "UE3"]
+
+
+def test_large_models_have_no_index(monkeypatch, model):
+    monkeypatch.setattr(HAMMON.ReachabilityIndex, "MAX_UNITS", 2)
+    assert model.reachability() is None
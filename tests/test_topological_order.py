@@ -0,0 +1,38 @@
+import pytest
+
+from conftest import model_from_rows, random_model, search_cycle
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_creates_cycle_matches_search_cycle(seed):
+    model, names, rng = random_model(seed)
+    for step in range(150):
+        origin, destination = rng.choice(names), rng.choice(names)
+        expected = search_cycle(model, origin, destination)
+        assert model.topology().creates_cycle(origin, destination) == expected
+        # El modelo cambia como en la aplicación: relaciones nuevas, quitadas y equivalencias
+        if not expected:
+            model.add_child(origin, destination)
+        if step % 10 == 0:
+            parent = rng.choice([code for code in names if model.children[code]])
+            model.remove_child(parent, next(iter(model.children[parent])))
+        if step % 25 == 0:
+            node_A, node_B = rng.sample(names, 2)
+            if not (search_cycle(model, node_A, node_B) or search_cycle(model, node_B, node_A)):
+                model.add_equivalence(node_A, node_B)
+                if not model.topology().valid:
+                    model.remove_equivalence(node_A, node_B)
+
+
+def test_rename_and_remove(model):
+    model.rename_unit("UE4", "UE40")
+    topology = model.topology()
+    assert topology.creates_cycle("UE40", "UE1")
+    assert not topology.creates_cycle("UE1", "UE40")
+    model.remove_unit("UE2")
+    assert model.topology().creates_cycle("UE40", "UE1")
+
+
+def test_cycle_in_model():
+    model = model_from_rows([("UE1", "UE2", "", "", "P", "I", ""), ("UE2", "UE1", "", "", "P", "I", "")])
+    assert model.topology().creates_cycle("UE1", "UE2") is None
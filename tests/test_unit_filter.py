@@ -0,0 +1,43 @@
+import pandas as pd
+import pytest
+
+import HAMMON
+
+BD = pd.DataFrame({
+    "Nombre": ["UE1", "UE10", "ue2", "Muro", "Zanja", "Pozo", "UE 3"],
+    "Tipo": ["P", "N", "P", "P", "N", "P", "P"],
+    "Fase": ["Romana", "romana", "Medieval", "Época moderna", "EPOCA MODERNA", "", "Ibérica"],
+    "Descripcion": ["Nivel de tierra", "Corte", "Relleno, con cerámica", "Muro de sillares",
+                    "Zanja de cimentación", "Pozo", "Suelo"],
+})
+
+FILTERS = ["", "ue1", "UE1", "romana", "Romana", "epoca", "Época", "época moderna", "ue1, muro",
+           "cerámica", "ceramica", "relleno, con", "ue", "nada", "ue 3", ",", "iberica"]
+
+
+@pytest.mark.parametrize("filtro", FILTERS)
+@pytest.mark.parametrize("match_case", [False, True])
+@pytest.mark.parametrize("full_words", [False, True])
+@pytest.mark.parametrize("diacritics", [False, True])
+def test_mask_matches_passes(filtro, match_case, full_words, diacritics):
+    columns = ["Nombre", "Fase", "Descripcion"]
+    unit_filter = HAMMON.UnitFilter(filtro, columns, match_case, full_words, diacritics)
+    expected = [unit_filter.passes(row) for _, row in BD.iterrows()]
+    assert unit_filter.mask(BD, HAMMON.NormalizedColumns()).tolist() == expected
+
+
+def test_normalized_columns_follow_version():
+    normalized = HAMMON.NormalizedColumns()
+    normalized.sync(1)
+    unit_filter = HAMMON.UnitFilter("pozo", ["Nombre"])
+    assert unit_filter.mask(BD, normalized).sum() == 1
+
+    renamed = BD.assign(Nombre=BD["Nombre"].replace("Pozo", "Silo"))
+    normalized.sync(2)
+    assert unit_filter.mask(renamed, normalized).sum() == 0
+
+
+def test_normalize():
+    assert HAMMON.UnitFilter.normalize("  Época ") == "epoca"
+    assert HAMMON.UnitFilter.normalize("Época", match_case=True) == "Epoca"
+    assert HAMMON.UnitFilter.normalize("Época", diacritics=True) == "época"